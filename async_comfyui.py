@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+asyncio facade over ComfyUIClient
+Blocking HTTP and completion waits run on a bounded thread pool so submission,
+monitoring and output handling can overlap inside one event loop
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from comfyui_client import ComfyUIClient, PromptRejected
+
+
+class AsyncComfyUIClient:
+    """submit / watch / fetch_outputs / interrupt as coroutines"""
+
+    def __init__(self, client: ComfyUIClient, max_workers: int = 8):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="comfyui")
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call on the client thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def submit(self, workflow: Dict) -> Optional[str]:
+        """Queue a workflow; returns prompt_id or None when the server is unreachable
+
+        Raises PromptRejected when the server refuses the workflow itself.
+        """
+        try:
+            return await self.run_blocking(self.client.queue_prompt, workflow)
+        except PromptRejected:
+            raise
+        except Exception as e:
+            print(f"Failed to send prompt: {e}")
+            return None
+
+    async def watch(self, prompt_id: str, timeout: float) -> Dict:
+        """Wait for completion; returns {'status': success|error|timeout, 'outputs', 'error'}"""
+        return await self.run_blocking(self.client.wait_for_completion, prompt_id, timeout)
+
+    async def fetch_outputs(self, prompt_id: str, result: Dict = None) -> List[Dict]:
+        """Output image refs for a finished prompt, read from its /history entry
+
+        Falls back to the outputs reported on the event stream when the history
+        request fails or has none.
+        """
+        try:
+            entry = await self.run_blocking(self.client.get_history, prompt_id)
+        except Exception as e:
+            print(f"⚠️ History lookup failed for {prompt_id}: {e}")
+            entry = None
+        images = ComfyUIClient.output_images((entry or {}).get("outputs", {}))
+        return images or ComfyUIClient.output_images((result or {}).get("outputs"))
+
+    async def interrupt(self) -> bool:
+        try:
+            return await self.run_blocking(self.client.interrupt)
+        except Exception as e:
+            print(f"⚠️ Interrupt failed: {e}")
+            return False
+
+    async def queue_size(self) -> int:
+        return await self.run_blocking(self.client.get_queue_size)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Dispatch jobs across several ComfyUI backends
+Health checks via /system_stats, throughput-weighted assignment and
+per-backend utilization reporting
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, List
+
+from async_comfyui import AsyncComfyUIClient
+from comfyui_client import ComfyUIClient
+
+
+class Backend:
+    """One ComfyUI server plus the bookkeeping the dispatcher needs"""
+
+    def __init__(self, client: ComfyUIClient, max_workers: int = 8):
+        self.client = client
+        self.url = client.server_url
+        self.async_client = AsyncComfyUIClient(client, max_workers=max_workers)
+        self.healthy = True
+        self.in_flight = 0
+        self.last_watch = None
+        self.completed = 0
+        self.failed = 0
+        self.moved_off = 0
+        self.busy_time = 0.0
+        # Workflow nodes of finished prompts and how many of them ComfyUI served from its cache
+        self.prompt_nodes = 0
+        self.cached_nodes = 0
+        # Exponential moving average of seconds per image; None until measured
+        self.avg_duration = None
+        # Prompts whose outputs were collected, oldest first, not yet pruned from /history
+        self.harvested = deque()
+        self.history_pruned = 0
+
+    def record_completion(self, duration: float, success: bool, alpha: float = 0.3,
+                          nodes: int = 0, cached: int = 0):
+        self.prompt_nodes += nodes
+        self.cached_nodes += cached
+        if success:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self.busy_time += duration
+        if self.avg_duration is None:
+            self.avg_duration = duration
+        else:
+            self.avg_duration = alpha * duration + (1 - alpha) * self.avg_duration
+
+
+class BackendDispatcher:
+    """Pick the backend expected to finish the next job first"""
+
+    def __init__(self, clients: List[ComfyUIClient], queue_depth: int = 1, health_interval: float = 15):
+        self.queue_depth = max(1, queue_depth)
+        self.health_interval = health_interval
+        self.backends = [Backend(client, max_workers=self.queue_depth + 4) for client in clients]
+        self.started_at = time.time()
+        # DRAIN/ABORT when the last run was stopped by a signal, else None
+        self.stop_mode = None
+        # UtilizationSampler of the last run when sampling was enabled
+        self.sampler = None
+
+    def healthy_backends(self) -> List[Backend]:
+        return [backend for backend in self.backends if backend.healthy]
+
+    def _expected_duration(self, backend: Backend) -> float:
+        if backend.avg_duration is not None:
+            return backend.avg_duration
+        # Unmeasured backends are assumed as fast as the average measured one
+        measured = [b.avg_duration for b in self.backends if b.avg_duration is not None]
+        return sum(measured) / len(measured) if measured else 1.0
+
+    def candidates(self) -> List[Backend]:
+        """Healthy backends with a free slot, best expected completion time first"""
+        free = [b for b in self.healthy_backends() if b.in_flight < self.queue_depth]
+        return sorted(free, key=lambda b: (b.in_flight + 1) * self._expected_duration(b))
+
+    async def check_health(self) -> List[Backend]:
+        """Probe every backend; returns the ones that just died"""
+        results = await asyncio.gather(*[
+            backend.async_client.run_blocking(backend.client.is_alive) for backend in self.backends
+        ])
+        died = []
+        for backend, alive in zip(self.backends, results):
+            if backend.healthy and not alive:
+                backend.healthy = False
+                backend.client.cancel_waits()
+                died.append(backend)
+                print(f"⚠️ Backend down: {backend.url} ({backend.in_flight} in-flight jobs will be moved)")
+            elif not backend.healthy and alive:
+                backend.client.reset()
+                backend.healthy = True
+                print(f"✅ Backend back online: {backend.url}")
+        return died
+
+    async def monitor(self):
+        """Background health checks for the duration of a run"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    def utilization(self) -> List[Dict]:
+        wall_time = max(time.time() - self.started_at, 1e-6)
+        return [
+            {
+                "url": b.url,
+                "healthy": b.healthy,
+                "completed": b.completed,
+                "failed": b.failed,
+                "moved_off": b.moved_off,
+                "history_pruned": b.history_pruned,
+                "busy_seconds": round(b.busy_time, 1),
+                "prompt_nodes": b.prompt_nodes,
+                "cached_nodes": b.cached_nodes,
+                "utilization": min(1.0, b.busy_time / wall_time),
+                "avg_seconds_per_image": b.avg_duration
+            }
+            for b in self.backends
+        ]
+
+    def print_utilization(self):
+        print("\n🖥️ Backend utilization:")
+        for row in self.utilization():
+            state = "up" if row["healthy"] else "down"
+            avg = f"{row['avg_seconds_per_image']:.1f}s/image" if row["avg_seconds_per_image"] else "n/a"
+            print(f"   {row['url']} [{state}]: {row['completed']} done, {row['failed']} failed, "
+                  f"{row['moved_off']} moved off, busy {row['utilization'] * 100:.0f}%, {avg}, "
+                  f"{row['history_pruned']} history entries pruned")
+            if row["prompt_nodes"]:
+                print(f"      node cache: {row['cached_nodes']}/{row['prompt_nodes']} nodes reused "
+                      f"({row['cached_nodes'] / row['prompt_nodes'] * 100:.0f}%)")
+        if self.sampler is not None:
+            self.sampler.print_report()
+
+    def close(self):
+        for backend in self.backends:
+            backend.async_client.close()
@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+Pipelined batch orchestration for ComfyUI
+Submission, completion tracking and output handling run as concurrent asyncio
+tasks; up to queue_depth prompts stay enqueued on every backend so the GPUs
+never wait on the client
+"""
+
+import asyncio
+import contextlib
+import os
+import signal
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from backend_dispatcher import Backend, BackendDispatcher
+from comfyui_client import ComfyUIClient, PromptRejected
+from job_ledger import JobLedger, with_seed, workflow_seed
+from output_cache import OutputCache, deterministic_seed
+from progress import BatchProgress
+from run_metrics import RunMetrics
+from utilization_sampler import UtilizationSampler
+from workflow_validation import validate_workflow
+
+# Stop modes: finish in-flight work, or also remove/interrupt our prompts on ComfyUI
+DRAIN = "drain"
+ABORT = "abort"
+
+
+class AsyncBatchOrchestrator:
+    """Run a lazily produced stream of jobs with bounded in-flight work
+
+    A job is a dict with a 'workflow' key. The orchestrator adds 'prompt_id',
+    'backend', 'status', 'error', 'images', 'detected_at' (wall-clock time the
+    completion was noticed) and 'timings' (seconds per phase, see
+    run_metrics.PHASES) to it before on_result(job, success)
+    fires; on_start(job) fires when ComfyUI is expected to begin executing it
+    (the previous prompt on its backend finished). Only queue_depth jobs per backend (plus those waiting for output
+    handling) are held in memory at a time, so the job iterable can be
+    arbitrarily long. Jobs on a backend that dies are resubmitted elsewhere.
+
+    request_stop() ends submission early; jobs that are stopped before
+    finishing are reported with status 'cancelled'.
+
+    An output handler that rejects a render as defective (returns False and
+    sets job['defect']) gets the job re-queued with a new deterministic seed,
+    up to defect_retries times; after that it is reported with status
+    'defective'. job['defects'] lists every rejection.
+
+    Once a job's outputs are handled its /history entry is deleted on the
+    server, prune_batch entries at a time, keeping the newest keep_history
+    (None keeps everything).
+    """
+
+    def __init__(self, dispatcher: BackendDispatcher, timeout: float = 300,
+                 output_workers: int = 2, output_handler: Callable[[Dict], bool] = None,
+                 backpressure_interval: float = 2, max_attempts: int = 3,
+                 keep_history: Optional[int] = 0, prune_batch: int = 8, defect_retries: int = 0):
+        self.dispatcher = dispatcher
+        self.queue_depth = dispatcher.queue_depth
+        self.timeout = timeout
+        self.output_workers = max(1, output_workers)
+        self.output_handler = output_handler
+        self.backpressure_interval = backpressure_interval
+        self.max_attempts = max_attempts
+        self.keep_history = keep_history
+        self.prune_batch = max(1, prune_batch)
+        self.defect_retries = defect_retries
+        # Set once every backend stayed down past the timeout; later jobs fail fast
+        self.gave_up = False
+        # None while running, DRAIN or ABORT once a stop was requested
+        self.stop_mode = None
+        self.capacity = None
+        # prompt_id -> Backend for every submitted job still being watched
+        self.prompts = {}
+        self.stop_task = None
+
+    def requeue(self, job: Dict):
+        """Prepare a job with a rejected render for another run with a new seed"""
+        seed = deterministic_seed(workflow_seed(job['workflow']), "requeue")
+        print(f"🔁 Re-queueing {job['prompt_id']} ({job['defects'][-1]}) with seed {seed}")
+        job['workflow'] = with_seed(job['workflow'], seed)
+        if 'seed' in job:
+            job['seed'] = seed
+        # The replacement render is saved under the names of the first one
+        job.setdefault('canonical_images', job.get('images'))
+        # Backend losses count per render
+        job['attempts'] = 0
+        job.pop('files', None)
+
+    def request_stop(self, mode: str = DRAIN):
+        """Submit nothing new; ABORT also cancels our prompts queued or running on ComfyUI
+
+        Must be called on the event loop thread (signal handlers use call_soon_threadsafe).
+        """
+        if self.stop_mode in (mode, ABORT):
+            return
+        self.stop_mode = mode
+        if self.capacity is not None:
+            self.capacity.set()
+        if mode == DRAIN:
+            print(f"\n🛑 Stopping: no new jobs, waiting for {len(self.prompts)} in-flight "
+                  f"(press Ctrl-C again to cancel them)")
+        else:
+            print(f"\n🛑 Aborting: cancelling {len(self.prompts)} prompts on ComfyUI")
+            self.stop_task = asyncio.ensure_future(self.cancel_prompts())
+
+    async def cancel_prompts(self):
+        """Delete our pending prompts, interrupt ours if it is executing, release every wait"""
+        for backend in self.dispatcher.backends:
+            prompt_ids = [prompt_id for prompt_id, owner in self.prompts.items() if owner is backend]
+            if not prompt_ids:
+                continue
+            client = backend.client
+            try:
+                # Pending ones first, otherwise the interrupt just starts the next of ours
+                await backend.async_client.run_blocking(client.delete_queued, prompt_ids)
+                running = await backend.async_client.run_blocking(client.get_running_prompt_ids)
+                if running & set(prompt_ids):
+                    await backend.async_client.interrupt()
+            except Exception as e:
+                print(f"⚠️ Could not cancel prompts on {backend.url}: {e}")
+            client.cancel_waits()
+
+    async def prune_history(self, backend: Backend, prompt_id: str = None, flush: bool = False):
+        """Delete harvested prompts from the server's /history beyond the newest keep_history"""
+        if self.keep_history is None:
+            return
+        if prompt_id:
+            backend.harvested.append(prompt_id)
+        excess = len(backend.harvested) - self.keep_history
+        if excess <= 0 or (excess < self.prune_batch and not flush):
+            return
+        prompt_ids = [backend.harvested.popleft() for _ in range(excess)]
+        try:
+            if await backend.async_client.run_blocking(backend.client.delete_history, prompt_ids):
+                backend.history_pruned += len(prompt_ids)
+        except Exception as e:
+            print(f"⚠️ History pruning failed ({backend.url}): {e}")
+
+    async def server_has_room(self, backend: Backend) -> bool:
+        """Backpressure check against /queue (includes other clients' prompts)"""
+        if backend.in_flight == 0:
+            return True
+        try:
+            return await backend.async_client.queue_size() < self.queue_depth
+        except Exception as e:
+            print(f"⚠️ Queue check failed ({backend.url}): {e}")
+            return True
+
+    async def acquire_backend(self, capacity: asyncio.Event) -> Optional[Backend]:
+        """Wait for a healthy backend with a free slot; None once every backend stayed down past the timeout"""
+        loop = asyncio.get_running_loop()
+        all_down_since = None
+
+        while True:
+            if self.stop_mode:
+                return None
+            for backend in self.dispatcher.candidates():
+                if await self.server_has_room(backend):
+                    backend.in_flight += 1
+                    return backend
+
+            if self.dispatcher.healthy_backends():
+                all_down_since = None
+                self.gave_up = False
+            else:
+                if self.gave_up:
+                    return None
+                all_down_since = all_down_since or loop.time()
+                if loop.time() - all_down_since > self.timeout:
+                    print("❌ No ComfyUI backend reachable, failing remaining jobs")
+                    self.gave_up = True
+                    return None
+                await self.dispatcher.check_health()
+
+            capacity.clear()
+            try:
+                await asyncio.wait_for(capacity.wait(), self.backpressure_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, jobs: Iterable[Dict],
+                  on_submit: Callable[[Dict, str], None] = None,
+                  on_result: Callable[[Dict, bool], None] = None,
+                  on_start: Callable[[Dict], None] = None):
+        loop = asyncio.get_running_loop()
+        capacity = self.capacity = asyncio.Event()
+        outputs = asyncio.Queue(maxsize=self.queue_depth * len(self.dispatcher.backends))
+        retry = deque()
+        watchers = set()
+        # Jobs between completion and the end of output handling, which may re-queue them
+        handling = set()
+        settled = asyncio.Event()
+
+        def report(job: Dict, success: bool):
+            job.pop('workflow', None)
+            if 'created_at' in job:
+                job['timings']['total'] = time.time() - job['created_at']
+            if on_result:
+                on_result(job, success)
+
+        def release(backend: Backend):
+            backend.in_flight -= 1
+            capacity.set()
+
+        def record_execution(job: Dict, result: Dict):
+            # Server and client clocks may differ slightly: never report negative phases
+            timings, started, finished = job['timings'], result.get('started'), result.get('finished')
+            if started:
+                timings['queue_wait'] = max(0.0, started - job['submitted_at'])
+            if started and finished:
+                timings['execution'] = max(0.0, finished - started)
+            if finished:
+                timings['detection'] = max(0.0, job['detected_at'] - finished)
+
+        def cancel(job: Dict):
+            job['status'] = 'cancelled'
+            job['error'] = f"batch stopped ({self.stop_mode})"
+            report(job, False)
+
+        async def watch(job: Dict, backend: Backend, previous: Optional[asyncio.Task]):
+            # ComfyUI runs prompts FIFO: start the timeout once the previous prompt is done
+            if previous is not None:
+                await asyncio.wait([previous])
+            if on_start:
+                on_start(job)
+            started = loop.time()
+            result = await backend.async_client.watch(job['prompt_id'], self.timeout)
+            job['detected_at'] = time.time()
+            self.prompts.pop(job['prompt_id'], None)
+            record_execution(job, result)
+
+            if self.stop_mode == ABORT and result['status'] != 'success':
+                release(backend)
+                cancel(job)
+                return
+
+            if result['status'] == 'cancelled':
+                # Backend declared dead: move the job to another one
+                backend.moved_off += 1
+                release(backend)
+                if self.stop_mode:
+                    cancel(job)
+                elif job['attempts'] < self.max_attempts:
+                    print(f"♻️ Moving {job['prompt_id']} off {backend.url}")
+                    retry.append(job)
+                else:
+                    job['status'] = 'error'
+                    job['error'] = f"backend lost {job['attempts']} times"
+                    report(job, False)
+                return
+
+            job['cached_nodes'] = len(result.get('cached_nodes') or [])
+            backend.record_completion(loop.time() - started, result['status'] == 'success',
+                                      nodes=len(job.get('workflow') or {}), cached=job['cached_nodes'])
+            # The slot frees once output handling has room, so a slow output
+            # stage throttles submission instead of piling up finished jobs
+            handling.add(id(job))
+            await outputs.put((job, backend, result))
+            release(backend)
+
+        async def submit_all():
+            job_iter = iter(jobs)
+            exhausted = False
+
+            while True:
+                if retry and self.stop_mode:
+                    # Handed back by a dead backend after the stop: do not resubmit
+                    cancel(retry.popleft())
+                    continue
+                if retry:
+                    job = retry.popleft()
+                elif not exhausted and not self.stop_mode:
+                    job = next(job_iter, None)
+                    if job is None:
+                        exhausted = True
+                        continue
+                    job['attempts'] = 0
+                    job['timings'] = {}
+                elif watchers or handling:
+                    # Wait for in-flight work; a dying backend may hand jobs back and
+                    # output handling may re-queue defective renders
+                    settled.clear()
+                    waiter = asyncio.create_task(settled.wait())
+                    await asyncio.wait(set(watchers) | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    continue
+                else:
+                    break
+
+                backend = await self.acquire_backend(capacity)
+                if backend is None and self.stop_mode:
+                    # Jobs never submitted in this run are simply left for the next one
+                    if job['attempts']:
+                        cancel(job)
+                    continue
+                if backend is None:
+                    job['status'] = 'error'
+                    job['error'] = 'no healthy backend'
+                    report(job, False)
+                    continue
+
+                job['attempts'] += 1
+                submit_started = time.time()
+                job.setdefault('created_at', submit_started)
+                try:
+                    prompt_id = await backend.async_client.submit(job['workflow'])
+                except PromptRejected as e:
+                    # The workflow itself is broken: no point retrying elsewhere
+                    release(backend)
+                    job['status'] = 'invalid'
+                    job['error'] = str(e)
+                    report(job, False)
+                    continue
+                if not prompt_id:
+                    release(backend)
+                    # A connection failure means the backend may be gone: retry elsewhere
+                    await self.dispatcher.check_health()
+                    if job['attempts'] < self.max_attempts and not backend.healthy:
+                        retry.append(job)
+                        continue
+                    job['status'] = 'error'
+                    job['error'] = 'submit failed'
+                    report(job, False)
+                    continue
+
+                job['prompt_id'] = prompt_id
+                job['backend'] = backend.url
+                job['submitted_at'] = time.time()
+                job['timings']['submit'] = job['submitted_at'] - submit_started
+                self.prompts[prompt_id] = backend
+                if self.stop_mode == ABORT:
+                    # The abort arrived while this prompt was being queued
+                    await self.cancel_prompts()
+                    self.prompts.pop(prompt_id, None)
+                    release(backend)
+                    cancel(job)
+                    continue
+                if on_submit:
+                    on_submit(job, prompt_id)
+                task = asyncio.create_task(watch(job, backend, backend.last_watch))
+                backend.last_watch = task
+                watchers.add(task)
+                task.add_done_callback(watchers.discard)
+
+            for _ in range(self.output_workers):
+                await outputs.put(None)
+
+        async def handle_outputs():
+            while True:
+                item = await outputs.get()
+                if item is None:
+                    return
+                job, backend, result = item
+                job['status'] = result['status']
+                job['error'] = result.get('error')
+                success = result['status'] == 'success'
+                if success:
+                    output_started = time.time()
+                    job['images'] = await backend.async_client.fetch_outputs(job['prompt_id'], result)
+                    handler_started = time.time()
+                    if self.output_handler:
+                        try:
+                            success = bool(await backend.async_client.run_blocking(self.output_handler, job))
+                        except Exception as e:
+                            print(f"⚠️ Output handling failed: {e}")
+                            job['error'] = f"output handling failed: {e}"
+                            success = False
+                    # Output handlers record their own share of downloading in timings['download']
+                    downloaded = job['timings'].get('download', 0.0)
+                    job['timings']['download'] = handler_started - output_started + downloaded
+                    job['timings']['postprocess'] = max(0.0, time.time() - handler_started - downloaded)
+                if not success and job.get('defect'):
+                    job.setdefault('defects', []).append(job.pop('defect'))
+                    if len(job['defects']) <= self.defect_retries and not self.stop_mode:
+                        self.requeue(job)
+                        retry.append(job)
+                        await self.prune_history(backend, job['prompt_id'])
+                        handling.discard(id(job))
+                        settled.set()
+                        continue
+                    job['status'] = 'defective'
+                report(job, success)
+                handling.discard(id(job))
+                settled.set()
+                if result['status'] in ('success', 'error'):
+                    await self.prune_history(backend, job['prompt_id'])
+
+        monitor = asyncio.create_task(self.dispatcher.monitor())
+        try:
+            await asyncio.gather(submit_all(), *[handle_outputs() for _ in range(self.output_workers)])
+            for backend in self.dispatcher.backends:
+                await self.prune_history(backend, flush=True)
+        finally:
+            monitor.cancel()
+            if self.stop_mode == ABORT:
+                # Waits were released for good; later runs need fresh clients
+                for backend in self.dispatcher.backends:
+                    backend.client.reset()
+            self.dispatcher.stop_mode = self.stop_mode
+
+
+@contextlib.contextmanager
+def _stop_on_signals(orchestrator: AsyncBatchOrchestrator, mode: str):
+    """Turn SIGINT/SIGTERM into orchestrator.request_stop(mode)
+
+    A second signal escalates to ABORT; after that the previous handlers are
+    back, so a third Ctrl-C interrupts the process as usual.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    loop = asyncio.get_running_loop()
+    signals = [signal.SIGINT] + ([signal.SIGTERM] if hasattr(signal, "SIGTERM") else [])
+    previous = {signum: signal.getsignal(signum) for signum in signals}
+    received = 0
+
+    def restore():
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+    def handle(signum, frame):
+        nonlocal received
+        received += 1
+        loop.call_soon_threadsafe(orchestrator.request_stop, mode if received == 1 else ABORT)
+        if received > 1:
+            restore()
+
+    for signum in signals:
+        signal.signal(signum, handle)
+    try:
+        yield
+    finally:
+        restore()
+
+
+def run_batch(clients: Union[ComfyUIClient, List[ComfyUIClient]], jobs: Iterable[Dict],
+              queue_depth: int = 1, timeout: float = 300,
+              on_submit: Callable[[Dict, str], None] = None,
+              on_result: Callable[[Dict, bool], None] = None,
+              output_handler: Callable[[Dict], bool] = None,
+              ledger: JobLedger = None, resume: bool = False,
+              retry_failed: bool = False, cache: OutputCache = None,
+              output_dir: str = None, download_workers: int = 4,
+              validate: bool = True, on_interrupt: str = DRAIN,
+              keep_history: Optional[int] = 0, metrics: RunMetrics = None,
+              progress: BatchProgress = None, sample_interval: float = 5,
+              quality_gate: Callable[[Dict, List[str]], Optional[str]] = None,
+              defect_retries: int = 2) -> BackendDispatcher:
+    """Synchronous entry point used by the generator CLIs
+
+    With a ledger, jobs must carry 'ledger_key' = (config, region, city, weather);
+    their states are recorded and resume/retry_failed skip finished work.
+    With a cache, jobs whose workflow was rendered before are served from disk
+    (job['cached'] = True) and new renders are downloaded into the cache.
+    output_handler(job) post-processes a job's outputs in a worker thread
+    (cache hits: once they are copied to output_dir); returning False fails it.
+    quality_gate(job, paths) checks every downloaded render (needs a cache or
+    output_dir) and returns a defect description to reject it: rejected
+    renders are not cached and are re-queued with a new seed up to
+    defect_retries times, then fail with status 'defective'. A replacement
+    render is renamed to the file names of the first one (ComfyUI counts up).
+    With an output_dir, images are streamed from /view to
+    output_dir/<subfolder>/<filename> while later jobs keep rendering;
+    job['files'] lists the local paths.
+    With validate, workflows are checked against the first healthy backend's
+    /object_info and invalid ones fail (status 'invalid') without being queued.
+    Ctrl-C/SIGTERM stops the run in on_interrupt mode (DRAIN: finish in-flight
+    jobs; ABORT: delete our queued prompts and interrupt the running one), a
+    second signal aborts. Every submitted job is still reported (stopped ones
+    as 'cancelled') and dispatcher.stop_mode tells the caller the run ended early.
+    Harvested prompts are pruned from the server's /history except the newest
+    keep_history per backend (None disables pruning).
+    With metrics, every job's submission, start and phase timings are logged;
+    with progress, submissions and results feed its ETA and status line.
+    From the first submission on, every sample_interval seconds (0 disables) each
+    backend's /system_stats and /queue are sampled into dispatcher.sampler (and the
+    metrics event log) for the idle time and utilization timeline in print_utilization().
+    """
+    if isinstance(clients, ComfyUIClient):
+        clients = [clients]
+    dispatcher = BackendDispatcher(clients, queue_depth=queue_depth)
+    on_start = None
+
+    if ledger is not None:
+        jobs = ledger.select(jobs, resume=resume, retry_failed=retry_failed)
+        user_submit, user_result = on_submit, on_result
+
+        def on_submit(job: Dict, prompt_id: str):
+            ledger.mark_queued(job)
+            if user_submit:
+                user_submit(job, prompt_id)
+
+        def ledger_start(job: Dict):
+            ledger.mark_running(job)
+
+        on_start = ledger_start
+
+        def on_result(job: Dict, success: bool):
+            ledger.mark_finished(job, success)
+            if user_result:
+                user_result(job, success)
+
+    if metrics is not None:
+        metric_submit, metric_start, metric_result = on_submit, on_start, on_result
+
+        def on_submit(job: Dict, prompt_id: str):
+            metrics.job_submitted(job)
+            if metric_submit:
+                metric_submit(job, prompt_id)
+
+        def metrics_start(job: Dict):
+            metrics.job_started(job)
+            if metric_start:
+                metric_start(job)
+
+        on_start = metrics_start
+
+        def on_result(job: Dict, success: bool):
+            metrics.job_finished(job, success)
+            if metric_result:
+                metric_result(job, success)
+
+    if progress is not None:
+        progress_submit, progress_result = on_submit, on_result
+
+        def on_submit(job: Dict, prompt_id: str):
+            progress.job_submitted(job)
+            if progress_submit:
+                progress_submit(job, prompt_id)
+
+        def on_result(job: Dict, success: bool):
+            if ledger is not None:
+                progress.skipped = ledger.skipped
+            progress.job_finished(job, success)
+            if progress_result:
+                progress_result(job, success)
+
+    if cache is not None:
+        jobs = _serve_cached(cache, jobs, output_dir, on_result, output_handler)
+
+    if cache is not None or output_dir:
+        clients_by_url = {client.server_url: client for client in clients}
+        # Without an output tree the cache still needs the files on disk
+        download_dir = output_dir or os.path.join(cache.root, "staging")
+        user_handler = output_handler
+
+        def output_handler(job: Dict) -> bool:
+            client = clients_by_url[job['backend']]
+            started = time.time()
+            files = client.download_outputs(job['images'], download_dir)
+            job['timings']['download'] = time.time() - started
+            defect = quality_gate(job, [f['path'] for f in files]) if quality_gate and files else None
+            if defect:
+                job['defect'] = defect
+                job['error'] = f"defective output: {defect}"
+                if not output_dir:
+                    for f in files:
+                        if os.path.exists(f['path']):
+                            os.remove(f['path'])
+                return False
+            if job.get('canonical_images'):
+                files = _canonical_names(files, job['canonical_images'])
+            if cache is not None and files:
+                cache.store(job['cache_key'], files)
+            if output_dir:
+                job['files'] = [f['path'] for f in files]
+            else:
+                for f in files:
+                    os.remove(f['path'])
+            return user_handler(job) if user_handler else True
+
+    async def main():
+        await dispatcher.check_health()
+        orchestrator = AsyncBatchOrchestrator(dispatcher, timeout=timeout, output_handler=output_handler,
+                                              output_workers=download_workers, keep_history=keep_history,
+                                              defect_retries=defect_retries if quality_gate else 0)
+        run_jobs = jobs
+        if not dispatcher.healthy_backends():
+            print("❌ No ComfyUI backend reachable")
+            orchestrator.gave_up = True
+        elif validate:
+            backend = dispatcher.healthy_backends()[0]
+            try:
+                object_info = await backend.async_client.run_blocking(backend.client.get_object_info)
+                run_jobs = _validated(object_info, jobs, on_result)
+            except Exception as e:
+                print(f"⚠️ Workflow validation skipped, /object_info unavailable: {e}")
+        sampling = None
+        if sample_interval and dispatcher.healthy_backends():
+            dispatcher.sampler = UtilizationSampler(dispatcher, interval=sample_interval, metrics=metrics)
+            sampling = asyncio.create_task(dispatcher.sampler.run())
+
+        def sampled_submit(job: Dict, prompt_id: str):
+            dispatcher.sampler.job_submitted()
+            if on_submit:
+                on_submit(job, prompt_id)
+
+        try:
+            with _stop_on_signals(orchestrator, on_interrupt):
+                await orchestrator.run(run_jobs, on_submit=sampled_submit if sampling else on_submit,
+                                       on_result=on_result, on_start=on_start)
+        finally:
+            if sampling is not None:
+                sampling.cancel()
+                await asyncio.gather(sampling, return_exceptions=True)
+                if dispatcher.sampler.started.is_set():
+                    # One last reading so the timeline covers the end of the run
+                    await dispatcher.sampler.sample_all()
+                    dispatcher.sampler.close_gaps()
+
+    try:
+        asyncio.run(main())
+    finally:
+        dispatcher.close()
+    return dispatcher
+
+
+def _canonical_names(files: List[Dict], canonical: List[Dict]) -> List[Dict]:
+    """Rename downloaded files of a re-queued render to the file names of its first render"""
+    renamed = []
+    for f, image in zip(files, canonical):
+        if f['filename'] != image['filename']:
+            path = os.path.join(os.path.dirname(f['path']), image['filename'])
+            os.replace(f['path'], path)
+            f = {**f, 'filename': image['filename'], 'path': path}
+        renamed.append(f)
+    return renamed + files[len(canonical):]
+
+
+def _serve_cached(cache: OutputCache, jobs: Iterable[Dict], output_dir: Optional[str],
+                  on_result: Optional[Callable[[Dict, bool], None]],
+                  output_handler: Callable[[Dict], bool] = None) -> Iterable[Dict]:
+    """Report cache hits straight away and pass the misses on for rendering"""
+    for job in jobs:
+        job['cache_key'] = cache.key_for(job['workflow'])
+        images = cache.lookup(job['cache_key'])
+        if images is None:
+            yield job
+            continue
+        job['cached'] = True
+        job['status'] = 'success'
+        job['images'] = images
+        success = True
+        if output_dir:
+            job['files'] = cache.materialize(images, output_dir)
+            if output_handler:
+                try:
+                    success = bool(output_handler(job))
+                except Exception as e:
+                    print(f"⚠️ Output handling failed: {e}")
+                    job['status'] = 'error'
+                    job['error'] = f"output handling failed: {e}"
+                    success = False
+        job.pop('workflow', None)
+        if on_result:
+            on_result(job, success)
+
+
+def _validated(object_info: Dict, jobs: Iterable[Dict],
+               on_result: Optional[Callable[[Dict, bool], None]]) -> Iterable[Dict]:
+    """Fail jobs whose workflow the server cannot run; pass the rest on"""
+    reported = set()
+    for job in jobs:
+        errors = validate_workflow(job['workflow'], object_info)
+        if not errors:
+            yield job
+            continue
+        job['status'] = 'invalid'
+        job['error'] = "; ".join(errors)
+        # Every job of a batch usually shares the same broken node, say it once
+        new_errors = [error for error in errors if error not in reported]
+        if new_errors:
+            print("❌ Workflow rejected before queueing:")
+            for error in new_errors:
+                print(f"   - {error}")
+            reported.update(new_errors)
+        job.pop('workflow', None)
+        if on_result:
+            on_result(job, False)
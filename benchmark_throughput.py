@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+End-to-end orchestration throughput benchmark
+Runs generator workloads through run_batch against the fake ComfyUI server with
+a fixed render time, so everything above the render time is orchestration
+overhead. Results go to a JSON file and are compared against a stored
+baseline to flag regressions. The mixed scenarios send the same city + cloud
+jobs interleaved and in job_scheduler's reuse order and count the nodes the
+server served from its cache; regional_split_prompt renders the city jobs with
+separately encoded landmark and weather prompts to measure the text-encode
+time saved per city (--encode-time).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cloud_generator"))
+
+from batch_pipeline import run_batch
+from comfyui_client import ComfyUIClient
+from fake_comfyui import FakeComfyUIServer
+from job_scheduler import reuse_order
+from regional_batch_generator import RegionalBatchGenerator
+import regional_fallback_generator
+from run_metrics import percentile
+from single_cloud_generator import CLOUD_STYLES, SingleCloudGenerator
+
+SCENARIOS = {
+    "regional_sequential": {"kind": "regional", "queue_depth": 1},
+    "regional_pipelined": {"kind": "regional", "queue_depth": 3},
+    "regional_split_prompt": {"kind": "regional", "queue_depth": 1, "split_prompt": True},
+    "fallback_pipelined": {"kind": "fallback", "queue_depth": 2},
+    "clouds_pipelined": {"kind": "cloud", "queue_depth": 2},
+    "mixed_interleaved": {"kind": "mixed", "queue_depth": 2},
+    "mixed_reuse_order": {"kind": "mixed", "queue_depth": 2, "reuse_order": True}
+}
+
+# metric: (higher is better, absolute slack ignored when comparing)
+# The millisecond metrics are a few ms each, where scheduler noise on a busy
+# machine easily doubles them, so their slack is wide and only a real jump counts
+METRICS = {
+    "images_per_hour": (True, 0),
+    "efficiency": (True, 0.02),
+    "idle_gap_mean_ms": (False, 30),
+    "submit_ms": (False, 30),
+    "polling_ms_per_image": (False, 30),
+    "detection_p50_ms": (False, 30),
+    "detection_p95_ms": (False, 50),
+    "node_cache_hit_rate": (True, 0.02),
+    "encode_seconds_per_city": (False, 0.05)
+}
+
+# Settings that change what the metrics measure: results are only comparable when they match
+COMPARABLE_SETTINGS = ("render_time", "images", "model_load_time", "encode_time")
+
+# Roughly what a T5 + CLIP encode of the long city prompts costs on a mid-range
+# GPU; with 0 the split-prompt scenario would have no encode time to save
+DEFAULT_ENCODE_TIME = 0.2
+
+
+def build_jobs(kind: str, count: int, server_url: str, split_prompt: bool = False) -> List[Dict]:
+    """count jobs built by the generators' own job builders"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    jobs = []
+    if kind == "regional":
+        with open(os.path.join(base_dir, "global_cities_config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        generator = RegionalBatchGenerator(server_url, ledger_path=None, cache_dir=None, split_prompt=split_prompt)
+        pairs = ((city, weather) for region in config["regions"].values()
+                 for city in region["cities"] for weather in config["weather_conditions"])
+        for city, weather in pairs:
+            jobs.append(generator.build_city_job(city, weather))
+            if len(jobs) == count:
+                break
+    elif kind == "fallback":
+        config = regional_fallback_generator.load_config(os.path.join(base_dir, "regional_fallback_config.json"))
+        pairs = ((region, weather) for region in config["regional_fallbacks"].values()
+                 for weather in config["weather_conditions"])
+        for region, weather in pairs:
+            jobs.append(regional_fallback_generator.build_fallback_job(config, region, weather))
+            if len(jobs) == count:
+                break
+    elif kind == "mixed":
+        # City and cloud jobs alternating, the worst case for the node cache
+        cities = build_jobs("regional", count - count // 2, server_url)
+        clouds = build_jobs("cloud", count // 2, server_url)
+        for index, city in enumerate(cities):
+            jobs.append(city)
+            if index < len(clouds):
+                jobs.append(clouds[index])
+    else:
+        for index in range(count):
+            generator = SingleCloudGenerator(server_url, cache_dir=None, seed_salt=str(index))
+            jobs.append(generator.build_cloud_job(CLOUD_STYLES[index % len(CLOUD_STYLES)]))
+    return jobs
+
+
+def run_scenario(spec: Dict, render_time: float, images: int, load_time: float = 0.0,
+                 encode_time: float = DEFAULT_ENCODE_TIME) -> Dict:
+    with FakeComfyUIServer(latency=f"fixed:{render_time}", load_time=load_time, encode_time=encode_time) as server, \
+            tempfile.TemporaryDirectory() as output_dir:
+        client = ComfyUIClient(server.url, "throughput_benchmark")
+        jobs = build_jobs(spec["kind"], images, server.url, spec.get("split_prompt", False))
+        cities = len({job['city']['name'] for job in jobs if 'city' in job})
+        if spec.get("reuse_order"):
+            jobs = reuse_order(jobs)
+        finished = []
+
+        started = time.time()
+        # No utilization sampling: its /queue polls would count as completion polling
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_batch([client], jobs, queue_depth=spec["queue_depth"], output_dir=output_dir,
+                      on_result=lambda job, success: finished.append((job, success)), sample_interval=0)
+        wall = time.time() - started
+        client.close()
+
+        timeline = sorted(server.timeline, key=lambda entry: entry["started"])
+        ended = {entry["prompt_id"]: entry["finished"] for entry in timeline}
+        gaps = [nxt["started"] - prev["finished"] for prev, nxt in zip(timeline, timeline[1:])]
+        detection = [job["detected_at"] - ended[job["prompt_id"]]
+                     for job, _ in finished if job.get("prompt_id") in ended and "detected_at" in job]
+
+        endpoints = client.stats()["endpoints"]
+        completed = sum(1 for _, success in finished if success)
+        polling_ms = sum(endpoints.get(name, {}).get("total_ms", 0) for name in ("GET /history", "GET /queue"))
+        polling_requests = sum(endpoints.get(name, {}).get("requests", 0) for name in ("GET /history", "GET /queue"))
+        images_per_hour = completed / wall * 3600 if wall else 0.0
+        nodes = server.stats["cached_nodes"] + server.stats["executed_nodes"]
+
+        return {
+            "images": completed,
+            "failed": len(finished) - completed,
+            "wall_seconds": round(wall, 3),
+            "images_per_hour": round(images_per_hour, 1),
+            "efficiency": round(images_per_hour / (3600 / render_time), 4),
+            "startup_ms": round((timeline[0]["started"] - started) * 1000, 1) if timeline else 0.0,
+            "idle_gap_mean_ms": round(sum(gaps) / len(gaps) * 1000, 1) if gaps else 0.0,
+            "idle_gap_max_ms": round(max(gaps) * 1000, 1) if gaps else 0.0,
+            "submit_ms": round(endpoints.get("POST /prompt", {}).get("avg_ms", 0.0), 2),
+            "polling_requests_per_image": round(polling_requests / completed, 2) if completed else 0.0,
+            "polling_ms_per_image": round(polling_ms / completed, 2) if completed else 0.0,
+            "download_ms_per_image": round(endpoints.get("GET /view", {}).get("avg_ms", 0.0), 2),
+            "detection_p50_ms": round(percentile(detection, 50) * 1000, 1),
+            "detection_p95_ms": round(percentile(detection, 95) * 1000, 1),
+            "node_cache_hit_rate": round(server.stats["cached_nodes"] / nodes, 4) if nodes else 0.0,
+            "cache_miss_seconds": round(server.stats["miss_seconds"], 2),
+            **({"encode_seconds_per_city": round(server.stats["encode_seconds"] / cities, 3)} if cities else {})
+        }
+
+
+def setting_mismatches(results: Dict, baseline: Dict) -> List[str]:
+    """Benchmark settings that differ between results and baseline"""
+    meta, reference = results["meta"], baseline.get("meta", {})
+    return [f"{setting}: {reference.get(setting)} (baseline) vs {meta[setting]}"
+            for setting in COMPARABLE_SETTINGS if reference.get(setting) != meta[setting]]
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of results against baseline beyond tolerance (relative) plus each metric's slack"""
+    regressions = []
+    for name, metrics in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference:
+            continue
+        for metric, (higher_is_better, slack) in METRICS.items():
+            if metric not in reference or metric not in metrics:
+                continue
+            old, new = reference[metric], metrics[metric]
+            if higher_is_better:
+                regressed = new < old * (1 - tolerance) - slack
+            else:
+                regressed = new > old * (1 + tolerance) + slack
+            if regressed:
+                regressions.append(f"{name}.{metric}: {old} -> {new}")
+    return regressions
+
+
+def print_results(results: Dict):
+    for name, metrics in results["scenarios"].items():
+        print(f"\n📊 {name}: {metrics['images']} images in {metrics['wall_seconds']:.1f}s")
+        print(f"   Throughput: {metrics['images_per_hour']:.0f} images/hour ({metrics['efficiency'] * 100:.1f}% of GPU-bound)")
+        print(f"   Idle gap: mean {metrics['idle_gap_mean_ms']:.1f} ms, max {metrics['idle_gap_max_ms']:.1f} ms "
+              f"(startup {metrics['startup_ms']:.0f} ms)")
+        print(f"   Submission: {metrics['submit_ms']:.1f} ms/prompt | Polling: {metrics['polling_requests_per_image']:.1f} "
+              f"requests, {metrics['polling_ms_per_image']:.1f} ms per image | Download: {metrics['download_ms_per_image']:.1f} ms")
+        print(f"   Completion detection: p50 {metrics['detection_p50_ms']:.1f} ms, p95 {metrics['detection_p95_ms']:.1f} ms")
+        print(f"   Node cache: {metrics['node_cache_hit_rate'] * 100:.1f}% of nodes reused, "
+              f"{metrics['cache_miss_seconds']:.1f}s spent loading/encoding")
+        if "encode_seconds_per_city" in metrics:
+            print(f"   Text encoding: {metrics['encode_seconds_per_city']:.2f}s per city")
+    joined, split = results["scenarios"].get("regional_sequential"), results["scenarios"].get("regional_split_prompt")
+    if joined and split and joined["encode_seconds_per_city"]:
+        saved = joined["encode_seconds_per_city"] - split["encode_seconds_per_city"]
+        print(f"\n✂️ Split prompt encoding saves {saved:.2f}s of text encoding per city "
+              f"({saved / joined['encode_seconds_per_city'] * 100:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark orchestration overhead against a simulated ComfyUI backend")
+    parser.add_argument("--render-time", type=float, default=0.5, help="Simulated seconds per image")
+    parser.add_argument("--images", type=int, default=12, help="Images per scenario")
+    parser.add_argument("--model-load-time", type=float, default=0.0, help="Simulated seconds per uncached model loader node")
+    parser.add_argument("--encode-time", type=float, default=DEFAULT_ENCODE_TIME,
+                        help="Simulated seconds per 100 words of uncached CLIPTextEncode text")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS), help="Scenarios to run")
+    parser.add_argument("--output", default="benchmark_results.json", help="Results JSON file")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative slack before a change counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+
+    args = parser.parse_args()
+
+    print(f"⏱️ Benchmarking {len(args.scenarios)} scenarios: {args.images} images each at {args.render_time}s/image")
+    results = {
+        "meta": {
+            "render_time": args.render_time,
+            "images": args.images,
+            "model_load_time": args.model_load_time,
+            "encode_time": args.encode_time,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "scenarios": {}
+    }
+    for name in args.scenarios:
+        print(f"▶️ {name}...")
+        results["scenarios"][name] = run_scenario(SCENARIOS[name], args.render_time, args.images,
+                                                  args.model_load_time, args.encode_time)
+
+    print_results(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"📌 Baseline updated: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ No baseline at {args.baseline} (run with --update-baseline to create one)")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    mismatches = setting_mismatches(results, baseline)
+    if mismatches:
+        print(f"\n❌ {args.baseline} was recorded with other settings, not comparing:")
+        for mismatch in mismatches:
+            print(f"   - {mismatch}")
+        print("   Run with the baseline's settings, or record a new baseline with --update-baseline")
+        sys.exit(1)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"   - {regression}")
+        sys.exit(1)
+    print(f"\n✅ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,109 +1,51 @@
-import json
-import requests
-import time
 import os
+import sys
 import argparse
 from typing import List, Dict, Tuple
 
+# Shared ComfyUI helpers live in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batch_pipeline import DRAIN, run_batch
+from comfyui_client import ComfyUIClient, parse_server_urls
+from job_scheduler import reuse_order
+from output_cache import OutputCache, deterministic_seed
+from progress import BatchProgress
+from run_metrics import RunMetrics, format_seconds
+from workflow_templates import DEFAULT_MODELS, DEFAULT_SAMPLER, compile_workflow
+
+# Clouds follow the prompt more closely than the city renders
+CLOUD_SAMPLER = {**DEFAULT_SAMPLER, "cfg": 3.5}
+CLOUD_STYLES = ["blue_sky_mountain", "sunset_cityscape", "overcast_gray", "fantasy_castle", "mystical_blue"]
+
 class SingleCloudGenerator:
-    def __init__(self, server_url: str = "http://127.0.0.1:8000"):
+    def __init__(self, server_url: str = "http://127.0.0.1:8000", cache_dir: str = ".image_cache",
+                 seed_salt: str = "", on_interrupt: str = DRAIN, keep_history: int = 0,
+                 events_log: str = "batch_events.jsonl", prom_file: str = None, progress_interval: float = 30,
+                 sample_interval: float = 5):
         self.server_url = server_url
-        self.client_id = "single_cloud_generator"
+        # server_url may list several backends (list or comma-separated)
+        self.clients = [ComfyUIClient(url, "single_cloud_generator") for url in parse_server_urls(server_url)]
+        self.cache = OutputCache(cache_dir) if cache_dir else None
+        self.seed_salt = seed_salt
+        # Ctrl-C behaviour: drain (finish in-flight) or abort (cancel our prompts on ComfyUI)
+        self.on_interrupt = on_interrupt
+        # Harvested prompts are deleted from ComfyUI's /history except the newest keep_history
+        self.keep_history = keep_history
+        # Per-job timings: JSONL event log and optional Prometheus textfile
+        self.events_log = events_log
+        self.prom_file = prom_file
+        # Seconds between progress lines when stdout is not a terminal
+        self.progress_interval = progress_interval
+        # Seconds between backend utilization samples (0 disables)
+        self.sample_interval = sample_interval
         
     def create_cloud_workflow(self, size: Tuple[int, int], positive_prompt: str, 
-                            negative_prompt: str, filename: str, seed: int = None) -> Dict:
+                            negative_prompt: str, filename: str, seed: int) -> Dict:
         """Generate single complete cloud workflow with transparent background"""
-        if seed is None:
-            seed = int(time.time() * 1000) % 1000000
-            
         width, height = size
-        
-        workflow = {
-            "39": {
-                "inputs": {
-                    "vae_name": "ae.safetensors"
-                },
-                "class_type": "VAELoader"
-            },
-            "8": {
-                "inputs": {
-                    "samples": ["31", 0],
-                    "vae": ["39", 0]
-                },
-                "class_type": "VAEDecode"
-            },
-            "27": {
-                "inputs": {
-                    "width": width,
-                    "height": height,
-                    "batch_size": 1
-                },
-                "class_type": "EmptySD3LatentImage"
-            },
-            "52": {
-                "inputs": {
-                    "model": ["38", 0],
-                    "clip": ["40", 0],
-                    "lora_name": "noc-lwply.safetensors",
-                    "strength_model": 1.0,
-                    "strength_clip": 1.0
-                },
-                "class_type": "LoraLoader"
-            },
-            "38": {
-                "inputs": {
-                    "unet_name": "flux1-krea-dev_fp8_scaled.safetensors",
-                    "weight_dtype": "default"
-                },
-                "class_type": "UNETLoader"
-            },
-            "40": {
-                "inputs": {
-                    "clip_name1": "clip_l.safetensors",
-                    "clip_name2": "t5xxl_fp16.safetensors",
-                    "type": "flux",
-                    "device": "cpu"
-                },
-                "class_type": "DualCLIPLoader"
-            },
-            "9": {
-                "inputs": {
-                    "images": ["8", 0],
-                    "filename_prefix": f"single_clouds/{filename}"
-                },
-                "class_type": "SaveImage"
-            },
-            "53": {
-                "inputs": {
-                    "clip": ["40", 0],
-                    "text": negative_prompt
-                },
-                "class_type": "CLIPTextEncode"
-            },
-            "31": {
-                "inputs": {
-                    "model": ["52", 0],
-                    "positive": ["45", 0],
-                    "negative": ["53", 0],
-                    "latent_image": ["27", 0],
-                    "seed": seed,
-                    "steps": 35,
-                    "cfg": 3.5,
-                    "sampler_name": "euler",
-                    "scheduler": "simple",
-                    "denoise": 1.0
-                },
-                "class_type": "KSampler"
-            },
-            "45": {
-                "inputs": {
-                    "clip": ["52", 1],
-                    "text": positive_prompt
-                },
-                "class_type": "CLIPTextEncode"
-            }
-        }
-        return workflow
+        template = compile_workflow(models=DEFAULT_MODELS, sampler=CLOUD_SAMPLER)
+        return template.render(positive=positive_prompt, negative=negative_prompt, seed=seed, width=width,
+                               height=height, filename_prefix=f"single_clouds/{filename}")
 
     def generate_cloud_prompts(self, image_style: str) -> Dict[str, str]:
         """Generate prompts for single complete clouds based on image style"""
@@ -149,79 +91,66 @@ class SingleCloudGenerator:
         }
         return sizes.get(image_style, (400, 300))
 
-    def queue_prompt(self, workflow: Dict) -> str:
-        """Send workflow to ComfyUI server"""
-        prompt = {
-            "prompt": workflow,
-            "client_id": self.client_id
-        }
+    def build_cloud_job(self, image_style: str) -> Dict:
+        """Build size, prompts and workflow for one cloud style"""
+        size = self.get_cloud_size(image_style)
+        prompts = self.generate_cloud_prompts(image_style)
+        filename = f"{image_style}_complete_cloud"
         
-        try:
-            response = requests.post(f"{self.server_url}/prompt", json=prompt)
-            response.raise_for_status()
-            return response.json()["prompt_id"]
-        except Exception as e:
-            print(f"Failed to send prompt: {e}")
-            return None
+        return {
+            'style': image_style,
+            'size': size,
+            'filename': filename,
+            'labels': {'kind': 'cloud', 'resolution': f"{size[0]}x{size[1]}", 'style': image_style},
+            'workflow': self.create_cloud_workflow(
+                size=size,
+                positive_prompt=prompts["positive"],
+                negative_prompt=prompts["negative"],
+                filename=filename,
+                seed=deterministic_seed(image_style, salt=self.seed_salt)
+            )
+        }
 
-    def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> bool:
-        """Wait for image generation completion"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            try:
-                response = requests.get(f"{self.server_url}/history/{prompt_id}")
-                if response.status_code == 200:
-                    history = response.json()
-                    if prompt_id in history:
-                        print(f"✅ Cloud generation completed: {prompt_id}")
-                        return True
-                
-                time.sleep(2)
-            except Exception as e:
-                print(f"Error checking status: {e}")
-                time.sleep(2)
-        
-        print(f"⏰ Timeout: {prompt_id}")
-        return False
+    def print_result(self, job: Dict, success: bool, progress: BatchProgress = None) -> bool:
+        if success and job.get('cached'):
+            message = f"✓ Complete cloud served from cache: {job['filename']}"
+        elif success:
+            message = f"✓ Successfully generated complete cloud: {job['filename']}"
+        elif job.get('status') == 'timeout':
+            message = f"⏰ Timeout: {job['filename']}"
+        elif job.get('status') == 'cancelled':
+            message = f"🛑 Cancelled: {job['filename']}"
+        else:
+            message = f"✗ Failed to generate {job['filename']} ({job.get('error')})"
+        if progress is None:
+            print(message)
+        elif success:
+            progress.note(message)
+        else:
+            progress.alert(message)
+        return success
 
-    def generate_single_cloud(self, image_style: str, output_dir: str = "single_clouds"):
+    def generate_single_cloud(self, image_style: str, output_dir: str = "."):
         """Generate one complete cloud for an image style"""
         
         print(f"Generating single complete cloud for {image_style} style...")
         
-        # Get size and prompts for this style
-        size = self.get_cloud_size(image_style)
-        prompts = self.generate_cloud_prompts(image_style)
+        job = self.build_cloud_job(image_style)
+        size = job['size']
         
-        filename = f"{image_style}_complete_cloud"
-        
-        print(f"Generating {filename} (size: {size[0]}x{size[1]})...")
+        print(f"Generating {job['filename']} (size: {size[0]}x{size[1]})...")
         print(f"Cloud will be: Complete, centered, no cropping, transparent background")
         
-        workflow = self.create_cloud_workflow(
-            size=size,
-            positive_prompt=prompts["positive"],
-            negative_prompt=prompts["negative"],
-            filename=filename
-        )
-        
-        prompt_id = self.queue_prompt(workflow)
-        if prompt_id:
-            if self.wait_for_completion(prompt_id):
-                print(f"✓ Successfully generated complete cloud: {filename}")
-                return True
-            else:
-                print(f"✗ Failed to generate {filename}")
-                return False
-        else:
-            print(f"✗ Failed to queue {filename}")
-            return False
+        results = []
+        run_batch(self.clients, [job], on_result=lambda job, success: results.append(self.print_result(job, success)),
+                  cache=self.cache, output_dir=output_dir, on_interrupt=self.on_interrupt,
+                  keep_history=self.keep_history)
+        return bool(results and results[0])
 
-    def generate_all_single_clouds(self, output_dir: str = "single_clouds"):
+    def generate_all_single_clouds(self, output_dir: str = ".", queue_depth: int = 1):
         """Generate one complete cloud for each image style"""
         
-        styles = ["blue_sky_mountain", "sunset_cityscape", "overcast_gray", "fantasy_castle", "mystical_blue"]
+        styles = CLOUD_STYLES
         success_count = 0
         
         print("=== Generating Single Complete Clouds ===")
@@ -230,38 +159,80 @@ class SingleCloudGenerator:
         print("• Fully visible (no cropping)")
         print("• Transparent background")
         print("• Optimally sized for 1024x1024 images")
-        print()
         
+        # Cloud sizes differ per style, so the ETA is planned per resolution
+        plan = {}
         for style in styles:
-            print(f"\n--- Processing {style} ---")
-            if self.generate_single_cloud(style, output_dir):
+            width, height = self.get_cloud_size(style)
+            plan[f"cloud {width}x{height}"] = plan.get(f"cloud {width}x{height}", 0) + 1
+        progress = BatchProgress(len(styles), plan=plan, parallelism=len(self.clients), interval=self.progress_interval)
+        print(f"⏱️ Estimated time: {format_seconds(progress.eta())}")
+        print()
+        
+        def on_submit(job: Dict, prompt_id: str):
+            size = job['size']
+            progress.note(f"\n--- Processing {job['style']} ({size[0]}x{size[1]}, ID: {prompt_id} @ {job['backend']}) ---")
+        
+        def on_result(job: Dict, success: bool):
+            nonlocal success_count
+            if self.print_result(job, success, progress):
                 success_count += 1
-                print(f"✅ {style}: SUCCESS")
+                progress.note(f"✅ {job['style']}: SUCCESS")
             else:
-                print(f"❌ {style}: FAILED")
-            
-            # Small delay between generations
-            time.sleep(2)
-        
-        print(f"\n=== Generation Complete ===")
+                progress.alert(f"❌ {job['style']}: FAILED")
+        
+        # Styles sharing a negative prompt run back to back so ComfyUI reuses its encoding
+        jobs = reuse_order([self.build_cloud_job(style) for style in styles])
+        metrics = RunMetrics(self.events_log, self.prom_file, job_name="single_clouds")
+        progress.start()
+        dispatcher = run_batch(self.clients, jobs, queue_depth=queue_depth, on_submit=on_submit, on_result=on_result,
+                               cache=self.cache, output_dir=output_dir,
+                               on_interrupt=self.on_interrupt, keep_history=self.keep_history, metrics=metrics,
+                               progress=progress, sample_interval=self.sample_interval)
+        progress.close()
+        metrics.close()
+        
+        if dispatcher.stop_mode:
+            print(f"\n=== Generation Stopped ({dispatcher.stop_mode}) ===")
+        else:
+            print(f"\n=== Generation Complete ===")
         print(f"Successfully generated: {success_count}/{len(styles)} clouds")
-        print(f"Output directory: {output_dir}")
+        dispatcher.print_utilization()
+        for client in self.clients:
+            client.print_stats()
+        if self.cache:
+            self.cache.print_report()
+        metrics.print_percentiles(title="Cloud timings")
+        # ComfyUI saves into a single_clouds/ subfolder, mirrored under output_dir
+        print(f"Output directory: {os.path.join(output_dir, 'single_clouds')}")
 
 def main():
     parser = argparse.ArgumentParser(description="Generate single complete clouds for low-poly images")
     parser.add_argument("--style", 
-                       choices=["blue_sky_mountain", "sunset_cityscape", "overcast_gray", "fantasy_castle", "mystical_blue", "all"],
+                       choices=CLOUD_STYLES + ["all"],
                        default="all",
                        help="Image style to generate cloud for")
-    parser.add_argument("--output", default="single_clouds", help="Output directory")
-    parser.add_argument("--server", default="http://127.0.0.1:8000", help="ComfyUI server URL")
+    parser.add_argument("--output", default=".", help="Local directory the clouds are downloaded to (<dir>/single_clouds/...)")
+    parser.add_argument("--server", nargs="+", default=["http://127.0.0.1:8000"], help="ComfyUI server URL(s); several backends share the batch")
+    parser.add_argument("--queue-depth", type=int, default=1, help="Prompts kept enqueued on ComfyUI (1 = sequential)")
+    parser.add_argument("--seed-salt", default="", help="Salt mixed into the per style seeds")
+    parser.add_argument("--no-cache", action="store_true", help="Always render, bypassing the image cache")
+    parser.add_argument("--on-interrupt", choices=["drain", "abort"], default="drain",
+                        help="Ctrl-C: drain finishes queued clouds, abort cancels them on ComfyUI")
+    parser.add_argument("--keep-history", type=int, default=0, help="Finished prompts left in ComfyUI history (older ones are pruned)")
+    parser.add_argument("--events-log", default="batch_events.jsonl", help="JSONL log of job events and per-phase timings")
+    parser.add_argument("--prom-file", help="Prometheus textfile for job timing metrics")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines when output is not a terminal")
+    parser.add_argument("--sample-interval", type=float, default=5, help="Seconds between /system_stats + /queue samples for the backend timeline (0 disables)")
     
     args = parser.parse_args()
     
-    generator = SingleCloudGenerator(args.server)
+    generator = SingleCloudGenerator(args.server, None if args.no_cache else ".image_cache", args.seed_salt,
+                                     args.on_interrupt, args.keep_history, args.events_log, args.prom_file,
+                                     args.progress_interval, args.sample_interval)
     
     if args.style == "all":
-        generator.generate_all_single_clouds(args.output)
+        generator.generate_all_single_clouds(args.output, args.queue_depth)
     else:
         generator.generate_single_cloud(args.style, args.output)
     
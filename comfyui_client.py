@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+"""
+ComfyUI client shared by the batch generators
+Pooled HTTP session with timeouts and retry/backoff, completion tracking
+over the /ws event stream with /history polling as fallback, and verified
+streaming downloads of the rendered images
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+
+def new_client_id(prefix: str) -> str:
+    """Unique client_id per run so /ws only delivers our own execution events"""
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+
+def websocket_url(server_url: str, client_id: str) -> str:
+    """Convert http(s)://host:port to ws(s)://host:port/ws?clientId=..."""
+    parsed = urlparse(server_url)
+    scheme = "wss" if parsed.scheme == "https" else "ws"
+    return f"{scheme}://{parsed.netloc}{parsed.path.rstrip('/')}/ws?clientId={client_id}"
+
+
+def event_time(data: Dict) -> float:
+    """Server timestamp (ms) of an execution event in seconds, local time when it has none"""
+    timestamp = data.get("timestamp")
+    return timestamp / 1000 if timestamp else time.time()
+
+
+def describe_execution_error(data: Dict) -> str:
+    """'<node type> <node id>: <message>' from an execution_error payload"""
+    return f"{data.get('node_type', 'node')} {data.get('node_id', '')}: {data.get('exception_message', '')}".strip()
+
+
+class CompletionListener:
+    """Collect executing/executed/execution_error events from the ComfyUI WebSocket"""
+
+    def __init__(self, server_url: str, client_id: str, connect_timeout: float = 5):
+        self.server_url = server_url
+        self.client_id = client_id
+        self.connect_timeout = connect_timeout
+        self._ws = None
+        self._thread = None
+        self._started = False
+        self._connected = False
+        self._condition = threading.Condition()
+        self._results = {}
+        self._outputs = {}
+        self._start_times = {}
+        self._cached = {}
+        self._collected = set()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def start(self) -> bool:
+        """Connect once per run; returns False when the socket is unavailable"""
+        if self._started:
+            return self._connected
+        self._started = True
+
+        if websocket is None:
+            print("⚠️ websocket-client not installed, using /history polling")
+            return False
+
+        try:
+            self._ws = websocket.create_connection(
+                websocket_url(self.server_url, self.client_id),
+                timeout=self.connect_timeout
+            )
+            self._ws.settimeout(None)
+        except Exception as e:
+            print(f"⚠️ WebSocket unavailable, using /history polling: {e}")
+            self._ws = None
+            return False
+
+        self._connected = True
+        self._thread = threading.Thread(target=self._run, name="comfyui-ws", daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self):
+        """Stop the reader thread and close the socket"""
+        ws = self._ws
+        self._ws = None
+        self._set_disconnected()
+        if ws is not None:
+            try:
+                # shutdown() skips the close handshake the blocked reader would race for
+                ws.shutdown()
+            except Exception:
+                pass
+
+    def _run(self):
+        ws = self._ws
+        while ws is not None and self._connected:
+            try:
+                message = ws.recv()
+            except Exception:
+                break
+            if not message:
+                break
+            # Binary frames are live previews, only text frames carry events
+            if isinstance(message, str):
+                try:
+                    self.handle_message(json.loads(message))
+                except ValueError:
+                    continue
+        if self._connected:
+            print("⚠️ WebSocket connection dropped, falling back to /history polling")
+        self._set_disconnected()
+
+    def _set_disconnected(self):
+        with self._condition:
+            self._connected = False
+            self._condition.notify_all()
+
+    def _finish(self, prompt_id: str, status: str, error: str = None, finished: float = None):
+        with self._condition:
+            # The first terminal event wins: ComfyUI sends executing(node=None)
+            # after execution_error as well
+            if prompt_id in self._results or prompt_id in self._collected:
+                return
+            self._results[prompt_id] = {
+                "status": status,
+                "outputs": self._outputs.pop(prompt_id, {}),
+                "error": error,
+                "started": self._start_times.pop(prompt_id, None),
+                "finished": finished or time.time(),
+                "cached_nodes": self._cached.pop(prompt_id, [])
+            }
+            self._condition.notify_all()
+
+    def handle_message(self, message: Dict):
+        """Update prompt state from one decoded event"""
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        if msg_type == "execution_start":
+            with self._condition:
+                self._start_times[prompt_id] = event_time(data)
+        elif msg_type == "execution_cached":
+            # Nodes ComfyUI reused from the previous prompt instead of executing
+            with self._condition:
+                self._cached[prompt_id] = list(data.get("nodes") or [])
+        elif msg_type == "executed":
+            with self._condition:
+                self._outputs.setdefault(prompt_id, {})[data.get("node")] = data.get("output")
+        elif msg_type == "executing":
+            # node == None marks the end of the prompt
+            if data.get("node") is None:
+                self._finish(prompt_id, "success")
+        elif msg_type == "execution_success":
+            self._finish(prompt_id, "success", finished=event_time(data))
+        elif msg_type == "execution_error":
+            self._finish(prompt_id, "error", describe_execution_error(data), event_time(data))
+        elif msg_type == "execution_interrupted":
+            self._finish(prompt_id, "error", "interrupted", event_time(data))
+
+    def wait(self, prompt_id: str, timeout: float) -> Optional[Dict]:
+        """Block until prompt_id finishes; None on timeout or when the socket is down"""
+        deadline = time.time() + timeout
+        with self._condition:
+            while prompt_id not in self._results and self._connected:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            result = self._results.pop(prompt_id, None)
+            if result is not None:
+                self._collected.add(prompt_id)
+            return result
+
+
+class PromptRejected(Exception):
+    """ComfyUI refused the workflow at /prompt (validation or node errors)"""
+
+
+def describe_node_errors(node_errors: Dict) -> str:
+    """One line per failing node from a /prompt node_errors payload"""
+    lines = []
+    for node_id, info in (node_errors or {}).items():
+        for error in info.get("errors", []):
+            detail = error.get("details") or error.get("message", "")
+            lines.append(f"node {node_id} {info.get('class_type', '')}: {detail}".strip())
+    return "; ".join(lines)
+
+
+def parse_history_entry(entry: Dict) -> Dict:
+    """Turn a /history entry into {'status': success|error, 'outputs', 'error', 'started', 'finished', 'cached_nodes'}
+
+    A history entry only means the prompt left the queue; its status tells
+    whether it actually rendered. started/finished are the server's execution
+    timestamps (seconds) when the status messages carry them.
+    """
+    status = entry.get("status") or {}
+    result = {"status": "success", "outputs": entry.get("outputs") or {}, "error": None,
+              "started": None, "finished": None, "cached_nodes": []}
+    for event, data in status.get("messages", []):
+        if event == "execution_start" and data.get("timestamp"):
+            result["started"] = data["timestamp"] / 1000
+        elif event == "execution_cached":
+            result["cached_nodes"] = list(data.get("nodes") or [])
+        elif event in ("execution_success", "execution_error", "execution_interrupted") and data.get("timestamp"):
+            result["finished"] = data["timestamp"] / 1000
+        if event == "execution_error" and result["status"] == "success":
+            result.update(status="error", error=describe_execution_error(data))
+        elif event == "execution_interrupted" and result["status"] == "success":
+            result.update(status="error", error="interrupted")
+    if status.get("status_str") == "error" and result["status"] == "success":
+        result.update(status="error", error="execution failed")
+    return result
+
+
+def wait_for_prompt(listener: Optional[CompletionListener], prompt_id: str, timeout: float,
+                    fetch_history: Callable[[str], Optional[Dict]],
+                    poll_interval: float = 2, safety_interval: float = 30,
+                    cancel_event: threading.Event = None,
+                    fetch_queue_ids: Callable[[], set] = None) -> Dict:
+    """Wait for a prompt via WebSocket events, polling /history only when the socket is down
+
+    fetch_history(prompt_id) returns the history entry or None (and may raise on errors).
+    While the socket is up, /history is still checked every safety_interval seconds
+    in case an event was missed. A prompt that is in neither /history nor
+    fetch_queue_ids() was dropped by the server and fails right away instead of
+    waiting out the timeout. Setting cancel_event ends the wait with status 'cancelled'.
+    """
+    start_time = time.time()
+    polled = False
+    cancel_event = cancel_event or threading.Event()
+
+    while time.time() - start_time < timeout:
+        if cancel_event.is_set():
+            return {"status": "cancelled", "outputs": {}, "error": "wait cancelled"}
+        remaining = timeout - (time.time() - start_time)
+
+        if listener is not None and listener.connected:
+            result = listener.wait(prompt_id, min(remaining, safety_interval))
+            if result is not None:
+                return result
+        elif polled:
+            if cancel_event.wait(min(poll_interval, remaining)):
+                continue
+
+        try:
+            entry = fetch_history(prompt_id)
+            if entry is None and fetch_queue_ids is not None and prompt_id not in fetch_queue_ids():
+                # It may have finished between the two requests
+                entry = fetch_history(prompt_id)
+                if entry is None:
+                    return {"status": "error", "outputs": {}, "error": "prompt vanished from queue and history"}
+        except Exception as e:
+            print(f"Error checking status: {e}")
+            entry = None
+        polled = True
+        if entry is not None:
+            return parse_history_entry(entry)
+
+    return {"status": "timeout", "outputs": {}, "error": None}
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_server_urls(servers) -> List[str]:
+    """Accept one URL, a comma-separated string or a list of either"""
+    if isinstance(servers, str):
+        servers = [servers]
+    urls = []
+    for entry in servers or []:
+        urls.extend(url.strip().rstrip("/") for url in entry.split(",") if url.strip())
+    return urls
+
+
+class ComfyUIClient:
+    """One pooled, keep-alive HTTP session per ComfyUI server
+
+    Transient failures (connection errors and 5xx responses) are retried with
+    jittered exponential backoff. POST /prompt is not retried after a read
+    timeout because the server may already have queued it.
+    """
+
+    RETRY_STATUS = {500, 502, 503, 504}
+
+    def __init__(self, server_url: str, client_prefix: str = "comfyui_batch",
+                 connect_timeout: float = 5, read_timeout: float = 30,
+                 max_retries: int = 3, backoff: float = 0.5, max_backoff: float = 10,
+                 pool_size: int = 10):
+        self.server_url = server_url.rstrip("/")
+        self.client_id = new_client_id(client_prefix)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.listener = CompletionListener(self.server_url, self.client_id)
+        self.cancel_event = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        # "METHOD /endpoint" -> [requests, total seconds]
+        self.endpoint_stats = {}
+        self._object_info = None
+
+    def _record(self, latency: float, retried: bool = False, failed: bool = False, endpoint: str = None):
+        with self._stats_lock:
+            if endpoint:
+                entry = self.endpoint_stats.setdefault(endpoint, [0, 0.0])
+                entry[0] += 1
+                entry[1] += latency
+            self.request_count += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if retried:
+                self.retry_count += 1
+            if failed:
+                self.error_count += 1
+
+    def _sleep_backoff(self, attempt: int):
+        # Full jitter: uniform in [0, min(max_backoff, backoff * 2^attempt)]
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt))))
+
+    def request(self, method: str, path: str, timeout=None, retry_read_timeout: bool = True,
+                **kwargs) -> requests.Response:
+        """Send one request with retry; raises the last error when retries run out"""
+        url = f"{self.server_url}{path}"
+        # Group /history/<id> style paths under their first segment
+        endpoint = f"{method} /{path.lstrip('/').split('/')[0].split('?')[0]}"
+        attempt = 0
+
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                error = e
+            except requests.Timeout as e:
+                if not retry_read_timeout:
+                    self._record(time.perf_counter() - start, failed=True, endpoint=endpoint)
+                    raise
+                error = e
+            else:
+                latency = time.perf_counter() - start
+                if response.status_code not in self.RETRY_STATUS or attempt >= self.max_retries:
+                    self._record(latency, failed=response.status_code >= 400, endpoint=endpoint)
+                    return response
+                self._record(latency, retried=True, endpoint=endpoint)
+                attempt += 1
+                self._sleep_backoff(attempt)
+                continue
+
+            if attempt >= self.max_retries:
+                self._record(time.perf_counter() - start, failed=True, endpoint=endpoint)
+                raise error
+            self._record(time.perf_counter() - start, retried=True, endpoint=endpoint)
+            attempt += 1
+            self._sleep_backoff(attempt)
+
+    def queue_prompt(self, workflow: Dict) -> str:
+        """POST /prompt and return the prompt_id"""
+        # Connect before queueing so no execution event is missed
+        self.listener.start()
+        # Template-rendered workflows are sent as their pre-serialized JSON
+        prompt = getattr(workflow, "serialized", None) or json.dumps(workflow, ensure_ascii=False)
+        body = f'{{"prompt":{prompt},"client_id":{json.dumps(self.client_id)}}}'
+        response = self.request(
+            "POST", "/prompt",
+            data=body.encode("utf-8"), headers={"Content-Type": "application/json"},
+            retry_read_timeout=False
+        )
+        if response.status_code == 400:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            error = body.get("error")
+            message = error.get("message", "invalid prompt") if isinstance(error, dict) else str(error or "invalid prompt")
+            details = describe_node_errors(body.get("node_errors"))
+            raise PromptRejected(f"{message}: {details}" if details else message)
+        response.raise_for_status()
+        body = response.json()
+        if body.get("node_errors"):
+            print(f"⚠️ Prompt queued with node errors: {describe_node_errors(body['node_errors'])}")
+        return body["prompt_id"]
+
+    def get_history(self, prompt_id: str) -> Optional[Dict]:
+        """Return the /history entry for prompt_id, or None if not finished yet"""
+        response = self.request("GET", f"/history/{prompt_id}")
+        if response.status_code == 200:
+            return response.json().get(prompt_id)
+        return None
+
+    def delete_history(self, prompt_ids: List[str]) -> bool:
+        """POST /history {"delete": [...]}: drop finished prompts from the server's history"""
+        response = self.request("POST", "/history", json={"delete": list(prompt_ids)})
+        return response.status_code == 200
+
+    def get_queue(self) -> Dict:
+        """Raw /queue payload (queue_running / queue_pending)"""
+        response = self.request("GET", "/queue")
+        response.raise_for_status()
+        return response.json()
+
+    def get_queue_prompt_ids(self) -> set:
+        """prompt_ids running or pending on the server"""
+        queue = self.get_queue()
+        return {entry[1] for entry in queue.get("queue_running", []) + queue.get("queue_pending", [])}
+
+    def get_running_prompt_ids(self) -> set:
+        """prompt_ids currently executing on the server"""
+        return {entry[1] for entry in self.get_queue().get("queue_running", [])}
+
+    def delete_queued(self, prompt_ids: List[str]) -> bool:
+        """POST /queue {"delete": [...]}: drop pending prompts (running ones need interrupt())"""
+        response = self.request("POST", "/queue", json={"delete": list(prompt_ids)})
+        return response.status_code == 200
+
+    def get_object_info(self, refresh: bool = False) -> Dict:
+        """Node catalogue from /object_info, fetched once per client"""
+        if self._object_info is None or refresh:
+            response = self.request("GET", "/object_info", timeout=(self.timeout[0], 120))
+            response.raise_for_status()
+            self._object_info = response.json()
+        return self._object_info
+
+    def get_queue_size(self) -> int:
+        """Number of prompts running or pending on the server (all clients)"""
+        queue = self.get_queue()
+        return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+
+    def interrupt(self) -> bool:
+        """POST /interrupt: stop the prompt currently executing on the server"""
+        response = self.request("POST", "/interrupt")
+        return response.status_code == 200
+
+    def download_image(self, image: Dict, target_path: str, chunk_size: int = 1024 * 1024,
+                       attempts: int = 2) -> Dict:
+        """Stream one output image ({'filename', 'subfolder', 'type'}) from /view to target_path
+
+        Chunks go to a temporary file next to the target, which replaces the target
+        only once the size matches Content-Length and the file on disk hashes to the
+        SHA-256 computed while streaming. Returns {'filename', 'subfolder', 'path', 'size', 'sha256'}.
+        """
+        params = {
+            "filename": image["filename"],
+            "subfolder": image.get("subfolder", ""),
+            "type": image.get("type", "output")
+        }
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+
+        for attempt in range(attempts):
+            tmp_path = f"{target_path}.{uuid.uuid4().hex[:8]}.part"
+            try:
+                digest = hashlib.sha256()
+                size = 0
+                with self.request("GET", "/view", params=params, stream=True) as response:
+                    response.raise_for_status()
+                    # requests decodes compressed bodies, so Content-Length only applies to identity encoding
+                    expected = None if response.headers.get("Content-Encoding") else response.headers.get("Content-Length")
+                    with open(tmp_path, "wb") as f:
+                        for chunk in response.iter_content(chunk_size):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                        f.flush()
+                        os.fsync(f.fileno())
+                if expected is not None and int(expected) != size:
+                    raise IOError(f"size mismatch for {image['filename']}: got {size}, expected {expected}")
+                if file_sha256(tmp_path) != digest.hexdigest():
+                    raise IOError(f"checksum mismatch for {image['filename']}")
+                os.replace(tmp_path, target_path)
+                return {
+                    "filename": image["filename"],
+                    "subfolder": params["subfolder"],
+                    "path": target_path,
+                    "size": size,
+                    "sha256": digest.hexdigest()
+                }
+            except (requests.RequestException, OSError):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if attempt + 1 >= attempts:
+                    raise
+
+    def download_outputs(self, images: List[Dict], output_dir: str, max_workers: int = 4) -> List[Dict]:
+        """Download images in parallel to output_dir/<subfolder>/<filename>"""
+        def download(image: Dict) -> Dict:
+            target = os.path.join(output_dir, image.get("subfolder", ""), image["filename"])
+            return self.download_image(image, target)
+
+        if len(images) <= 1:
+            return [download(image) for image in images]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(images))) as pool:
+            return list(pool.map(download, images))
+
+    def upload_image(self, path: str, filename: str = None, subfolder: str = "") -> str:
+        """POST /upload/image into the input folder (overwriting); returns the LoadImage image value"""
+        with open(path, "rb") as f:
+            data = f.read()
+        response = self.request(
+            "POST", "/upload/image",
+            files={"image": (filename or os.path.basename(path), data, "image/png")},
+            data={"subfolder": subfolder, "type": "input", "overwrite": "true"}
+        )
+        response.raise_for_status()
+        body = response.json()
+        return f"{body['subfolder']}/{body['name']}" if body.get("subfolder") else body["name"]
+
+    def system_stats(self) -> Dict:
+        response = self.request("GET", "/system_stats")
+        response.raise_for_status()
+        return response.json()
+
+    def is_alive(self) -> bool:
+        """Health check via /system_stats without retries"""
+        try:
+            response = self.session.get(f"{self.server_url}/system_stats", timeout=self.timeout[0])
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def wait_for_completion(self, prompt_id: str, timeout: float = 300) -> Dict:
+        """Wait for the prompt; returns {'status': success|error|timeout|cancelled, 'outputs', 'error'}"""
+        return wait_for_prompt(self.listener, prompt_id, timeout, self.get_history,
+                               cancel_event=self.cancel_event,
+                               fetch_queue_ids=self.get_queue_prompt_ids)
+
+    def cancel_waits(self):
+        """Release every wait_for_completion call (used when the backend is declared dead)"""
+        self.cancel_event.set()
+        self.listener.close()
+
+    def reset(self):
+        """Start over with a fresh event stream after the backend came back"""
+        self.listener.close()
+        self.listener = CompletionListener(self.server_url, self.client_id)
+        self.cancel_event = threading.Event()
+
+    @staticmethod
+    def output_images(outputs: Dict) -> List[Dict]:
+        """Flatten history/executed outputs into [{'filename', 'subfolder', 'type'}, ...]"""
+        images = []
+        for node_output in (outputs or {}).values():
+            for image in (node_output or {}).get("images", []):
+                images.append(image)
+        return images
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "requests": self.request_count,
+                "retries": self.retry_count,
+                "errors": self.error_count,
+                "avg_latency_ms": (self.total_latency / self.request_count * 1000) if self.request_count else 0.0,
+                "max_latency_ms": self.max_latency * 1000,
+                "endpoints": {
+                    name: {"requests": count, "total_ms": total * 1000, "avg_ms": total / count * 1000}
+                    for name, (count, total) in self.endpoint_stats.items()
+                }
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"🌐 HTTP {self.server_url}: {stats['requests']} requests, {stats['retries']} retries, "
+              f"{stats['errors']} errors, avg {stats['avg_latency_ms']:.0f} ms, max {stats['max_latency_ms']:.0f} ms")
+
+    def close(self):
+        self.listener.close()
+        self.session.close()
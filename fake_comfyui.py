@@ -0,0 +1,747 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a ComfyUI server (standard library only)
+Implements /prompt, /queue, /history, /view, /upload/image, /system_stats,
+/interrupt and the /ws event stream closely enough to drive the batch generators end to end
+without a GPU. Render time follows a configurable latency distribution; queue
+capacity limits, HTTP errors, execution failures, hung jobs and black or flat
+images can be injected; /view serves flat-shaded triangle PNGs sized like the
+requested latent.
+Nodes whose inputs match the previous prompt are reported as cached, like
+ComfyUI's node cache, and can be given a model-load / text-encode cost.
+"""
+
+import argparse
+import base64
+import email.parser
+import email.policy
+import hashlib
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+GIB = 1024 ** 3
+
+# Model files the fake server pretends to have (folder -> file names)
+DEFAULT_MODELS = {
+    "unet": ["flux1-krea-dev_fp8_scaled.safetensors", "flux1-dev.safetensors"],
+    "vae": ["ae.safetensors"],
+    "clip": ["clip_l.safetensors", "t5xxl_fp16.safetensors", "t5xxl_fp8_e4m3fn.safetensors"],
+    "loras": ["noc-lwply.safetensors"]
+}
+
+
+def default_object_info(models: Dict[str, List[str]] = None) -> Dict:
+    """/object_info subset covering the nodes the generators use"""
+    models = models or DEFAULT_MODELS
+    INT, FLOAT, STRING = ["INT", {}], ["FLOAT", {}], ["STRING", {"multiline": True}]
+    nodes = {
+        "UNETLoader": {"unet_name": [models["unet"]], "weight_dtype": [["default", "fp8_e4m3fn", "fp8_e5m2"]]},
+        "VAELoader": {"vae_name": [models["vae"]]},
+        "DualCLIPLoader": {"clip_name1": [models["clip"]], "clip_name2": [models["clip"]],
+                           "type": [["sdxl", "sd3", "flux", "hunyuan_video"]]},
+        "LoraLoader": {"model": ["MODEL"], "clip": ["CLIP"], "lora_name": [models["loras"]],
+                       "strength_model": FLOAT, "strength_clip": FLOAT},
+        "CLIPTextEncode": {"text": STRING, "clip": ["CLIP"]},
+        "ConditioningCombine": {"conditioning_1": ["CONDITIONING"], "conditioning_2": ["CONDITIONING"]},
+        "ConditioningConcat": {"conditioning_to": ["CONDITIONING"], "conditioning_from": ["CONDITIONING"]},
+        "EmptySD3LatentImage": {"width": INT, "height": INT, "batch_size": INT},
+        "EmptyLatentImage": {"width": INT, "height": INT, "batch_size": INT},
+        "KSampler": {"model": ["MODEL"], "seed": INT, "steps": INT, "cfg": FLOAT,
+                     "sampler_name": [["euler", "euler_ancestral", "dpmpp_2m", "dpmpp_2m_sde"]],
+                     "scheduler": [["simple", "normal", "karras", "sgm_uniform", "beta"]],
+                     "positive": ["CONDITIONING"], "negative": ["CONDITIONING"],
+                     "latent_image": ["LATENT"], "denoise": FLOAT},
+        "VAEDecode": {"samples": ["LATENT"], "vae": ["VAE"]},
+        "VAEEncode": {"pixels": ["IMAGE"], "vae": ["VAE"]},
+        # Like ComfyUI, a combo of the top-level input files (subfolders are not listed)
+        "LoadImage": {"image": [[], {"image_upload": True}]},
+        "SaveImage": {"images": ["IMAGE"], "filename_prefix": ["STRING", {"default": "ComfyUI"}]}
+    }
+    optional = {"DualCLIPLoader": {"device": [["default", "cpu"]]}}
+    return {
+        name: {"input": {"required": inputs, "optional": optional.get(name, {})},
+               "name": name, "display_name": name, "category": "fake"}
+        for name, inputs in nodes.items()
+    }
+
+
+def node_signatures(workflow: Dict) -> Dict[str, str]:
+    """node id -> hash of its class, literal inputs and the signatures of its upstream nodes
+
+    Two nodes with the same signature would produce the same output, which is
+    what ComfyUI's cache relies on to skip them in the next prompt.
+    """
+    signatures = {}
+
+    def signature(node_id: str) -> str:
+        if node_id in signatures:
+            return signatures[node_id]
+        node = workflow.get(node_id, {})
+        inputs = {}
+        for name, value in sorted(node.get("inputs", {}).items()):
+            # Links are [upstream node id, output index]
+            if isinstance(value, list) and len(value) == 2 and str(value[0]) in workflow:
+                inputs[name] = [signature(str(value[0])), value[1]]
+            else:
+                inputs[name] = value
+        payload = json.dumps([node.get("class_type"), inputs], sort_keys=True, ensure_ascii=False)
+        signatures[node_id] = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        return signatures[node_id]
+
+    for node_id in workflow:
+        signature(node_id)
+    return signatures
+
+
+class LatencyModel:
+    """Render time distribution parsed from 'kind:params'
+
+    fixed:2            always 2 s
+    uniform:1,3        uniform between 1 and 3 s
+    normal:2,0.3       normal with mean 2 s and sd 0.3 s (clamped at 0)
+    lognormal:0.7,0.2  lognormal with mu 0.7 and sigma 0.2
+    exp:2              exponential with mean 2 s
+    """
+
+    def __init__(self, spec: str = "fixed:0.5", rng: random.Random = None):
+        kind, _, params = spec.partition(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p] if params else []
+        self.rng = rng or random.Random()
+        if kind not in ("fixed", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(p[0], p[1])
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(p[0], p[1]))
+        if self.kind == "lognormal":
+            return self.rng.lognormvariate(p[0], p[1])
+        return self.rng.expovariate(1.0 / p[0])
+
+
+def synthetic_png(width: int, height: int, seed: int = 0, defect: str = None) -> bytes:
+    """RGB PNG of seed-dependent flat-shaded triangles (a crude low poly look)
+
+    defect 'black' or 'flat' gives the broken renders the quality gate rejects.
+    """
+    rng = random.Random(seed)
+    base = [rng.randrange(64, 192) for _ in range(3)]
+    cell = max(1, min(width, height) // 16)
+    columns = -(-width // cell)
+    rows = []
+    colors = []
+    for y in range(height):
+        if defect == "black":
+            rows.append(b"\x00" + b"\x00\x00\x00" * width)
+            continue
+        if defect == "flat":
+            rows.append(b"\x00" + bytes(base) * width)
+            continue
+        if y % cell == 0:
+            # Two triangles per grid cell, split along its diagonal
+            colors = [[bytes(max(0, min(255, value + shade)) for value in base)
+                       for shade in (rng.randrange(-48, 49), rng.randrange(-48, 49))] for _ in range(columns)]
+        split = y % cell
+        row = b"".join(upper * (cell - split) + lower * split for lower, upper in colors)
+        rows.append(b"\x00" + row[:width * 3])
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 1)) + chunk(b"IEND", b""))
+
+
+class WebSocketConnection:
+    """Server side of one /ws connection (unmasked text frames out, masked frames in)"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.open = True
+
+    def send(self, message: Dict):
+        payload = json.dumps(message).encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack(">BB", 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack(">BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack(">BBQ", 0x81, 127, len(payload))
+        self._send_raw(header + payload)
+
+    def _send_raw(self, data: bytes):
+        with self.lock:
+            if not self.open:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.open = False
+
+    def _recv_exact(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def serve(self):
+        """Read client frames until close; answers pings"""
+        try:
+            while self.open:
+                first, second = self._recv_exact(2)
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self._recv_exact(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self._recv_exact(8))[0]
+                mask = self._recv_exact(4) if second & 0x80 else b"\x00\x00\x00\x00"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exact(length)))
+                if opcode == 0x8:
+                    self._send_raw(struct.pack(">BB", 0x88, 0))
+                    break
+                if opcode == 0x9:
+                    self._send_raw(struct.pack(">BB", 0x8A, len(payload)) + payload)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.open = False
+
+
+class FakeComfyUIServer:
+    """Single-executor ComfyUI simulator
+
+    latency: render time spec for LatencyModel
+    capacity: max prompts running + pending; /prompt answers 503 beyond it (None = unlimited)
+    failure_rate: share of prompts that end with execution_error
+    hang_rate: share of prompts that never finish (until /interrupt or stop)
+    http_error_rate: share of HTTP requests answered with a 503 before any work
+    models: model files per folder served through /object_info; /prompt rejects
+            workflows naming anything else, like ComfyUI does
+    load_time: extra seconds per *Loader node not cached from the previous prompt
+    encode_time: extra seconds per 100 words of text in CLIPTextEncode nodes not cached from the
+                 previous prompt (text encoders cost about linear in prompt length)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0.5",
+                 capacity: Optional[int] = None, failure_rate: float = 0.0, hang_rate: float = 0.0,
+                 http_error_rate: float = 0.0, vram_total_gb: float = 24, seed: Optional[int] = None,
+                 models: Dict[str, List[str]] = None, load_time: float = 0.0, encode_time: float = 0.0,
+                 defect_rate: float = 0.0):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.capacity = capacity
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.http_error_rate = http_error_rate
+        # Share of output images rendered black or flat (quality gate injection)
+        self.defect_rate = defect_rate
+        self.vram_total = int(vram_total_gb * GIB)
+        self.object_info = default_object_info(models)
+        self.load_time = load_time
+        self.encode_time = encode_time
+        # Signatures of the nodes the previous successful prompt produced
+        self.node_cache = set()
+
+        self.cv = threading.Condition()
+        self.pending = deque()
+        self.running = None
+        self.history = {}
+        self.counters = {}
+        self.images = {}
+        # (subfolder, filename) -> (width, height) of images uploaded to the input folder
+        self.inputs = {}
+        self.number = 0
+        self.interrupt_event = threading.Event()
+        self.stopped = threading.Event()
+        self.sockets = {}
+        self.sockets_lock = threading.Lock()
+
+        # One record per executed prompt: {'prompt_id', 'started', 'finished', 'status', 'cached'}
+        self.timeline = []
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "interrupted": 0,
+                      "rejected": 0, "http_errors": 0, "busy_seconds": 0.0,
+                      "cached_nodes": 0, "executed_nodes": 0, "miss_seconds": 0.0, "encode_seconds": 0.0}
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_port}"
+        self._threads = []
+
+    # --- lifecycle ---
+
+    def start(self) -> "FakeComfyUIServer":
+        for target in (self.httpd.serve_forever, self._worker):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.interrupt_event.set()
+        with self.cv:
+            self.cv.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        with self.sockets_lock:
+            connections = [c for conns in self.sockets.values() for c in conns]
+        for connection in connections:
+            connection.open = False
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self) -> "FakeComfyUIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- event stream ---
+
+    def _send(self, client_id: Optional[str], message: Dict):
+        with self.sockets_lock:
+            if client_id is None:
+                connections = [c for conns in self.sockets.values() for c in conns]
+            else:
+                connections = list(self.sockets.get(client_id, []))
+        for connection in connections:
+            connection.send(message)
+
+    def _queue_status(self) -> Dict:
+        return {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": self.queue_size()}}}}
+
+    def queue_size(self) -> int:
+        return len(self.pending) + (1 if self.running else 0)
+
+    # --- prompt handling ---
+
+    def node_errors(self, workflow: Dict) -> Dict:
+        """ComfyUI-style node_errors for unknown node types and unavailable combo values"""
+        errors = {}
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type")
+            info = self.object_info.get(class_type)
+            if info is None:
+                errors[node_id] = {"errors": [{"type": "invalid_node", "message": "Node not found",
+                                               "details": f"unknown node type {class_type}"}],
+                                   "class_type": class_type}
+                continue
+            specs = {**info["input"]["required"], **info["input"]["optional"]}
+            if class_type == "LoadImage":
+                subfolder, _, filename = str(node.get("inputs", {}).get("image", "")).rpartition("/")
+                if (subfolder, filename) not in self.inputs:
+                    errors.setdefault(node_id, {"errors": [], "class_type": class_type})["errors"].append({
+                        "type": "custom_validation_failed", "message": "Custom validation failed for node",
+                        "details": f"image - Invalid image file: {node['inputs'].get('image')}"
+                    })
+            for name, value in node.get("inputs", {}).items():
+                spec = specs.get(name)
+                # LoadImage validates its own input above instead of the combo list
+                if class_type == "LoadImage" and name == "image":
+                    continue
+                if spec and isinstance(spec[0], list) and not isinstance(value, list) and value not in spec[0]:
+                    errors.setdefault(node_id, {"errors": [], "class_type": class_type})["errors"].append({
+                        "type": "value_not_in_list", "message": "Value not in list",
+                        "details": f"{name}: '{value}' not in list"
+                    })
+        return errors
+
+    def upload(self, data: bytes, filename: str, subfolder: str = "") -> Dict:
+        """Store an uploaded PNG in the input folder; returns the /upload/image response body"""
+        if data[:8] != b"\x89PNG\r\n\x1a\n":
+            raise ValueError("not a PNG")
+        width, height = struct.unpack(">II", data[16:24])
+        with self.cv:
+            self.inputs[(subfolder, filename)] = (width, height)
+            if not subfolder:
+                files = self.object_info["LoadImage"]["input"]["required"]["image"][0]
+                files[:] = sorted(set(files) | {filename})
+        return {"name": filename, "subfolder": subfolder, "type": "input"}
+
+    def submit(self, workflow: Dict, client_id: Optional[str]) -> Dict:
+        """Queue a prompt; returns the /prompt response body (raises OverflowError when full)"""
+        with self.cv:
+            if self.capacity is not None and self.queue_size() >= self.capacity:
+                self.stats["rejected"] += 1
+                raise OverflowError("queue full")
+            prompt_id = str(uuid.uuid4())
+            number = self.number
+            self.number += 1
+            self.pending.append({"prompt_id": prompt_id, "number": number,
+                                 "workflow": workflow, "client_id": client_id})
+            self.stats["submitted"] += 1
+            self.cv.notify_all()
+        self._send(None, self._queue_status())
+        return {"prompt_id": prompt_id, "number": number, "node_errors": {}}
+
+    @staticmethod
+    def _queue_entry(job: Dict) -> List:
+        # Same shape as ComfyUI: [number, prompt_id, prompt, extra_data, outputs_to_execute]
+        return [job["number"], job["prompt_id"], job["workflow"], {"client_id": job["client_id"]}, []]
+
+    def _output_images(self, job: Dict) -> Dict:
+        workflow = job["workflow"]
+        width, height = 1024, 1024
+        for node in workflow.values():
+            # img2img renders keep the size of their input image
+            if node.get("class_type") == "LoadImage":
+                subfolder, _, filename = str(node["inputs"].get("image", "")).rpartition("/")
+                width, height = self.inputs.get((subfolder, filename), (width, height))
+        for node in workflow.values():
+            inputs = node.get("inputs", {})
+            if "width" in inputs and "height" in inputs and "Latent" in node.get("class_type", ""):
+                width, height = int(inputs["width"]), int(inputs["height"])
+                batch = int(inputs.get("batch_size", 1))
+                break
+        else:
+            batch = 1
+        seed = next((n["inputs"]["seed"] for n in workflow.values()
+                     if isinstance(n.get("inputs", {}).get("seed"), int)), 0)
+
+        outputs = {}
+        for node_id, node in workflow.items():
+            if node.get("class_type") != "SaveImage":
+                continue
+            prefix = node.get("inputs", {}).get("filename_prefix", "ComfyUI")
+            subfolder, _, name = prefix.rpartition("/")
+            images = []
+            for index in range(batch):
+                with self.cv:
+                    counter = self.counters.get(prefix, 0) + 1
+                    self.counters[prefix] = counter
+                filename = f"{name}_{counter:05}_.png"
+                defect = self.rng.choice(("black", "flat")) if self.rng.random() < self.defect_rate else None
+                self.images[(subfolder, filename)] = (width, height, seed + index, defect)
+                images.append({"filename": filename, "subfolder": subfolder, "type": "output"})
+            outputs[node_id] = {"images": images}
+        return outputs
+
+    def _cache_misses(self, workflow: Dict, signatures: Dict[str, str]) -> Tuple[float, float]:
+        """Extra (load, encode) seconds for the loader and text-encode nodes that have to run"""
+        load = encode = 0.0
+        for node_id, node in workflow.items():
+            if signatures[node_id] in self.node_cache:
+                continue
+            class_type = node.get("class_type", "")
+            if class_type.endswith("Loader"):
+                load += self.load_time
+            elif class_type == "CLIPTextEncode":
+                encode += self.encode_time * len(str(node.get("inputs", {}).get("text", "")).split()) / 100
+        return load, encode
+
+    def _finish(self, job: Dict, status: str, outputs: Dict, messages: List, started: float, cached: List[str]):
+        messages = ([["execution_start", {"prompt_id": job["prompt_id"], "timestamp": int(started * 1000)}],
+                     ["execution_cached", {"nodes": cached, "prompt_id": job["prompt_id"], "timestamp": int(started * 1000)}]]
+                    + messages)
+        with self.cv:
+            self.timeline.append({"prompt_id": job["prompt_id"], "started": started,
+                                  "finished": time.time(), "status": status, "cached": len(cached)})
+            self.history[job["prompt_id"]] = {
+                "prompt": self._queue_entry(job),
+                "outputs": outputs,
+                "status": {"status_str": status, "completed": status == "success", "messages": messages}
+            }
+            self.running = None
+
+    def _worker(self):
+        while not self.stopped.is_set():
+            with self.cv:
+                while not self.pending and not self.stopped.is_set():
+                    self.cv.wait()
+                if self.stopped.is_set():
+                    return
+                job = self.pending.popleft()
+                self.running = job
+                self.interrupt_event.clear()
+
+            prompt_id, client_id = job["prompt_id"], job["client_id"]
+            started = time.time()
+            self._send(None, self._queue_status())
+            self._send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id, "timestamp": int(started * 1000)}})
+            signatures = node_signatures(job["workflow"])
+            cached = [node_id for node_id, signature in signatures.items() if signature in self.node_cache]
+            self._send(client_id, {"type": "execution_cached", "data": {"nodes": cached, "prompt_id": prompt_id}})
+
+            roll = self.rng.random()
+            hang = roll < self.hang_rate
+            fail = not hang and roll < self.hang_rate + self.failure_rate
+            load_seconds, encode_seconds = self._cache_misses(job["workflow"], signatures)
+            miss_seconds = load_seconds + encode_seconds
+            duration = float("inf") if hang else self.latency.sample() + miss_seconds
+
+            node_ids = [node_id for node_id in job["workflow"] if node_id not in cached]
+            self.stats["cached_nodes"] += len(cached)
+            self.stats["executed_nodes"] += len(node_ids)
+            self.stats["miss_seconds"] += miss_seconds
+            self.stats["encode_seconds"] += encode_seconds
+            deadline = started + duration
+            interrupted = False
+            for node_id in node_ids:
+                self._send(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+            # One wait for the whole render keeps the event volume independent of latency
+            remaining = deadline - time.time()
+            if remaining > 0 and self.interrupt_event.wait(None if hang else remaining):
+                interrupted = True
+
+            self.stats["busy_seconds"] += time.time() - started
+            timestamp = int(time.time() * 1000)
+            if interrupted:
+                self.stats["interrupted"] += 1
+                data = {"prompt_id": prompt_id, "node_id": node_ids[-1] if node_ids else None, "timestamp": timestamp}
+                self._finish(job, "error", {}, [["execution_interrupted", data]], started, cached)
+                self._send(client_id, {"type": "execution_interrupted", "data": data})
+            elif fail:
+                self.stats["failed"] += 1
+                data = {"prompt_id": prompt_id, "node_id": node_ids[-1] if node_ids else None,
+                        "exception_type": "RuntimeError", "exception_message": "injected failure",
+                        "timestamp": timestamp}
+                self._finish(job, "error", {}, [["execution_error", data]], started, cached)
+                self._send(client_id, {"type": "execution_error", "data": data})
+            else:
+                self.stats["completed"] += 1
+                outputs = self._output_images(job)
+                self.node_cache = set(signatures.values())
+                for node_id, output in outputs.items():
+                    self._send(client_id, {"type": "executed", "data": {"node": node_id, "output": output, "prompt_id": prompt_id}})
+                self._finish(job, "success", outputs, [["execution_success", {"prompt_id": prompt_id, "timestamp": timestamp}]], started, cached)
+                self._send(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id, "timestamp": timestamp}})
+            self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+            self._send(None, self._queue_status())
+
+    def interrupt(self):
+        if self.running:
+            self.interrupt_event.set()
+
+    def system_stats(self) -> Dict:
+        busy = self.running is not None
+        used = int(self.vram_total * (0.7 if busy else 0.3))
+        return {
+            "system": {"os": "fake", "comfyui_version": "fake", "python_version": "", "embedded_python": False},
+            "devices": [{
+                "name": "fake:0 simulated GPU", "type": "cuda", "index": 0,
+                "vram_total": self.vram_total, "vram_free": self.vram_total - used,
+                "torch_vram_total": used, "torch_vram_free": used // 10
+            }]
+        }
+
+    # --- HTTP ---
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, body, code: int = 200):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> Dict:
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+            def _inject_error(self) -> bool:
+                if server.http_error_rate and server.rng.random() < server.http_error_rate:
+                    server.stats["http_errors"] += 1
+                    self._json({"error": "injected error"}, 503)
+                    return True
+                return False
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == "/ws":
+                    return self._websocket(query.get("clientId", [None])[0])
+                if url.path == "/system_stats":
+                    # Health checks stay reliable so injected errors exercise retries, not failover
+                    return self._json(server.system_stats())
+                if self._inject_error():
+                    return
+                if url.path == "/queue":
+                    with server.cv:
+                        running = [server._queue_entry(server.running)] if server.running else []
+                        pending = [server._queue_entry(job) for job in server.pending]
+                    return self._json({"queue_running": running, "queue_pending": pending})
+                if url.path.startswith("/history/"):
+                    prompt_id = url.path.split("/", 2)[2]
+                    entry = server.history.get(prompt_id)
+                    return self._json({prompt_id: entry} if entry else {})
+                if url.path == "/history":
+                    items = list(server.history.items())
+                    if "max_items" in query:
+                        items = items[-int(query["max_items"][0]):]
+                    return self._json(dict(items))
+                if url.path == "/object_info":
+                    return self._json(server.object_info)
+                if url.path == "/view":
+                    key = (query.get("subfolder", [""])[0], query.get("filename", [""])[0])
+                    if key not in server.images:
+                        return self._json({"error": "not found"}, 404)
+                    data = synthetic_png(*server.images[key])
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self._json({"error": "not found"}, 404)
+
+            def _upload(self):
+                length = int(self.headers.get("Content-Length", 0))
+                message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                    f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("utf-8")
+                    + self.rfile.read(length))
+                fields, image = {}, None
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    if name == "image":
+                        image = (part.get_filename(), part.get_payload(decode=True))
+                    else:
+                        fields[name] = part.get_content().strip()
+                if image is None:
+                    return self._json({"error": "no image"}, 400)
+                try:
+                    return self._json(server.upload(image[1], image[0], fields.get("subfolder", "")))
+                except ValueError as e:
+                    return self._json({"error": str(e)}, 400)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path == "/upload/image":
+                    return self._upload()
+                try:
+                    body = self._body()
+                except ValueError:
+                    return self._json({"error": "invalid json"}, 400)
+                if self._inject_error():
+                    return
+                if url.path == "/prompt":
+                    workflow = body.get("prompt")
+                    if not isinstance(workflow, dict) or not workflow:
+                        return self._json({"error": {"type": "invalid_prompt", "message": "Invalid prompt"},
+                                           "node_errors": {}}, 400)
+                    node_errors = server.node_errors(workflow)
+                    if node_errors:
+                        return self._json({"error": {"type": "prompt_outputs_failed_validation",
+                                                     "message": "Prompt outputs failed validation"},
+                                           "node_errors": node_errors}, 400)
+                    try:
+                        return self._json(server.submit(workflow, body.get("client_id")))
+                    except OverflowError:
+                        return self._json({"error": "queue full"}, 503)
+                if url.path == "/interrupt":
+                    server.interrupt()
+                    return self._json({})
+                if url.path == "/queue":
+                    with server.cv:
+                        if body.get("clear"):
+                            server.pending.clear()
+                        for prompt_id in body.get("delete", []):
+                            server.pending = deque(j for j in server.pending if j["prompt_id"] != prompt_id)
+                    return self._json({})
+                if url.path == "/history":
+                    with server.cv:
+                        if body.get("clear"):
+                            server.history.clear()
+                        for prompt_id in body.get("delete", []):
+                            server.history.pop(prompt_id, None)
+                    return self._json({})
+                self._json({"error": "not found"}, 404)
+
+            def _websocket(self, client_id: Optional[str]):
+                key = self.headers.get("Sec-WebSocket-Key")
+                if not key:
+                    return self._json({"error": "websocket upgrade required"}, 400)
+                accept = base64.b64encode(hashlib.sha1((key + WS_MAGIC).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+                self.close_connection = True
+
+                client_id = client_id or uuid.uuid4().hex
+                connection = WebSocketConnection(self.connection)
+                with server.sockets_lock:
+                    server.sockets.setdefault(client_id, []).append(connection)
+                connection.send({"type": "status", "data": {
+                    "status": {"exec_info": {"queue_remaining": server.queue_size()}}, "sid": client_id}})
+                try:
+                    connection.serve()
+                finally:
+                    with server.sockets_lock:
+                        conns = server.sockets.get(client_id, [])
+                        if connection in conns:
+                            conns.remove(connection)
+                        if not conns:
+                            server.sockets.pop(client_id, None)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server for offline testing and load simulation")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=8000, help="Port (0 = any free port)")
+    parser.add_argument("--latency", default="fixed:0.5", help="Render time: fixed:S, uniform:A,B, normal:M,SD, lognormal:MU,SIGMA, exp:MEAN")
+    parser.add_argument("--capacity", type=int, help="Max queued prompts before /prompt answers 503")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of prompts ending with execution_error")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of prompts that never finish (timeout injection)")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Share of HTTP requests answered with 503")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible simulations")
+    parser.add_argument("--model-load-time", type=float, default=0.0, help="Extra seconds per uncached model loader node")
+    parser.add_argument("--encode-time", type=float, default=0.0, help="Extra seconds per 100 words of uncached CLIPTextEncode text")
+    parser.add_argument("--defect-rate", type=float, default=0.0, help="Share of output images rendered black or flat")
+
+    args = parser.parse_args()
+
+    server = FakeComfyUIServer(
+        args.host, args.port, latency=args.latency, capacity=args.capacity,
+        failure_rate=args.failure_rate, hang_rate=args.hang_rate,
+        http_error_rate=args.http_error_rate, seed=args.seed,
+        load_time=args.model_load_time, encode_time=args.encode_time, defect_rate=args.defect_rate
+    ).start()
+    print(f"🧪 Fake ComfyUI listening on {server.url} (latency {args.latency})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        print(f"\n📊 {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
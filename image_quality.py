@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Local image quality metrics
+Vectorized NumPy metrics over a stack of downscaled renders: edge density
+(share of pixels on a luminance edge, the facets of the low poly style),
+color spread, luminance histogram and blank/flat detection. Scores rank the
+candidates of a batched render; a blank or flat image always scores 0.
+QualityGate rejects defective renders inline: black, blown out, flat, no
+facet edges, or a style unlike the other renders of the same city. Its
+thresholds are deliberately loose so foggy or dim weather passes.
+"""
+
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+
+# Longest side the metrics are computed at
+ANALYSIS_SIZE = 256
+# Luminance step (0-1) that counts as an edge between neighbouring pixels
+EDGE_STEP = 0.04
+# Edge density / color standard deviation at which their score part saturates
+EDGE_TARGET = 0.12
+COLOR_TARGET = 0.2
+# Luminance standard deviation below which an image is flat
+FLAT_STD = 0.02
+# Mean luminance below / above which an image is blank (black / white)
+BLANK_DARK = 0.03
+BLANK_LIGHT = 0.97
+# Luminance histogram bins; share of pixels in the darkest bin, or in any single bin,
+# above which a render is black / nearly flat
+HISTOGRAM_BINS = 32
+MAX_DARK_SHARE = 0.9
+MAX_PEAK_SHARE = 0.95
+# Edge density below which the low poly facets are missing
+MIN_EDGE_DENSITY = 0.005
+# Style signature: distribution of edge strengths over STYLE_BINS luminance steps of
+# EDGE_STEP each (stronger edges fall in the last bin)
+STYLE_BINS = 16
+# Histogram intersection with the mean signature of a city's accepted renders below
+# which a render does not belong to the set (loose: weathers differ in contrast)
+MIN_SET_SIMILARITY = 0.5
+
+LUMA = (0.299, 0.587, 0.114)
+
+
+def available() -> bool:
+    return np is not None
+
+
+def load_stack(paths: List[str], size: int = ANALYSIS_SIZE) -> "np.ndarray":
+    """Images as one float32 array (N, H, W, 3) in 0-1, downscaled to at most size pixels a side
+
+    Images of different sizes are resized to the size of the first one.
+    """
+    frames = []
+    shape = None
+    for path in paths:
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            if shape is None:
+                factor = max(1, max(image.size) // size)
+                shape = (max(1, image.width // factor), max(1, image.height // factor))
+            if image.size != shape:
+                # Integer box reduction first: much cheaper than resampling the full image
+                factor = max(1, min(image.width // shape[0], image.height // shape[1]))
+                image = image.reduce(factor) if factor > 1 else image
+                if image.size != shape:
+                    image = image.resize(shape, Image.BILINEAR)
+            frames.append(np.asarray(image, dtype=np.uint8))
+    return np.stack(frames).astype(np.float32) / 255.0
+
+
+def histograms(values: "np.ndarray", bins: int, top: float = 1.0) -> "np.ndarray":
+    """Normalized histogram over 0-top of every image of an (N, ...) array, as (N, bins)"""
+    count = values.shape[0]
+    indices = np.clip((values.reshape(count, -1) * (bins / top)).astype(np.int64), 0, bins - 1)
+    # One bincount for the whole stack: offset each image into its own range of bins
+    indices += np.arange(count, dtype=np.int64)[:, None] * bins
+    counts = np.bincount(indices.ravel(), minlength=count * bins).reshape(count, bins)
+    return counts / indices.shape[1]
+
+
+def batch_metrics(pixels: "np.ndarray") -> Dict[str, "np.ndarray"]:
+    """Per image metrics of an (N, H, W, 3) stack
+
+    Scalars are arrays of N values; 'signature' is the (N, STYLE_BINS) style
+    signature compared by set_similarity.
+    """
+    count = pixels.shape[0]
+    luma = pixels @ np.asarray(LUMA, dtype=np.float32)
+    steps_x = np.abs(np.diff(luma, axis=2))[:, :-1, :]
+    steps_y = np.abs(np.diff(luma, axis=1))[:, :, :-1]
+    steps = np.maximum(steps_x, steps_y)
+    edge_density = (steps > EDGE_STEP).reshape(count, -1).mean(axis=1)
+    luma_histogram = histograms(luma, HISTOGRAM_BINS)
+    color_std = pixels.reshape(count, -1, 3).std(axis=1).mean(axis=1)
+    luma_mean = luma.reshape(count, -1).mean(axis=1)
+    luma_std = luma.reshape(count, -1).std(axis=1)
+    flat = luma_std < FLAT_STD
+    blank = (luma_mean < BLANK_DARK) | (luma_mean > BLANK_LIGHT)
+    score = 0.5 * np.minimum(edge_density / EDGE_TARGET, 1.0) + 0.5 * np.minimum(color_std / COLOR_TARGET, 1.0)
+    score = np.where(flat | blank, 0.0, score)
+    # Bin 0 holds the steps below EDGE_STEP (no edge)
+    strengths = histograms(steps, STYLE_BINS + 1, EDGE_STEP * (STYLE_BINS + 1))[:, 1:]
+    signature = strengths / np.maximum(strengths.sum(axis=1, keepdims=True), 1e-9)
+    return {"score": score, "edge_density": edge_density, "color_std": color_std,
+            "luma_mean": luma_mean, "luma_std": luma_std, "flat": flat, "blank": blank,
+            "dark_share": luma_histogram[:, 0], "peak_share": luma_histogram.max(axis=1),
+            "signature": signature}
+
+
+def score_images(paths: List[str]) -> List[Dict]:
+    """Scalar metrics of every image as plain dicts, in the order of paths"""
+    metrics = batch_metrics(load_stack(paths))
+    return [{name: values[index].item() for name, values in metrics.items() if values.ndim == 1}
+            for index in range(len(paths))]
+
+
+def set_similarity(signatures: "np.ndarray", reference: "np.ndarray") -> "np.ndarray":
+    """Histogram intersection (0-1) of each style signature with a reference signature"""
+    return np.minimum(signatures, reference[None, :]).sum(axis=1)
+
+
+def defects(metrics: Dict[str, "np.ndarray"], reference: "np.ndarray" = None) -> List[Optional[str]]:
+    """Defect description of every image of batch_metrics, None for a good render"""
+    similarity = set_similarity(metrics["signature"], reference) if reference is not None else None
+    reasons = []
+    for index in range(len(metrics["score"])):
+        if metrics["luma_mean"][index] < BLANK_DARK or metrics["dark_share"][index] > MAX_DARK_SHARE:
+            reasons.append(f"black (mean luminance {metrics['luma_mean'][index]:.2f})")
+        elif metrics["luma_mean"][index] > BLANK_LIGHT:
+            reasons.append(f"white (mean luminance {metrics['luma_mean'][index]:.2f})")
+        elif metrics["flat"][index] or metrics["peak_share"][index] > MAX_PEAK_SHARE:
+            reasons.append(f"flat (luminance spread {metrics['luma_std'][index]:.3f})")
+        elif metrics["edge_density"][index] < MIN_EDGE_DENSITY:
+            reasons.append(f"no low poly edges (edge density {metrics['edge_density'][index]:.4f})")
+        elif similarity is not None and similarity[index] < MIN_SET_SIMILARITY:
+            reasons.append(f"unlike the city's other renders (similarity {similarity[index]:.2f})")
+        else:
+            reasons.append(None)
+    return reasons
+
+
+def best_image(scores: List[Dict]) -> int:
+    """Index of the highest score; the earliest image wins ties"""
+    return max(range(len(scores)), key=lambda index: (scores[index]["score"], -index))
+
+
+class QualityGate:
+    """Inline defect check of rendered images
+
+    The images of a job are checked in one vectorized pass. Every group (a
+    city) keeps the style signatures of its accepted renders; once min_set of
+    them exist, new renders of the group must resemble their mean. Safe to
+    call from several output worker threads.
+    """
+
+    def __init__(self, min_set: int = 2):
+        self.min_set = min_set
+        self.signatures = {}
+        self.lock = threading.Lock()
+        self.checked = 0
+        # Defect kind ('black', 'flat', ...) -> rejected renders
+        self.rejected = Counter()
+        # Updated by the caller's gate callback: renders re-queued, renders rejected on their last try
+        self.requeued = 0
+        self.gave_up = 0
+
+    def check(self, paths: List[str], group: str = None) -> List[Optional[str]]:
+        """Defect description per image (None = accepted); accepted images join their group"""
+        metrics = batch_metrics(load_stack(paths))
+        with self.lock:
+            known = self.signatures.get(group, [])
+            reference = np.mean(known, axis=0) if group is not None and len(known) >= self.min_set else None
+        reasons = defects(metrics, reference)
+        with self.lock:
+            self.checked += len(paths)
+            for reason, signature in zip(reasons, metrics["signature"]):
+                if reason is None:
+                    if group is not None:
+                        self.signatures.setdefault(group, []).append(signature)
+                else:
+                    self.rejected[reason.split(" (")[0]] += 1
+        return reasons
+
+    def print_report(self):
+        if not self.checked:
+            return
+        kinds = ", ".join(f"{kind} {count}" for kind, count in self.rejected.most_common())
+        print(f"🔎 Quality gate: {self.checked} renders checked, {sum(self.rejected.values())} rejected"
+              + (f" ({kinds})" if kinds else "") + f", {self.requeued} re-queued, {self.gave_up} still defective")
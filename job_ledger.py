@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Persistent job ledger for batch runs
+SQLite table keyed by (config, region, city, weather, workflow hash) recording
+the state of every job so interrupted batches can resume without regenerating
+finished images; img2img weather variants also record the base image they
+were derived from
+"""
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Stopped by Ctrl-C before finishing; resume runs these again
+CANCELLED = "cancelled"
+
+SEED_INPUTS = ("seed", "noise_seed")
+
+
+def workflow_seed(workflow: Dict) -> Optional[int]:
+    """Seed of the first sampler node, if any"""
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        for name in SEED_INPUTS:
+            if isinstance(inputs.get(name), int):
+                return inputs[name]
+    return None
+
+
+def with_seed(workflow: Dict, seed: int) -> Dict:
+    """Copy of a workflow with every sampler seed replaced"""
+    workflow = copy.deepcopy(workflow)
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        for name in SEED_INPUTS:
+            if isinstance(inputs.get(name), int):
+                inputs[name] = seed
+    return workflow
+
+
+def workflow_resolution(workflow: Dict) -> Optional[str]:
+    """'<width>x<height>' of the first latent image node, if any"""
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        if isinstance(inputs.get("width"), int) and isinstance(inputs.get("height"), int):
+            return f"{inputs['width']}x{inputs['height']}"
+    return None
+
+
+def workflow_hash(workflow: Dict, include_seed: bool = True) -> str:
+    """Stable hash of a fully built workflow; include_seed=False hashes everything but the sampler seed"""
+    # Workflows rendered from a template carry their canonical JSON already
+    payload = getattr(workflow, "serialized", None) if include_seed else None
+    if not include_seed:
+        workflow = copy.deepcopy(workflow)
+        for node in workflow.values():
+            for name in SEED_INPUTS:
+                node.get("inputs", {}).pop(name, None)
+    if payload is None:
+        payload = json.dumps(workflow, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class JobLedger:
+    """Job states: queued -> running -> done | failed | cancelled"""
+
+    def __init__(self, path: str = "job_ledger.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                config TEXT NOT NULL,
+                region TEXT NOT NULL,
+                city TEXT NOT NULL,
+                weather TEXT NOT NULL,
+                workflow_hash TEXT NOT NULL,
+                state TEXT NOT NULL,
+                prompt_id TEXT,
+                seed INTEGER,
+                backend TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                queued_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                base TEXT,
+                PRIMARY KEY (config, region, city, weather, workflow_hash)
+            )
+        """)
+        # Ledgers created before img2img variants lack the base column
+        if "base" not in {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN base TEXT")
+        self.conn.commit()
+        self.skipped = 0
+
+    @staticmethod
+    def job_key(job: Dict) -> tuple:
+        """(config, region, city, weather, workflow_hash) for a job carrying 'ledger_key'"""
+        config, region, city, weather = job["ledger_key"]
+        return (os.path.basename(config), region, city, weather, workflow_hash(job["workflow"]))
+
+    def state(self, key: tuple) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT state FROM jobs WHERE config=? AND region=? AND city=? AND weather=? AND workflow_hash=?",
+            key
+        ).fetchone()
+        return row[0] if row else None
+
+    def select(self, jobs: Iterable[Dict], resume: bool = False, retry_failed: bool = False) -> Iterator[Dict]:
+        """Yield the jobs that still need to run
+
+        resume: skip done and failed jobs (continue where the last run stopped;
+                cancelled jobs run again)
+        retry_failed: submit only failed jobs
+        both: everything that is not done
+        """
+        self.skipped = 0
+        for job in jobs:
+            job["ledger"] = self.job_key(job)
+            state = self.state(job["ledger"])
+            if resume and retry_failed:
+                wanted = state != DONE
+            elif retry_failed:
+                wanted = state == FAILED
+            elif resume:
+                wanted = state not in (DONE, FAILED)
+            else:
+                wanted = True
+            if wanted:
+                yield job
+            else:
+                self.skipped += 1
+
+    def _upsert(self, key: tuple, **fields):
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{name}=excluded.{name}" for name in fields)
+        self.conn.execute(
+            f"INSERT INTO jobs (config, region, city, weather, workflow_hash, {columns}) "
+            f"VALUES (?, ?, ?, ?, ?, {placeholders}) "
+            f"ON CONFLICT (config, region, city, weather, workflow_hash) DO UPDATE SET {updates}",
+            key + tuple(fields.values())
+        )
+        self.conn.commit()
+
+    def mark_queued(self, job: Dict):
+        self._upsert(
+            job["ledger"], state=QUEUED, prompt_id=job.get("prompt_id"),
+            seed=workflow_seed(job.get("workflow", {})), backend=job.get("backend"),
+            attempts=self._attempts(job["ledger"]) + 1, error=None,
+            queued_at=time.time(), started_at=None, finished_at=None, base=job.get("base")
+        )
+
+    def mark_running(self, job: Dict):
+        self._upsert(job["ledger"], state=RUNNING, started_at=time.time())
+
+    def mark_finished(self, job: Dict, success: bool):
+        self._upsert(
+            job["ledger"], state=DONE if success else (CANCELLED if job.get("status") == "cancelled" else FAILED),
+            error=None if success else (job.get("error") or job.get("status")),
+            finished_at=time.time()
+        )
+
+    def seed(self, key: tuple) -> Optional[int]:
+        """Seed a finished job was last queued with (the replacement seed of a re-queued render)"""
+        row = self.conn.execute(
+            "SELECT seed FROM jobs WHERE config=? AND region=? AND city=? AND weather=? AND workflow_hash=? AND state=?",
+            key + (DONE,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _attempts(self, key: tuple) -> int:
+        row = self.conn.execute(
+            "SELECT attempts FROM jobs WHERE config=? AND region=? AND city=? AND weather=? AND workflow_hash=?",
+            key
+        ).fetchone()
+        return row[0] if row else 0
+
+    def counts(self, config: str = None, region: str = None) -> Dict[str, int]:
+        """Number of jobs per state, optionally for one config/region"""
+        query = "SELECT state, COUNT(*) FROM jobs WHERE 1=1"
+        params = []
+        if config:
+            query += " AND config=?"
+            params.append(os.path.basename(config))
+        if region:
+            query += " AND region=?"
+            params.append(region)
+        return dict(self.conn.execute(query + " GROUP BY state", params).fetchall())
+
+    def close(self):
+        self.conn.close()
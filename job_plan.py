@@ -0,0 +1,740 @@
+#!/usr/bin/env python3
+"""
+Job-plan compiler and workers for global generation runs
+Expands the selected regions, resort categories and regional fallbacks of
+global_cities_config.json, resort_cities_config.json and
+regional_fallback_config.json times the weather filter (plus optional single
+cloud styles) into a JSONL plan: one header line (configs, seed salt, cost
+estimate) followed by one slotted record per image with a deterministic ID.
+Slots follow a cache-aware order (job_scheduler) unless --order config. Plans run either as fixed slices
+(--shard K/N or --slots A:B) or through a shared work queue that any number
+of workers, each with its own ComfyUI servers, claim jobs from.
+The quality profile and candidates per prompt are compiled into the plan;
+img2img is not available in plans (variants need their city's base render
+uploaded first, so their jobs are not independent slots).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import image_quality
+from batch_pipeline import DRAIN, run_batch
+from job_ledger import JobLedger
+from job_scheduler import count_reuse, reuse_order
+from progress import BatchProgress, ThroughputEstimator, class_pixels
+from regional_batch_generator import RegionalBatchGenerator
+from regional_fallback_generator import build_fallback_job
+from run_metrics import RunMetrics, format_seconds
+from work_queue import CLAIMED, PENDING, LeaseKeeper, WorkQueue, default_worker_id
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cloud_generator"))
+from single_cloud_generator import CLOUD_STYLES, SingleCloudGenerator
+
+PLAN_VERSION = 1
+DEFAULT_CONFIGS = {
+    "city": "global_cities_config.json",
+    "resort": "resort_cities_config.json",
+    "fallback": "regional_fallback_config.json"
+}
+
+
+class PlanError(Exception):
+    """The plan file is malformed or no longer matches the configs it was compiled from"""
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def plan_id(ledger_key: tuple) -> str:
+    """Deterministic job ID: hash of (config, region, item, weather, workflow_hash)"""
+    return hashlib.sha256("|".join(ledger_key).encode("utf-8")).hexdigest()[:16]
+
+
+def select(names: Optional[List[str]], available: List[str], what: str) -> List[str]:
+    """None or 'all' selects everything, 'none' nothing; unknown names are an error"""
+    if not names or names == ["all"]:
+        return list(available)
+    if names == ["none"]:
+        return []
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise PlanError(f"Unknown {what}: {', '.join(unknown)} (available: {', '.join(available)})")
+    return list(names)
+
+
+class PlanBuilder:
+    """Build the job of a plan record the same way the generator scripts do
+
+    City and resort jobs come from RegionalBatchGenerator.build_city_job,
+    fallback jobs from build_fallback_job and cloud jobs from
+    SingleCloudGenerator.build_cloud_job; ledger keys match the generators so
+    a plan run and a script run share ledger state.
+    """
+
+    def __init__(self, generator: RegionalBatchGenerator):
+        self.generator = generator
+        self.configs = {}
+        self.clouds = None
+
+    def config(self, path: str) -> Dict:
+        if path not in self.configs:
+            with open(path, "r", encoding="utf-8") as f:
+                self.configs[path] = json.load(f)
+        return self.configs[path]
+
+    def weather(self, config: Dict, name: str) -> Dict:
+        for weather in config["weather_conditions"]:
+            if weather["name"] == name:
+                return weather
+        raise PlanError(f"Weather '{name}' not found")
+
+    def build(self, kind: str, config_path: str, region: str, item: str, weather_name: str) -> Dict:
+        if kind == "cloud":
+            if self.clouds is None:
+                self.clouds = SingleCloudGenerator(cache_dir=None, seed_salt=self.generator.seed_salt)
+            if item not in CLOUD_STYLES:
+                raise PlanError(f"Cloud style '{item}' not found")
+            job = self.clouds.build_cloud_job(item)
+            job['ledger_key'] = ("single_clouds", region, item, "")
+            return job
+        config = self.config(config_path)
+        weather = self.weather(config, weather_name)
+        if kind == "fallback":
+            data = config["regional_fallbacks"][region]
+            job = build_fallback_job(config, data, weather, self.generator.seed_salt)
+            job['ledger_key'] = (config_path, region, data['representative_landmark'], weather['name'])
+            return job
+        section = config["resort_destinations"] if kind == "resort" else config["regions"]
+        city = next((city for city in section[region]["cities"] if city["name"] == item), None)
+        if city is None:
+            raise PlanError(f"City '{item}' not found in {config_path} / {region}")
+        # Plans render at the plan's quality profile of the record's config
+        try:
+            self.generator.apply_config(config)
+        except ValueError as e:
+            raise PlanError(f"{config_path}: {e}")
+        job = self.generator.build_city_job(city, weather)
+        job['ledger_key'] = (config_path, region, city['name'], weather['name'])
+        return job
+
+    def record(self, slot: int, kind: str, config_path: str, region: str, item: str, weather: str) -> Dict:
+        job = self.build(kind, config_path, region, item, weather)
+        key = JobLedger.job_key(job)
+        return {
+            "slot": slot,
+            "id": plan_id(key),
+            "kind": kind,
+            "config": config_path,
+            "region": region,
+            "item": item,
+            "weather": weather,
+            "resolution": job['labels']['resolution']
+        }
+
+
+def expand(builder: PlanBuilder, configs: Dict[str, str], regions: List[str] = None,
+           resorts: List[str] = None, fallbacks: List[str] = None, weather_filter: List[str] = None,
+           priority: List[int] = None, clouds: List[str] = None) -> Iterator[Dict]:
+    """Slotted records for every selected region/resort/fallback x weather and cloud style, in generator order"""
+    slot = 0
+    sources = []
+    for kind, section, names in (("city", "regions", regions), ("resort", "resort_destinations", resorts)):
+        config = builder.config(configs[kind])
+        for region in select(names, list(config.get(section, {})), section.replace("_", " ")):
+            sources.append((kind, configs[kind], region, [city["name"] for city in config[section][region]["cities"]]))
+    config = builder.config(configs["fallback"])
+    fallback_regions = config["regional_fallbacks"]
+    for region in select(fallbacks, list(fallback_regions), "regional fallbacks"):
+        if priority and fallback_regions[region].get("priority", 3) not in priority:
+            continue
+        sources.append(("fallback", configs["fallback"], region, [region]))
+    # Clouds are opt-in and weather independent
+    cloud_styles = select(clouds, CLOUD_STYLES, "cloud styles") if clouds else []
+    if cloud_styles:
+        sources.append(("cloud", "", "clouds", cloud_styles))
+
+    for kind, config_path, region, items in sources:
+        if kind == "cloud":
+            weathers = [""]
+        else:
+            weathers = [w["name"] for w in builder.config(config_path)["weather_conditions"]]
+        if weather_filter and kind != "cloud":
+            weathers = [name for name in weathers if name in weather_filter]
+        for item in items:
+            for weather in weathers:
+                yield builder.record(slot, kind, config_path, region, item, weather)
+                slot += 1
+
+
+def calibrate(estimator: ThroughputEstimator, events_path: str) -> int:
+    """Feed measured execution times of earlier runs (RunMetrics event log); returns the sample count"""
+    samples = 0
+    if not events_path or not os.path.exists(events_path):
+        return samples
+    with open(events_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            labels, timings = event.get("labels") or {}, event.get("timings") or {}
+            seconds = timings.get("execution") or timings.get("total")
+            if event.get("event") != "finished" or event.get("status") != "success" or not seconds:
+                continue
+            if labels.get("resolution"):
+                estimator.add(f"{labels.get('kind', 'job')} {labels['resolution']}", seconds)
+                samples += 1
+    return samples
+
+
+def record_class(record: Dict) -> str:
+    """progress.job_class of the record's job (resort cities render as 'city' jobs)"""
+    kind = record["kind"] if record["kind"] in ("fallback", "cloud") else "city"
+    return f"{kind} {record['resolution']}"
+
+
+def estimate(records: List[Dict], estimator: ThroughputEstimator, backends: int = 1) -> Dict:
+    """GPU seconds per job class and wall time over the given number of backends"""
+    classes = Counter(record_class(record) for record in records)
+    rows = {}
+    for key, count in sorted(classes.items()):
+        seconds = estimator.estimate(key)
+        rows[key] = {"jobs": count, "seconds_per_image": round(seconds, 1), "gpu_seconds": round(count * seconds, 1),
+                     "megapixels": round(count * class_pixels(key) / 1e6, 1)}
+    gpu_seconds = sum(row["gpu_seconds"] for row in rows.values())
+    return {"classes": rows, "jobs": len(records), "gpu_seconds": round(gpu_seconds, 1),
+            "backends": backends, "wall_seconds": round(gpu_seconds / max(1, backends), 1)}
+
+
+def print_estimate(cost: Dict):
+    print("\n💰 Cost estimate:")
+    for key, row in cost["classes"].items():
+        print(f"   {key}: {row['jobs']} images x {format_seconds(row['seconds_per_image'])} = "
+              f"{format_seconds(row['gpu_seconds'])} GPU ({row['megapixels']} MP)")
+    print(f"   Total: {cost['jobs']} images, {format_seconds(cost['gpu_seconds'])} GPU time, "
+          f"~{format_seconds(cost['wall_seconds'])} on {cost['backends']} backend(s)")
+
+
+def write_plan(path: str, header: Dict, records: List[Dict]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+    os.replace(tmp_path, path)
+
+
+def parse_slots(shard: str = None, slots: str = None) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+    """'K/N' -> (K, N) with 1 <= K <= N; 'A:B' -> (A, B) (either end may be empty)"""
+    shard_range = slot_range = None
+    if shard:
+        try:
+            index, count = (int(part) for part in shard.split("/"))
+        except ValueError:
+            raise PlanError(f"Invalid shard '{shard}', expected K/N")
+        if not 1 <= index <= count:
+            raise PlanError(f"Invalid shard '{shard}', K must be between 1 and N")
+        shard_range = (index, count)
+    if slots:
+        start, _, end = slots.partition(":")
+        try:
+            slot_range = (int(start) if start else 0, int(end) if end else sys.maxsize)
+        except ValueError:
+            raise PlanError(f"Invalid slots '{slots}', expected A:B")
+    return shard_range, slot_range
+
+
+def load_plan(path: str, shard: str = None, slots: str = None) -> Tuple[Dict, List[Dict]]:
+    """Header and the records of the requested slice
+
+    Shards interleave slots (slot % N == K - 1) so every worker gets the same
+    mix of resolutions; slots A:B is a half-open range.
+    """
+    shard_range, slot_range = parse_slots(shard, slots)
+    with open(path, "r", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("plan") != PLAN_VERSION:
+            raise PlanError(f"{path} is not a version {PLAN_VERSION} job plan")
+        records = []
+        for line in f:
+            record = json.loads(line)
+            if shard_range and record["slot"] % shard_range[1] != shard_range[0] - 1:
+                continue
+            if slot_range and not slot_range[0] <= record["slot"] < slot_range[1]:
+                continue
+            records.append(record)
+    return header, records
+
+
+def check_configs(header: Dict):
+    """Refuse plans whose configs changed since compilation (their IDs would not match)"""
+    for path, digest in header.get("configs", {}).items():
+        if not os.path.exists(path):
+            raise PlanError(f"Config {path} of the plan is missing")
+        if file_digest(path) != digest:
+            raise PlanError(f"Config {path} changed since the plan was compiled, compile it again")
+
+
+def describe(record: Dict) -> str:
+    weather = f" - {record['weather']}" if record['weather'] else ""
+    return f"#{record['slot']} {record['region']}/{record['item']}{weather}"
+
+
+def generator_settings(header: Dict) -> Tuple[str, bool, str, int]:
+    """(seed salt, split prompt, quality, candidates) the plan's jobs were built with; all are part of every job ID"""
+    return (header.get("seed_salt", ""), header.get("split_prompt", False),
+            header.get("quality", "final"), header.get("candidates", 1))
+
+
+def create_generator(args, header: Dict) -> RegionalBatchGenerator:
+    seed_salt, split_prompt, quality, candidates = generator_settings(header)
+    if candidates > 1 and not image_quality.available():
+        raise PlanError("The plan renders several candidates per prompt, which needs numpy and pillow "
+                        "(pip install numpy pillow)")
+    if args.quality_gate and not image_quality.available():
+        raise PlanError("--quality-gate needs numpy and pillow (pip install numpy pillow)")
+    return RegionalBatchGenerator(
+        server_url=args.server, ledger_path=args.ledger, cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_gb=args.cache_max_gb, output_dir=args.output_dir, seed_salt=seed_salt,
+        on_interrupt=args.on_interrupt, keep_history=args.keep_history, events_log=args.events_log,
+        prom_file=args.prom_file, progress_interval=args.progress_interval, sample_interval=args.sample_interval,
+        split_prompt=split_prompt, quality=quality, candidates=candidates,
+        quality_gate=args.quality_gate, gate_retries=args.gate_retries
+    )
+
+
+def gate_options(generator: RegionalBatchGenerator) -> Dict:
+    """run_batch options for the generator's candidate selection and quality gate
+
+    Only city and resort renders are gated (per city, like the generator
+    scripts); fallback and cloud renders always pass.
+    """
+    generator.gate = image_quality.QualityGate() if generator.quality_gate else None
+    if generator.gate is None:
+        return {"output_handler": generator.select_candidate}
+
+    def check_render(job: Dict, paths: List[str]) -> Optional[str]:
+        return generator.check_render(job, paths) if 'city' in job else None
+
+    return {"output_handler": generator.select_candidate, "quality_gate": check_render,
+            "defect_retries": generator.gate_retries}
+
+
+def build_checked(builder: PlanBuilder, record: Dict) -> Dict:
+    """Job of a record; PlanError when the workflow no longer matches the record's ID"""
+    job = builder.build(record["kind"], record["config"], record["region"], record["item"], record["weather"])
+    if plan_id(JobLedger.job_key(job)) != record["id"]:
+        raise PlanError(f"Slot {record['slot']} no longer matches its plan ID "
+                        f"(generator code or seed salt changed), compile the plan again")
+    job['plan'] = record
+    return job
+
+
+def compile_plan(args):
+    configs = {"city": args.config, "resort": args.resort_config, "fallback": args.fallback_config}
+    if args.candidates < 1:
+        raise PlanError("--candidates must be at least 1")
+    generator = RegionalBatchGenerator(ledger_path=None, cache_dir=None, seed_salt=args.seed_salt,
+                                       split_prompt=args.split_prompt, quality=args.quality,
+                                       candidates=args.candidates)
+    builder = PlanBuilder(generator)
+    records = list(expand(builder, configs, args.regions, args.resorts, args.fallbacks, args.weather,
+                          args.priority, args.clouds))
+    if not records:
+        raise PlanError("The selection is empty, nothing to plan")
+
+    def workflow_of(record: Dict) -> Dict:
+        return builder.build(record["kind"], record["config"], record["region"], record["item"], record["weather"])['workflow']
+
+    if args.order == "reuse":
+        records = reuse_order(records, workflow_of)
+        for slot, record in enumerate(records):
+            record["slot"] = slot
+    reuse = count_reuse([workflow_of(record) for record in records])
+
+    estimator = ThroughputEstimator()
+    measured = calibrate(estimator, args.events_log)
+    cost = estimate(records, estimator, args.backends)
+    used_configs = sorted({record["config"] for record in records if record["config"]})
+    header = {
+        "plan": PLAN_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed_salt": args.seed_salt,
+        "split_prompt": args.split_prompt,
+        "quality": args.quality,
+        "candidates": args.candidates,
+        "order": args.order,
+        "configs": {path: file_digest(path) for path in used_configs},
+        "jobs": len(records),
+        "by_kind": dict(Counter(record["kind"] for record in records)),
+        "estimate": cost
+    }
+    write_plan(args.output, header, records)
+
+    print(f"🗺️ Job plan compiled: {args.output}")
+    for kind, count in header["by_kind"].items():
+        print(f"   {kind}: {count} images")
+    print(f"   Configs: {', '.join(used_configs)}")
+    print(f"   Quality: {args.quality}" + (f", {args.candidates} candidates per prompt" if args.candidates > 1 else ""))
+    print(f"   Order: {args.order} ({reuse['negative']} of {len(records) - 1} consecutive jobs keep the negative prompt, "
+          f"{reuse['resolution']} the resolution)")
+    source = f"{measured} measured renders from {args.events_log}" if measured else "default render times"
+    print(f"   Estimate based on {source}")
+    print_estimate(cost)
+
+
+def run_plan(args) -> bool:
+    header, records = load_plan(args.plan, args.shard, args.slots)
+    check_configs(header)
+    label = " ".join(part for part in (f"shard {args.shard}" if args.shard else "",
+                                       f"slots {args.slots}" if args.slots else "") if part) or "all slots"
+    print(f"🗺️ Plan {args.plan}: {len(records)} of {header['jobs']} images ({label})")
+    if not records:
+        return True
+
+    generator = create_generator(args, header)
+    builder = PlanBuilder(generator)
+    # Workflows are cheap to build: check every ID before anything is queued
+    for record in records:
+        build_checked(builder, record)
+    estimator = ThroughputEstimator()
+    calibrate(estimator, args.events_log)
+    print_estimate(estimate(records, estimator, len(generator.clients)))
+    print("=" * 60)
+
+    plan = Counter(record_class(record) for record in records)
+    progress = BatchProgress(len(records), plan=plan, parallelism=len(generator.clients),
+                             interval=args.progress_interval)
+    counts = Counter()
+
+    def plan_jobs():
+        # Jobs are built again lazily; only the in-flight ones hold a workflow
+        for record in records:
+            yield build_checked(builder, record)
+
+    def on_submit(job: Dict, prompt_id: str):
+        progress.note(f"📤 Queued: {describe(job['plan'])} ({prompt_id} @ {job['backend']})")
+
+    def on_result(job: Dict, success: bool):
+        status = job.get('status')
+        if success:
+            counts['cached' if job.get('cached') else 'success'] += 1
+            progress.note(f"{'♻️ Cached' if job.get('cached') else '✅ Completed'}: {describe(job['plan'])}")
+        elif status == 'cancelled':
+            counts['cancelled'] += 1
+            progress.alert(f"🛑 Cancelled: {describe(job['plan'])}")
+        else:
+            counts['failed'] += 1
+            progress.alert(f"❌ Failed: {describe(job['plan'])} ({job.get('error')})")
+
+    metrics = RunMetrics(args.events_log, args.prom_file, job_name="job_plan")
+    metrics.event("batch", plan=args.plan, shard=args.shard, slots=args.slots, images=len(records))
+    progress.start()
+    try:
+        dispatcher = run_batch(generator.clients, plan_jobs(), queue_depth=args.queue_depth,
+                               on_submit=on_submit, on_result=on_result,
+                               ledger=generator.ledger, resume=args.resume, retry_failed=args.retry_failed,
+                               cache=generator.cache, output_dir=generator.output_dir,
+                               on_interrupt=generator.on_interrupt, keep_history=generator.keep_history,
+                               metrics=metrics, progress=progress, sample_interval=generator.sample_interval,
+                               **gate_options(generator))
+    finally:
+        progress.close()
+        metrics.close()
+
+    print("\n" + "=" * 60)
+    print(f"🛑 Plan slice stopped ({dispatcher.stop_mode})" if dispatcher.stop_mode else "🎉 Plan slice completed!")
+    print(f"✅ Success: {counts['success'] + counts['cached']} ({counts['cached']} from cache)")
+    print(f"❌ Failed: {counts['failed']}")
+    if counts['cancelled']:
+        print(f"🛑 Cancelled: {counts['cancelled']}")
+        print("↩️ Run the same slice again with --resume to finish it")
+    if generator.ledger and generator.ledger.skipped:
+        print(f"⏭️ Skipped (recorded in ledger): {generator.ledger.skipped}")
+    dispatcher.print_utilization()
+    for client in generator.clients:
+        client.print_stats()
+    if generator.cache:
+        generator.cache.print_report()
+    if generator.gate:
+        generator.gate.print_report()
+    metrics.print_percentiles("kind", "Timings by kind")
+    return counts['failed'] == 0 and not dispatcher.stop_mode
+
+
+def enqueue_plans(args):
+    queue = WorkQueue(args.queue)
+    settings = {generator_settings(header) for header in queue.plans().values()}
+    for path in args.plans:
+        header, records = load_plan(path)
+        check_configs(header)
+        # Workers build every job with one generator, so one seed salt and prompt encoding per queue
+        if settings and generator_settings(header) not in settings:
+            raise PlanError(f"{path} uses another seed salt, --split-prompt, --quality or --candidates "
+                            f"than the plans already in {args.queue}")
+        settings.add(generator_settings(header))
+        added = queue.add_plan(os.path.basename(path), header, records)
+        print(f"📥 {path}: {added} of {len(records)} jobs added to {args.queue}")
+    if args.retry_failed:
+        print(f"🔁 {queue.retry_failed()} failed jobs are pending again")
+    queue.close()
+
+
+def queue_status_line(queue: WorkQueue, stale_after: float) -> str:
+    """Aggregate progress over every worker of the queue"""
+    counts = queue.counts()
+    total = sum(counts.values())
+    done = counts.get("done", 0)
+    remaining = counts.get(PENDING, 0) + counts.get(CLAIMED, 0) + counts.get("expired", 0)
+    workers = queue.workers(stale_after)
+    alive = [row for row in workers if row["state"] == "alive"]
+    rate = queue.throughput()
+    if rate:
+        eta = format_seconds(remaining / rate * 3600)
+    else:
+        measured = [row["avg_seconds"] for row in workers if row["avg_seconds"]]
+        eta = format_seconds(remaining * sum(measured) / len(measured) / len(alive)) if measured and alive else "n/a"
+    parts = [f"{done}/{total} done ({done / total * 100 if total else 100:.0f}%)",
+             f"{counts.get(CLAIMED, 0)} claimed by {len(alive)} workers",
+             f"{counts.get(PENDING, 0)} pending",
+             f"{rate:.0f} img/h" if rate else "measuring...",
+             f"ETA {eta}"]
+    if counts.get("failed"):
+        parts.append(f"{counts['failed']} failed")
+    if counts.get("expired"):
+        parts.append(f"{counts['expired']} leases expired")
+    return " | ".join(parts)
+
+
+def print_queue_status(queue: WorkQueue, stale_after: float):
+    print(f"📊 Queue {queue.path}: {queue_status_line(queue, stale_after)}")
+    for row in queue.workers(stale_after):
+        icon = {"alive": "🟢", "lost": "🔴", "stopped": "⚪"}[row["state"]]
+        avg = f"{format_seconds(row['avg_seconds'])}/image" if row["avg_seconds"] else "n/a"
+        print(f"   {icon} {row['worker']} [{row['state']}, heartbeat {format_seconds(row['heartbeat_age'])} ago]: "
+              f"{row['done']} done, {row['failed']} failed, {row['claimed']} claimed, {avg} ({row['servers']})")
+
+
+def show_status(args):
+    queue = WorkQueue(args.queue)
+    try:
+        while True:
+            print_queue_status(queue, args.lease)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+            print()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+
+
+def run_worker(args) -> bool:
+    """Claim jobs from the shared queue until none are left (or the worker is stopped)"""
+    queue = WorkQueue(args.queue)
+    plans = queue.plans()
+    if not plans:
+        raise PlanError(f"{args.queue} holds no plan, add one with 'enqueue' first")
+    for header in plans.values():
+        check_configs(header)
+    worker = args.worker_id or default_worker_id()
+    generator = create_generator(args, next(iter(plans.values())))
+    builder = PlanBuilder(generator)
+    queue.register_worker(worker, [client.server_url for client in generator.clients])
+    keeper = LeaseKeeper(args.queue, worker, args.lease).start()
+    print(f"👷 Worker {worker} on {', '.join(client.server_url for client in generator.clients)} "
+          f"(lease {format_seconds(args.lease)})")
+    print_queue_status(queue, args.lease)
+    print("=" * 60)
+
+    counts = Counter()
+    last_status = time.time()
+
+    def claimed_jobs():
+        # One claim per job pulled: the orchestrator only asks when it can submit
+        while True:
+            record = queue.claim(worker, args.lease)
+            if record is None:
+                return
+            try:
+                yield build_checked(builder, record)
+            except PlanError as e:
+                print(f"❌ {describe(record)}: {e}")
+                queue.finish(record["id"], worker, False, str(e))
+
+    def on_submit(job: Dict, prompt_id: str):
+        print(f"📤 Queued: {describe(job['plan'])} ({prompt_id} @ {job['backend']})")
+
+    def on_result(job: Dict, success: bool):
+        nonlocal last_status
+        record = job['plan']
+        if job.get('status') == 'cancelled':
+            counts['cancelled'] += 1
+            queue.release(record["id"], worker)
+            print(f"🛑 Cancelled: {describe(record)} (handed back to the queue)")
+            return
+        if not queue.finish(record["id"], worker, success, job.get('error') or job.get('status'),
+                            job.get('timings', {}).get('total')):
+            counts['stale'] += 1
+            print(f"⚠️ Stale result dropped: {describe(record)} (lease expired, the job was claimed again)")
+            return
+        counts['success' if success else 'failed'] += 1
+        if success:
+            print(f"{'♻️ Cached' if job.get('cached') else '✅ Completed'}: {describe(record)}")
+        else:
+            print(f"❌ Failed: {describe(record)} ({job.get('error')})")
+        if time.time() - last_status >= args.progress_interval:
+            last_status = time.time()
+            print(f"📊 Cluster: {queue_status_line(queue, args.lease)}")
+
+    metrics = RunMetrics(args.events_log, args.prom_file, job_name="plan_worker")
+    metrics.event("worker", worker=worker, queue=args.queue)
+    stopped = None
+    try:
+        while True:
+            dispatcher = run_batch(generator.clients, claimed_jobs(), queue_depth=args.queue_depth,
+                                   on_submit=on_submit, on_result=on_result, ledger=generator.ledger,
+                                   cache=generator.cache, output_dir=generator.output_dir,
+                                   on_interrupt=generator.on_interrupt, keep_history=generator.keep_history,
+                                   metrics=metrics, sample_interval=generator.sample_interval,
+                                   **gate_options(generator))
+            stopped = dispatcher.stop_mode
+            if stopped:
+                break
+            if queue.claimable():
+                continue
+            held = queue.counts().get(CLAIMED, 0)
+            if not held:
+                break
+            # Another worker may still crash: stay around until its leases are settled
+            print(f"⏳ {held} jobs held by other workers, checking again in {format_seconds(args.poll_interval)}")
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        stopped = "interrupted"
+    finally:
+        keeper.stop()
+        released = queue.release_worker(worker)
+        metrics.close()
+
+    print("\n" + "=" * 60)
+    print(f"🛑 Worker {worker} stopped ({stopped})" if stopped else f"🎉 Worker {worker} finished: queue drained")
+    print(f"✅ Success: {counts['success']}")
+    print(f"❌ Failed: {counts['failed']}")
+    if counts['stale']:
+        print(f"⚠️ Stale results dropped: {counts['stale']}")
+    if counts['cancelled'] or released:
+        print(f"↩️ Handed back to the queue: {counts['cancelled'] + released}")
+    for client in generator.clients:
+        client.print_stats()
+    if generator.gate:
+        generator.gate.print_report()
+    metrics.print_percentiles("kind", "Timings by kind")
+    print_queue_status(queue, args.lease)
+    queue.close()
+    return counts['failed'] == 0 and not stopped
+
+
+def add_execution_arguments(parser: argparse.ArgumentParser):
+    """Options shared by 'run' and 'work': where and how jobs render"""
+    parser.add_argument("--server", "-s", nargs="+", default=["http://127.0.0.1:8000"], help="ComfyUI server URL(s)")
+    parser.add_argument("--queue-depth", "-q", type=int, default=1, help="Prompts kept enqueued on ComfyUI (1 = sequential)")
+    parser.add_argument("--ledger", default="job_ledger.db", help="Job ledger (SQLite) path")
+    parser.add_argument("--cache-dir", default=".image_cache", help="Local image cache directory")
+    parser.add_argument("--cache-max-gb", type=float, default=2.0, help="Image cache size limit (LRU eviction)")
+    parser.add_argument("--no-cache", action="store_true", help="Always render, bypassing the image cache")
+    parser.add_argument("--output-dir", default=".", help="Local directory the images are downloaded to")
+    parser.add_argument("--on-interrupt", choices=["drain", "abort"], default=DRAIN,
+                        help="Ctrl-C: drain finishes queued images, abort cancels them on ComfyUI (a second Ctrl-C always aborts)")
+    parser.add_argument("--keep-history", type=int, default=0, help="Finished prompts left in ComfyUI history for debugging")
+    parser.add_argument("--events-log", default="batch_events.jsonl", help="JSONL log of job events and per-phase timings")
+    parser.add_argument("--prom-file", help="Prometheus textfile (node_exporter textfile collector) for job timing metrics")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines when output is not a terminal")
+    parser.add_argument("--sample-interval", type=float, default=5, help="Seconds between /system_stats + /queue samples (0 disables)")
+    parser.add_argument("--quality-gate", action="store_true",
+                        help="Check every city render and re-queue defective ones with a new seed (needs numpy and pillow)")
+    parser.add_argument("--gate-retries", type=int, default=2, help="Re-queues per image before the quality gate gives up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the global generation matrix into a job plan and run it in slices or through a shared work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="Expand regions, resorts and fallbacks x weather into a plan file")
+    compile_parser.add_argument("--output", "-o", default="job_plan.jsonl", help="Plan file to write (JSONL)")
+    compile_parser.add_argument("--config", default=DEFAULT_CONFIGS["city"], help="City configuration file")
+    compile_parser.add_argument("--resort-config", default=DEFAULT_CONFIGS["resort"], help="Resort configuration file")
+    compile_parser.add_argument("--fallback-config", default=DEFAULT_CONFIGS["fallback"], help="Regional fallback configuration file")
+    compile_parser.add_argument("--regions", nargs="+", help="City regions to include ('all' by default, 'none' to skip)")
+    compile_parser.add_argument("--resorts", nargs="+", help="Resort categories to include ('all' by default, 'none' to skip)")
+    compile_parser.add_argument("--fallbacks", nargs="+", help="Regional fallbacks to include ('all' by default, 'none' to skip)")
+    compile_parser.add_argument("--priority", nargs="+", type=int, choices=[1, 2, 3], help="Only fallbacks of these priorities")
+    compile_parser.add_argument("--clouds", nargs="+", help="Single cloud styles to include ('all'; none by default)")
+    compile_parser.add_argument("--order", choices=["reuse", "config"], default="reuse",
+                                help="reuse: group jobs sharing models, LoRA, negative prompt and resolution "
+                                     "for ComfyUI's node cache; config: config file order")
+    compile_parser.add_argument("--weather", "-w", nargs="+", help="Weather conditions to include (default: all)")
+    compile_parser.add_argument("--seed-salt", default="", help="Salt mixed into the per image seeds")
+    compile_parser.add_argument("--split-prompt", action="store_true",
+                                help="City jobs encode landmark and weather prompts separately (cached landmark encoding)")
+    compile_parser.add_argument("--quality", default="final",
+                                help="Quality profile of city and resort jobs from the configs' settings.quality_profiles")
+    compile_parser.add_argument("--candidates", type=int, default=1,
+                                help="Candidates per city/resort prompt in one latent batch, the best-scoring one is kept "
+                                     "(running the plan needs numpy and pillow)")
+    compile_parser.add_argument("--events-log", default="batch_events.jsonl", help="Event log of earlier runs used to calibrate the estimate")
+    compile_parser.add_argument("--backends", type=int, default=1, help="Backends assumed for the wall time estimate")
+
+    run_parser = commands.add_parser("run", help="Execute a slice of a plan")
+    run_parser.add_argument("plan", help="Plan file written by 'compile'")
+    run_parser.add_argument("--shard", help="Run every N-th slot: K/N (1-based), e.g. 2/4 on the second of four workers")
+    run_parser.add_argument("--slots", help="Run the slot range A:B (half-open, either end optional)")
+    run_parser.add_argument("--resume", action="store_true", help="Skip images the job ledger records as done or failed")
+    run_parser.add_argument("--retry-failed", action="store_true", help="Re-run only images the job ledger records as failed")
+    add_execution_arguments(run_parser)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Add plans to a shared work queue")
+    enqueue_parser.add_argument("plans", nargs="+", help="Plan files written by 'compile'")
+    enqueue_parser.add_argument("--queue", default="work_queue.db", help="Work queue (SQLite, may be on a shared volume)")
+    enqueue_parser.add_argument("--retry-failed", action="store_true", help="Make failed jobs of the queue pending again")
+
+    work_parser = commands.add_parser("work", help="Claim and render jobs from a shared work queue")
+    work_parser.add_argument("--queue", default="work_queue.db", help="Work queue (SQLite, may be on a shared volume)")
+    work_parser.add_argument("--worker-id", help="Name shown in the status view (default: <host>-<pid>)")
+    work_parser.add_argument("--lease", type=float, default=120, help="Seconds a claim stays valid without heartbeats")
+    work_parser.add_argument("--poll-interval", type=float, default=30, help="Seconds between checks while other workers hold the last jobs")
+    add_execution_arguments(work_parser)
+
+    status_parser = commands.add_parser("status", help="Aggregate progress of a shared work queue")
+    status_parser.add_argument("--queue", default="work_queue.db", help="Work queue (SQLite)")
+    status_parser.add_argument("--lease", type=float, default=120, help="Workers silent for longer are shown as lost")
+    status_parser.add_argument("--watch", type=float, help="Refresh every N seconds")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "compile":
+            compile_plan(args)
+        elif args.command == "enqueue":
+            enqueue_plans(args)
+        elif args.command == "status":
+            show_status(args)
+        elif args.command == "work":
+            if not run_worker(args):
+                sys.exit(1)
+        elif not run_plan(args):
+            sys.exit(1)
+    except (PlanError, FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
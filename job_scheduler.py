@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Cache-aware job ordering
+ComfyUI skips every node whose inputs match the previous prompt: the model
+loaders, the LoRA, the shared negative CLIPTextEncode and the empty latent.
+Sending jobs grouped by model, LoRA and resolution, with identical negative
+prompts next to each other, lets consecutive prompts reuse that subgraph
+instead of reloading and re-encoding it. The negative prompt outranks the
+resolution: encoding it (T5 on the CPU in these workflows) costs far more
+than allocating a new empty latent.
+"""
+
+import json
+from typing import Callable, Dict, List, Tuple
+
+LATENT_NODES = ("EmptySD3LatentImage", "EmptyLatentImage")
+
+
+def _literals(node: Dict) -> str:
+    """The node's class and inputs without links, as a comparable string"""
+    inputs = {name: value for name, value in node.get("inputs", {}).items() if not isinstance(value, list)}
+    return json.dumps([node.get("class_type"), inputs], sort_keys=True, ensure_ascii=False)
+
+
+def reuse_key(workflow: Dict) -> Tuple[str, str, str, str]:
+    """(models, LoRA, negative prompt, resolution) of an API-format workflow
+
+    Jobs with equal leading parts share the corresponding cached nodes on the
+    server; the order of the parts is the grouping priority.
+    """
+    nodes = workflow.values()
+    models = sorted(_literals(node) for node in nodes
+                    if node.get("class_type", "").endswith("Loader") and node.get("class_type") != "LoraLoader")
+    loras = sorted(_literals(node) for node in nodes if node.get("class_type") == "LoraLoader")
+    resolution = sorted(_literals(node) for node in nodes if node.get("class_type") in LATENT_NODES)
+
+    negative = ""
+    for node in nodes:
+        link = node.get("inputs", {}).get("negative")
+        if node.get("class_type") == "KSampler" and isinstance(link, list):
+            negative = str(workflow.get(str(link[0]), {}).get("inputs", {}).get("text", ""))
+            break
+    return "|".join(models), "|".join(loras), negative, "|".join(resolution)
+
+
+def reuse_order(items: List, workflow_of: Callable[[object], Dict] = lambda job: job['workflow']) -> List:
+    """Items reordered so jobs sharing a reuse_key prefix run back to back
+
+    Groups keep the order in which they first appear and items keep their
+    order inside a group, so an already grouped list comes back unchanged.
+    """
+    keys = [reuse_key(workflow_of(item)) for item in items]
+    ranks = {}
+    sort_keys = [tuple(ranks.setdefault(key[:depth + 1], len(ranks)) for depth in range(len(key))) for key in keys]
+    order = sorted(range(len(items)), key=lambda index: (sort_keys[index], index))
+    return [items[index] for index in order]
+
+
+def count_reuse(workflows: List[Dict]) -> Dict[str, int]:
+    """How many consecutive prompts keep the models, LoRA, resolution and negative prompt of the previous one"""
+    counts = {"models": 0, "lora": 0, "negative": 0, "resolution": 0}
+    previous = None
+    for workflow in workflows:
+        key = reuse_key(workflow)
+        if previous is not None:
+            for name, part, last in zip(counts, key, previous):
+                counts[name] += part == last
+        previous = key
+    return counts
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of rendered images
+Entries are keyed by the hash of the fully built workflow (seed included), so
+an unchanged job is served from disk instead of being rendered again. Image
+bytes are stored once per content digest; the least recently used entries are
+evicted when the store grows past its size limit.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from job_ledger import workflow_hash
+
+SEED_RANGE = 2 ** 32
+
+
+def deterministic_seed(*parts, salt: str = "") -> int:
+    """Seed derived from the job identity (e.g. city and weather) plus a salt"""
+    text = "|".join(str(part) for part in parts) + f"|{salt}"
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big") % SEED_RANGE
+
+
+class OutputCache:
+    """Workflow hash -> rendered images, with size-bounded LRU eviction"""
+
+    def __init__(self, root: str = ".image_cache", max_bytes: int = 2 * 1024 ** 3):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.max_bytes = max_bytes
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        # Output handlers store from worker threads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                key TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                subfolder TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_key ON files (key);
+            CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+        """)
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    @staticmethod
+    def key_for(workflow: Dict) -> str:
+        return workflow_hash(workflow)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def lookup(self, key: str) -> Optional[List[Dict]]:
+        """Cached images for key ([{'filename', 'subfolder', 'path'}]) or None on a miss"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT filename, subfolder, digest FROM files WHERE key=?", (key,)
+            ).fetchall()
+            images = [
+                {"filename": filename, "subfolder": subfolder, "path": self._object_path(digest)}
+                for filename, subfolder, digest in rows
+            ]
+            if not images or not all(os.path.exists(image["path"]) for image in images):
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return images
+
+    def store(self, key: str, files: List[Dict]):
+        """Add downloaded images ({'filename', 'subfolder', 'path', 'size', 'sha256'}) for key,
+        then evict down to max_bytes"""
+        blobs = []
+        for image in files:
+            digest = image["sha256"]
+            path = self._object_path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                shutil.copyfile(image["path"], tmp_path)
+                os.replace(tmp_path, path)
+            blobs.append((key, image["filename"], image.get("subfolder", ""), digest, image["size"]))
+
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM files WHERE key=?", (key,))
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", blobs)
+            self.conn.execute(
+                "INSERT INTO entries VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET last_used=excluded.last_used",
+                (key, now, now)
+            )
+            self.conn.commit()
+            self.stored += 1
+            self._evict()
+
+    def total_bytes(self) -> int:
+        row = self.conn.execute("SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM files)").fetchone()
+        return row[0] or 0
+
+    def _evict(self):
+        total = self.total_bytes()
+        while total > self.max_bytes:
+            row = self.conn.execute("SELECT key FROM entries ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            key = row[0]
+            digests = [d for (d,) in self.conn.execute("SELECT DISTINCT digest FROM files WHERE key=?", (key,))]
+            self.conn.execute("DELETE FROM files WHERE key=?", (key,))
+            self.conn.execute("DELETE FROM entries WHERE key=?", (key,))
+            for digest in digests:
+                # Identical images may be shared by several entries
+                if not self.conn.execute("SELECT 1 FROM files WHERE digest=? LIMIT 1", (digest,)).fetchone():
+                    try:
+                        os.remove(self._object_path(digest))
+                    except FileNotFoundError:
+                        pass
+            self.conn.commit()
+            self.evicted += 1
+            total = self.total_bytes()
+
+    @staticmethod
+    def materialize(images: List[Dict], output_dir: str) -> List[str]:
+        """Copy cached images to output_dir/<subfolder>/<filename> (atomically)"""
+        paths = []
+        for image in images:
+            target = os.path.join(output_dir, image["subfolder"], image["filename"])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.{threading.get_ident()}.part"
+            shutil.copyfile(image["path"], tmp_path)
+            os.replace(tmp_path, target)
+            paths.append(target)
+        return paths
+
+    def report(self) -> Dict:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self.total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes
+        }
+
+    def print_report(self):
+        report = self.report()
+        print(f"🗄️ Cache: {report['hits']} hits, {report['misses']} misses ({report['hit_rate'] * 100:.0f}% hit rate), "
+              f"{report['entries']} entries, {report['bytes'] / 1024 ** 2:.1f}/{report['max_bytes'] / 1024 ** 2:.0f} MB, "
+              f"{report['evicted']} evicted")
+
+    def close(self):
+        self.conn.close()
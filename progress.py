@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Batch progress and throughput-based ETA
+Seconds per image are measured per job class (kind + resolution) over a
+rolling window; the ETA is the remaining work divided over the backends.
+On a terminal a single status line replaces the per-image output, otherwise
+one progress line is printed every interval seconds.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from job_ledger import workflow_resolution
+from run_metrics import format_seconds
+
+# Seconds per 1024x1024 image before anything was measured (FLUX Krea on one GPU)
+DEFAULT_SECONDS = 180.0
+REFERENCE_PIXELS = 1024 * 1024
+
+
+def job_class(job: Dict) -> str:
+    """'<kind> <width>x<height>' used to group throughput samples"""
+    labels = job.get("labels", {})
+    resolution = labels.get("resolution") or workflow_resolution(job.get("workflow", {})) or "?"
+    return f"{labels.get('kind', 'job')} {resolution}"
+
+
+def class_pixels(key: str) -> int:
+    try:
+        width, height = key.rsplit(" ", 1)[1].split("x")
+        return int(width) * int(height)
+    except (IndexError, ValueError):
+        return REFERENCE_PIXELS
+
+
+class ThroughputEstimator:
+    """Rolling mean seconds per image for each job class"""
+
+    def __init__(self, window: int = 20, default_seconds: float = DEFAULT_SECONDS):
+        self.window = window
+        self.default_seconds = default_seconds
+        self.samples = {}
+
+    def add(self, key: str, seconds: float):
+        self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def estimate(self, key: str) -> float:
+        """Measured mean for key; unmeasured classes are scaled by pixel count from the measured ones"""
+        if self.samples.get(key):
+            return sum(self.samples[key]) / len(self.samples[key])
+        pixels = class_pixels(key)
+        scaled = [sum(values) / len(values) * pixels / class_pixels(other)
+                  for other, values in self.samples.items() if values]
+        if scaled:
+            return sum(scaled) / len(scaled)
+        return self.default_seconds * pixels / REFERENCE_PIXELS
+
+
+class BatchProgress:
+    """done/total, images per hour, ETA and queue depth for one batch
+
+    plan maps job classes to their planned counts; without it the remaining
+    jobs are assumed to follow the mix submitted so far. live defaults to
+    whether stream is a terminal.
+    """
+
+    def __init__(self, total: int, plan: Dict[str, int] = None, parallelism: int = 1,
+                 interval: float = 30, stream=None, live: Optional[bool] = None):
+        self.total = total
+        self.plan = Counter(plan or {})
+        self.parallelism = max(1, parallelism)
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.live = self.stream.isatty() if live is None else live
+        self.estimator = ThroughputEstimator()
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.submitted = Counter()
+        self.done = Counter()
+        self.succeeded = 0
+        self.failed = 0
+        self.cached = 0
+        self.skipped = 0
+        # Jobs submitted and not reported yet (a moved job is submitted again)
+        self.active = set()
+        # Completion times of rendered images for the images/hour figure
+        self.completions = deque(maxlen=20)
+        self._line_width = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="batch-progress", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # A live line ticks every second so the ETA counts down between completions
+        while not self._stop.wait(1 if self.live else self.interval):
+            self.render()
+
+    def job_submitted(self, job: Dict):
+        with self.lock:
+            if id(job) not in self.active:
+                self.active.add(id(job))
+                self.submitted[job_class(job)] += 1
+
+    def job_finished(self, job: Dict, success: bool):
+        key = job_class(job)
+        with self.lock:
+            self.done[key] += 1
+            self.active.discard(id(job))
+            if job.get("cached"):
+                self.cached += 1
+            else:
+                timings = job.get("timings", {})
+                seconds = timings.get("execution") or timings.get("total")
+                if success and seconds:
+                    self.estimator.add(key, seconds)
+                    self.completions.append(time.time())
+            if success:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        if self.live:
+            self.render()
+
+    def images_per_hour(self) -> float:
+        with self.lock:
+            completions = list(self.completions)
+        if len(completions) < 2 or completions[-1] <= completions[0]:
+            return 0.0
+        return (len(completions) - 1) / (completions[-1] - completions[0]) * 3600
+
+    def eta(self) -> float:
+        """Seconds until every remaining job is rendered"""
+        with self.lock:
+            finished = sum(self.done.values())
+            remaining_total = max(0, self.total - self.skipped - finished)
+            if self.plan:
+                remaining = {key: max(0, count - self.done[key]) for key, count in self.plan.items()}
+                # Jobs skipped through the ledger never report; scale the plan down to what is left
+                planned = sum(remaining.values())
+                if planned > remaining_total:
+                    remaining = {key: count * remaining_total / planned for key, count in remaining.items()}
+            elif self.submitted:
+                # Spread what is left like the jobs seen so far
+                seen = sum(self.submitted.values())
+                remaining = {key: remaining_total * count / seen for key, count in self.submitted.items()}
+            else:
+                remaining = {"job ?": remaining_total}
+            work = sum(count * self.estimator.estimate(key) for key, count in remaining.items())
+        return work / self.parallelism
+
+    def status_line(self) -> str:
+        with self.lock:
+            finished = sum(self.done.values())
+            total = max(0, self.total - self.skipped)
+            in_flight, failed, cached = len(self.active), self.failed, self.cached
+        percent = finished / total * 100 if total else 100.0
+        rate = self.images_per_hour()
+        parts = [f"{finished}/{total} ({percent:.0f}%)",
+                 f"{rate:.0f} img/h" if rate else "measuring...",
+                 f"ETA {format_seconds(self.eta())}",
+                 f"queue {in_flight}"]
+        if failed:
+            parts.append(f"{failed} failed")
+        if cached:
+            parts.append(f"{cached} cached")
+        return " | ".join(parts)
+
+    def render(self):
+        line = self.status_line()
+        with self.lock:
+            if self.live:
+                padding = " " * max(0, self._line_width - len(line) - 3)
+                self.stream.write(f"\r⏳ {line}{padding}")
+                self._line_width = len(line) + 3
+            else:
+                self.stream.write(f"📈 Progress: {line}\n")
+            self.stream.flush()
+
+    def _clear_line(self):
+        if self.live and self._line_width:
+            self.stream.write("\r" + " " * self._line_width + "\r")
+            self._line_width = 0
+
+    def note(self, message: str):
+        """Per-image message: printed as is unless the live status line replaces it"""
+        if not self.live:
+            print(message, file=self.stream)
+
+    def alert(self, message: str):
+        """Message that must stay visible (failures); printed above the live status line"""
+        with self.lock:
+            self._clear_line()
+            print(message, file=self.stream)
+        if self.live:
+            self.render()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.render()
+        if self.live:
+            with self.lock:
+                self.stream.write("\n")
+                self._line_width = 0
@@ -1,14 +1,106 @@
 import json
-import requests
 import time
 import os
+import glob
+import re
 import argparse
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+from batch_pipeline import DRAIN, run_batch
+from comfyui_client import ComfyUIClient, parse_server_urls
+import image_quality
+from job_ledger import JobLedger, workflow_hash, workflow_resolution
+from output_cache import OutputCache, deterministic_seed
+from progress import BatchProgress
+from run_metrics import RunMetrics, format_seconds
+from workflow_templates import DEFAULT_TEMPLATE, compile_workflow, quality_profile, template_name, workflow_models
+
+NEGATIVE_PROMPT = "blur, haze, soft focus, atmospheric perspective, depth of field, bokeh, motion blur, fog, mist, dreamy, soft lighting, realistic raindrops, photographic snowflakes, natural water drops, organic snow crystals, realistic weather effects, smooth rounded shapes, large raindrops, oversized snowflakes, big weather elements, giant precipitation, huge crystals, massive particles, recognizable raindrop shapes, distinct snowflake patterns, teardrop forms, star-shaped snowflakes, detailed precipitation, complex weather shapes, medium sized particles, visible crystal shapes, prominent weather elements, noticeable precipitation"
+
+def load_approved(path: str) -> set:
+    """<city>_<weather> names of approved drafts
+
+    path is either a folder holding the approved draft images (searched
+    recursively) or a text file with one draft image name or path per line
+    (# starts a comment). ComfyUI's _00001_ counter and an img2img
+    _from_<base id> suffix are ignored.
+    """
+    if os.path.isdir(path):
+        names = [name for _, _, files in os.walk(path) for name in files if name.lower().endswith('.png')]
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            names = [line.split('#', 1)[0].strip() for line in f]
+    stems = set()
+    for name in names:
+        if name:
+            stem = re.sub(r'(_from_[0-9a-f]{8})?(_\d{5}_)?(\.png)?$', '', os.path.basename(name).lower())
+            stems.add(stem)
+    return stems
 
 class RegionalBatchGenerator:
-    def __init__(self, server_url: str = "http://127.0.0.1:8000"):
+    def __init__(self, server_url: str = "http://127.0.0.1:8000", ledger_path: str = "job_ledger.db",
+                 cache_dir: str = ".image_cache", cache_max_gb: float = 2.0,
+                 output_dir: str = ".", seed_salt: str = "", on_interrupt: str = DRAIN,
+                 keep_history: int = 0, events_log: str = "batch_events.jsonl", prom_file: str = None,
+                 progress_interval: float = 30, sample_interval: float = 5, split_prompt: bool = False,
+                 img2img: bool = False, variant_denoise: float = 0.55, variant_steps: int = 20,
+                 quality: str = "final", candidates: int = 1, quality_gate: bool = False, gate_retries: int = 2):
         self.server_url = server_url
-        self.client_id = "regional_cities_generator"
+        # server_url may list several backends (list or comma-separated)
+        self.clients = [ComfyUIClient(url, "regional_cities_generator") for url in parse_server_urls(server_url)]
+        # Records every batch job so interrupted runs can be resumed
+        self.ledger = JobLedger(ledger_path) if ledger_path else None
+        # Unchanged workflows are served from the local image cache instead of the GPU
+        self.cache = OutputCache(cache_dir, int(cache_max_gb * 1024 ** 3)) if cache_dir else None
+        # Local mirror of the ComfyUI output tree: <output_dir>/timezones/<tz>/<city>_<weather>_*.png
+        self.output_dir = output_dir
+        # Seeds derive from city + weather + salt so the same request renders the same image
+        self.seed_salt = seed_salt
+        # Ctrl-C behaviour: drain (finish in-flight) or abort (cancel our prompts on ComfyUI)
+        self.on_interrupt = on_interrupt
+        # Harvested prompts are deleted from ComfyUI's /history except the newest keep_history
+        self.keep_history = keep_history
+        # Per-job timings: JSONL event log and optional Prometheus textfile
+        self.events_log = events_log
+        self.prom_file = prom_file
+        # Seconds between progress lines when stdout is not a terminal
+        self.progress_interval = progress_interval
+        # Seconds between backend utilization samples (0 disables)
+        self.sample_interval = sample_interval
+        # Encode the landmark and weather parts of the prompt separately so
+        # ComfyUI caches the landmark encoding across a city's weather variants
+        self.split_prompt = split_prompt
+        # img2img mode: one base render per city, weather variants sampled from it
+        # at variant_denoise with variant_steps instead of full renders
+        self.img2img = img2img
+        self.variant_denoise = variant_denoise
+        self.variant_steps = variant_steps
+        # Quality profile name; its settings are read from each config the generator loads
+        # (custom profiles live there, so the name is only checked once a config is loaded)
+        self.quality = quality
+        self.profile = quality_profile({})
+        # Text-to-image renders per prompt (one latent batch); the best-scoring one is kept
+        self.candidates = candidates
+        # Inline check of every render; defective ones are re-queued with a new seed up to
+        # gate_retries times. A fresh gate (per-city style sets, counters) is made per batch
+        self.quality_gate = quality_gate
+        self.gate_retries = gate_retries
+        self.gate = None
+        # Workflow template and model files, also read from each loaded config
+        self.workflow_template = DEFAULT_TEMPLATE
+        self.models = workflow_models({})
+        # Stop mode of the last batch when it was interrupted, else None
+        self.stopped = None
+        
+    def apply_config(self, config: Dict, quality: str = None):
+        """Use the quality profile, workflow template and model files of a config
+
+        Raises ValueError for an unknown profile or a broken template.
+        """
+        self.profile = quality_profile(config, quality or self.quality)
+        self.workflow_template = template_name(config)
+        self.models = workflow_models(config)
+        compile_workflow(self.workflow_template, models=self.models, sampler=self.profile)
         
     def normalize_timezone(self, timezone: str) -> str:
         """Convert timezone to folder-safe format"""
@@ -19,136 +111,38 @@ class RegionalBatchGenerator:
         normalized = normalized.replace(":", "_")
         return normalized
         
-    def create_flux_krea_workflow(self, positive_prompt: str, negative_prompt: str, filename: str, seed: int = None) -> Dict:
-        """Generate FLUX Krea workflow (with LoRA)"""
-        if seed is None:
-            seed = int(time.time() * 1000) % 1000000
-            
-        workflow = {
-            "39": {
-                "inputs": {
-                    "vae_name": "ae.safetensors"
-                },
-                "class_type": "VAELoader"
-            },
-            "8": {
-                "inputs": {
-                    "samples": ["31", 0],
-                    "vae": ["39", 0]
-                },
-                "class_type": "VAEDecode"
-            },
-            "27": {
-                "inputs": {
-                    "width": 1024,
-                    "height": 1024,
-                    "batch_size": 1
-                },
-                "class_type": "EmptySD3LatentImage"
-            },
-            "52": {
-                "inputs": {
-                    "model": ["38", 0],
-                    "clip": ["40", 0],
-                    "lora_name": "noc-lwply.safetensors",
-                    "strength_model": 1.0,
-                    "strength_clip": 1.0
-                },
-                "class_type": "LoraLoader"
-            },
-            "38": {
-                "inputs": {
-                    "unet_name": "flux1-krea-dev_fp8_scaled.safetensors",
-                    "weight_dtype": "default"
-                },
-                "class_type": "UNETLoader"
-            },
-            "40": {
-                "inputs": {
-                    "clip_name1": "clip_l.safetensors",
-                    "clip_name2": "t5xxl_fp16.safetensors",
-                    "type": "flux",
-                    "device": "cpu"
-                },
-                "class_type": "DualCLIPLoader"
-            },
-            "9": {
-                "inputs": {
-                    "images": ["8", 0],
-                    "filename_prefix": f"timezones/{filename}"
-                },
-                "class_type": "SaveImage"
-            },
-            "53": {
-                "inputs": {
-                    "clip": ["40", 0],
-                    "text": negative_prompt
-                },
-                "class_type": "CLIPTextEncode"
-            },
-            "31": {
-                "inputs": {
-                    "model": ["52", 0],
-                    "positive": ["45", 0],
-                    "negative": ["53", 0],
-                    "latent_image": ["27", 0],
-                    "seed": seed,
-                    "steps": 35,
-                    "cfg": 1.0,
-                    "sampler_name": "euler",
-                    "scheduler": "simple",
-                    "denoise": 1.0
-                },
-                "class_type": "KSampler"
-            },
-            "45": {
-                "inputs": {
-                    "clip": ["52", 1],
-                    "text": positive_prompt
-                },
-                "class_type": "CLIPTextEncode"
-            }
-        }
-        return workflow
-    
-    def queue_prompt(self, workflow: Dict) -> str:
-        """Send workflow to ComfyUI server"""
-        prompt = {
-            "prompt": workflow,
-            "client_id": self.client_id
-        }
-        
-        try:
-            response = requests.post(f"{self.server_url}/prompt", json=prompt)
-            response.raise_for_status()
-            return response.json()["prompt_id"]
-        except Exception as e:
-            print(f"Failed to send prompt: {e}")
-            return None
-    
-    def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> bool:
-        """Wait for image generation completion"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            try:
-                response = requests.get(f"{self.server_url}/history/{prompt_id}")
-                if response.status_code == 200:
-                    history = response.json()
-                    if prompt_id in history:
-                        print(f"✅ Image generation completed: {prompt_id}")
-                        return True
-                
-                time.sleep(2)
-            except Exception as e:
-                print(f"Error checking status: {e}")
-                time.sleep(2)
-        
-        print(f"⏰ Timeout: {prompt_id}")
-        return False
+    def create_flux_krea_workflow(self, positive_prompt: str, negative_prompt: str, filename: str, seed: int,
+                                  weather_prompt: str = None, init_image: str = None, profile: Dict = None,
+                                  folder: str = "timezones", batch_size: int = 1) -> Dict:
+        """Generate FLUX Krea workflow (with LoRA) from the generator's workflow template
+
+        seed comes from the caller (deterministic_seed of the job identity).
+        Steps, sampler, size and output root come from profile (the
+        generator's quality profile by default).
+
+        With weather_prompt the positive conditioning is positive_prompt and
+        weather_prompt encoded separately and concatenated; the pooled output
+        comes from positive_prompt. With init_image (a LoadImage name in the
+        ComfyUI input folder) sampling starts from that image, VAE-encoded,
+        instead of an empty latent. batch_size > 1 renders that many
+        candidates of the prompt in one latent batch (text-to-image only).
+        """
+        profile = profile or self.profile
+        prefix = "/".join(part for part in (profile['output_root'], folder, filename) if part)
+        overlays = []
+        if weather_prompt is not None:
+            overlays.append("split_prompt")
+        if init_image is not None:
+            overlays.append("img2img")
+        if batch_size > 1:
+            overlays.append("candidates")
+        template = compile_workflow(self.workflow_template, overlays, models=self.models, sampler=profile)
+        return template.render(positive=positive_prompt, negative=negative_prompt, weather=weather_prompt,
+                               image=init_image, seed=seed, width=profile['width'], height=profile['height'],
+                               batch_size=batch_size, filename_prefix=prefix)
     
-    def generate_city_image(self, city: Dict, weather: Dict) -> bool:
-        """Generate individual city image"""
+    def landmark_prompt(self, city: Dict) -> str:
+        """Weather-independent part of the positive prompt"""
         
         # LoRA activation keywords
         lora_keywords = "lo-ply_, noc-lwply,"
@@ -156,6 +150,21 @@ class RegionalBatchGenerator:
         # Base prompt template
         base_template = "{lora_keywords} Stylized {landmark} illustration in low poly art style, geometric polygonal shapes, faceted surfaces, Low polygon count design with angular forms and triangular facets, polygonal clouds, angular horizon line, crystalline atmosphere. Vector graphics feel, clean minimalist composition, perfect for weather app background. Modern low poly aesthetic with crisp geometric edges throughout entire scene, professional UI artwork."
         
+        return base_template.format(
+            lora_keywords=lora_keywords,
+            landmark=f"{city['landmark']}, {city['landmark_description']}"
+        )
+    
+    def build_city_job(self, city: Dict, weather: Dict, base: Dict = None, seed: int = None,
+                       profile: Dict = None) -> Dict:
+        """Build prompt, filename and workflow for one city/weather image
+
+        With base (build_base_job of the same city) the image is an img2img
+        variant of the base render instead of a full text-to-image render.
+        seed replaces the deterministic seed and profile the generator's
+        quality profile.
+        """
+        
         # Timezone-based folder structure
         timezone_folder = self.normalize_timezone(city['timezone'])
         
@@ -164,42 +173,262 @@ class RegionalBatchGenerator:
         
         # Filename: timezone/cityname_weather.png (all lowercase)
         filename = f"{timezone_folder}/{city['name'].lower()}_{weather['name'].lower()}"
+        if base is not None:
+            # Variants name the base render they were derived from
+            filename += f"_from_{base['base_id']}"
         
         # Final positive prompt
-        positive_prompt = base_template.format(
-            lora_keywords=lora_keywords,
-            landmark=f"{city['landmark']}, {city['landmark_description']}"
-        ) + weather_desc + ", low poly style background"
+        landmark_prompt = self.landmark_prompt(city)
+        positive_prompt = landmark_prompt + weather_desc + ", low poly style background"
+        
+        if seed is None:
+            seed = deterministic_seed(city['name'], weather['name'], salt=self.seed_salt)
+        profile = profile or self.profile
+        
+        options = {'profile': profile}
+        if self.split_prompt:
+            positive_prompt = landmark_prompt
+            options['weather_prompt'] = weather_desc[2:] + ", low poly style background"
+        if base is None and self.candidates > 1:
+            options['batch_size'] = self.candidates
+        if base is not None:
+            options.update(init_image=base['image'],
+                           profile={**profile, 'steps': self.variant_steps, 'denoise': self.variant_denoise})
+        workflow = self.create_flux_krea_workflow(positive_prompt, NEGATIVE_PROMPT, filename, seed, **options)
+        
+        job = {
+            'city': city,
+            'weather': weather,
+            'timezone_folder': timezone_folder,
+            'filename': filename,
+            'seed': seed,
+            'labels': {'kind': 'city', 'resolution': workflow_resolution(workflow),
+                       'timezone': city['timezone'], 'weather': weather['name'], 'quality': profile['name']},
+            'workflow': workflow
+        }
+        if 'batch_size' in options:
+            job.update(candidates=self.candidates, archive=self.candidate_archive("timezones", timezone_folder))
+        if base is not None:
+            job['base'] = base['image']
+            job['labels'].update(kind='variant', resolution=base['labels']['resolution'], base=base['base_id'])
+        return job
+    
+    def build_base_job(self, city: Dict) -> Dict:
+        """Weather-neutral render of a city that its img2img weather variants start from
+
+        base_id is the hash of the base workflow; the render is saved as
+        [<output_root>/]bases/<tz>/<city>_base_<base_id>_*.png and uploaded to every backend
+        as the input image 'image' before the variants run.
+        """
+        timezone_folder = self.normalize_timezone(city['timezone'])
+        filename = f"{timezone_folder}/{city['name'].lower()}_base"
+        seed = deterministic_seed(city['name'], "base", salt=self.seed_salt)
+        prompt = self.landmark_prompt(city) + ", low poly style background"
+        batch_size = max(1, self.candidates)
+        workflow = self.create_flux_krea_workflow(prompt, NEGATIVE_PROMPT, filename, seed, folder="bases",
+                                                  batch_size=batch_size)
+        base_id = workflow_hash(workflow)[:8]
+        workflow = self.create_flux_krea_workflow(prompt, NEGATIVE_PROMPT, f"{filename}_{base_id}", seed,
+                                                  folder="bases", batch_size=batch_size)
+        return {
+            'city': city,
+            'weather': {'name': 'base'},
+            'timezone_folder': timezone_folder,
+            'filename': f"{filename}_{base_id}",
+            'seed': seed,
+            'base_id': base_id,
+            'image': f"img2img_bases/{filename}_{base_id}.png",
+            'prefix': workflow["9"]["inputs"]["filename_prefix"],
+            'labels': {'kind': 'base', 'resolution': workflow_resolution(workflow),
+                       'timezone': city['timezone'], 'weather': 'base', 'quality': self.profile['name']},
+            'workflow': workflow,
+            **({'candidates': batch_size, 'archive': self.candidate_archive("bases", timezone_folder)}
+               if batch_size > 1 else {})
+        }
+    
+    def candidate_archive(self, folder: str, timezone_folder: str) -> str:
+        """Local folder the losing candidates of a batched render are moved to"""
+        return os.path.join(self.output_dir, self.profile['output_root'], "candidates", folder, timezone_folder)
+    
+    def select_candidate(self, job: Dict) -> bool:
+        """Output handler: keep the best-scoring candidate of a batched render
+
+        The winner takes the file name of the first candidate (the name a
+        single render gets) and the others are archived as
+        <name>_cand<batch index>.png. job['files'] is left with the winner.
+        """
+        files = job.get('files') or []
+        if job.get('candidates', 1) < 2 or len(files) < 2:
+            return True
+        scores = image_quality.score_images(files)
+        # Candidates the quality gate rejected never win
+        for score, defect in zip(scores, job.get('candidate_defects') or []):
+            if defect:
+                score['score'] = -1.0
+        best = image_quality.best_image(scores)
+        os.makedirs(job['archive'], exist_ok=True)
+        name = os.path.basename(job['filename'])
+        for index, path in enumerate(files):
+            if index != best:
+                os.replace(path, os.path.join(job['archive'], f"{name}_cand{index + 1}.png"))
+        if best:
+            os.replace(files[best], files[0])
+        job['files'] = files[:1]
+        job['best_candidate'] = best + 1
+        job['candidate_scores'] = [round(score['score'], 3) for score in scores]
+        return True
+    
+    def draft_seed(self, ledger_key: tuple, city: Dict, weather: Dict, profile: Dict) -> Optional[int]:
+        """Seed the ledger recorded for the finished draft render of city/weather, None without one
+
+        The draft job is rebuilt with the draft profile and the current prompt
+        options to find its ledger row.
+        """
+        if self.ledger is None:
+            return None
+        draft = self.build_city_job(city, weather, profile=profile)
+        return self.ledger.seed(JobLedger.job_key({'ledger_key': ledger_key, 'workflow': draft['workflow']}))
+    
+    def check_render(self, job: Dict, paths: List[str]) -> Optional[str]:
+        """Quality gate of run_batch: the defect of a render, None when it may ship
+
+        Renders are compared with the accepted renders of the same city (its
+        base and all weathers). A batched render is defective only when every
+        candidate is; select_candidate then picks among the good ones. Rejected
+        renders are moved to [<output_root>/]rejected/<tz>/ with their seed in the name.
+        """
+        defects = self.gate.check(paths, group=job['city']['name'])
+        if job.get('candidates', 1) > 1:
+            job['candidate_defects'] = defects
+        if not all(defects):
+            return None
+        with self.gate.lock:
+            if len(job.get('defects', [])) < self.gate_retries:
+                self.gate.requeued += 1
+            else:
+                self.gate.gave_up += 1
+        rejected = os.path.join(self.output_dir, self.profile['output_root'], "rejected", job['timezone_folder'])
+        os.makedirs(rejected, exist_ok=True)
+        for path in paths:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            os.replace(path, os.path.join(rejected, f"{stem.rstrip('_')}_seed{job['seed']}.png"))
+        return defects[0]
+    
+    def render_bases(self, cities: List[Dict], config_file: str, region_name: str, queue_depth: int,
+                     resume: bool, retry_failed: bool, progress: BatchProgress, metrics: RunMetrics) -> Dict[str, Dict]:
+        """Render the base image of every city and upload it to each backend's input folder
+
+        Bases already rendered by an earlier run (skipped through the ledger)
+        are picked up from the output directory. Returns city name -> base
+        job for the cities whose variants can run.
+        """
+        files = {}
         
-        # Negative prompt
-        negative_prompt = "blur, haze, soft focus, atmospheric perspective, depth of field, bokeh, motion blur, fog, mist, dreamy, soft lighting, realistic raindrops, photographic snowflakes, natural water drops, organic snow crystals, realistic weather effects, smooth rounded shapes, large raindrops, oversized snowflakes, big weather elements, giant precipitation, huge crystals, massive particles, recognizable raindrop shapes, distinct snowflake patterns, teardrop forms, star-shaped snowflakes, detailed precipitation, complex weather shapes, medium sized particles, visible crystal shapes, prominent weather elements, noticeable precipitation"
+        def base_jobs():
+            for city in cities:
+                job = self.build_base_job(city)
+                job['ledger_key'] = (config_file, region_name, city['name'], 'base')
+                yield job
+        
+        def on_result(job: Dict, success: bool):
+            self.print_result(job, success, progress)
+            if success and job.get('files'):
+                files[job['city']['name']] = job['files'][0]
+        
+        dispatcher = run_batch(self.clients, base_jobs(), queue_depth=queue_depth,
+                               on_submit=lambda job, prompt_id: self.print_submitted(job, prompt_id, progress),
+                               on_result=on_result, output_handler=self.select_candidate,
+                               ledger=self.ledger, resume=resume, retry_failed=retry_failed,
+                               cache=self.cache, output_dir=self.output_dir, on_interrupt=self.on_interrupt,
+                               keep_history=self.keep_history, metrics=metrics, progress=progress,
+                               sample_interval=self.sample_interval,
+                               quality_gate=self.check_render if self.gate else None, defect_retries=self.gate_retries)
+        self.stopped = dispatcher.stop_mode
+        
+        bases = {}
+        for city in cities:
+            base = self.build_base_job(city)
+            path = files.get(city['name'])
+            if path is None:
+                found = glob.glob(os.path.join(self.output_dir, glob.escape(base['prefix']) + "_*.png"))
+                path = max(found, key=os.path.getmtime) if found else None
+            if path is None:
+                progress.alert(f"⚠️ No base image for {city['city']}, its weather variants are skipped")
+                continue
+            subfolder, _, name = base['image'].rpartition("/")
+            try:
+                for client in self.clients:
+                    client.upload_image(path, name, subfolder)
+            except Exception as e:
+                progress.alert(f"⚠️ Base image upload failed for {city['city']}: {e}")
+                continue
+            bases[city['name']] = base
+        progress.note(f"🧱 Base images ready: {len(bases)}/{len(cities)}")
+        return bases
+    
+    def generate_city_image(self, city: Dict, weather: Dict) -> bool:
+        """Generate individual city image"""
+        job = self.build_city_job(city, weather)
         
         print(f"\n🎨 Generating: {city['city']}, {city['country']}")
         print(f"🏛️ Landmark: {city['landmark']}")
         print(f"🌤️ Weather: {weather['name']}")
-        print(f"🕐 Timezone: {city['timezone']} -> {timezone_folder}")
-        print(f"💾 Filename: {filename}")
-        
-        # Generate workflow
-        workflow = self.create_flux_krea_workflow(positive_prompt, negative_prompt, filename)
+        print(f"🕐 Timezone: {city['timezone']} -> {job['timezone_folder']}")
+        print(f"💾 Filename: {job['filename']}")
         
-        # Send prompt
-        prompt_id = self.queue_prompt(workflow)
-        if not prompt_id:
-            print(f"❌ Prompt sending failed: {city['city']}")
-            return False
-        
-        # Wait for completion
-        success = self.wait_for_completion(prompt_id)
-        if success:
-            print(f"✅ Completed: {city['city']} - {weather['name']} -> {timezone_folder}")
+        if self.quality_gate and self.gate is None:
+            self.gate = image_quality.QualityGate()
+        results = []
+        run_batch(self.clients, [job], on_submit=self.print_submitted,
+                  on_result=lambda job, success: results.append(self.print_result(job, success)),
+                  output_handler=self.select_candidate,
+                  cache=self.cache, output_dir=self.output_dir, keep_history=self.keep_history,
+                  quality_gate=self.check_render if self.gate else None, defect_retries=self.gate_retries)
+        return bool(results and results[0])
+    
+    def print_submitted(self, job: Dict, prompt_id: str, progress: BatchProgress = None):
+        message = f"📤 Queued: {job['city']['city']} - {job['weather']['name']} ({prompt_id} @ {job['backend']})"
+        if progress:
+            progress.note(message)
         else:
-            print(f"❌ Failed: {city['city']} - {weather['name']}")
-        
+            print(message)
+    
+    def print_result(self, job: Dict, success: bool, progress: BatchProgress = None) -> bool:
+        """Per-image result line; with a live progress display only failures are printed"""
+        city, weather = job['city'], job['weather']
+        if success and job.get('cached'):
+            message = f"♻️ Cached: {city['city']} - {weather['name']} -> {job['timezone_folder']}"
+        elif success:
+            message = f"✅ Completed: {city['city']} - {weather['name']} -> {job['timezone_folder']}"
+        elif job.get('status') == 'timeout':
+            message = f"⏰ Timeout: {city['city']} - {weather['name']}"
+        elif job.get('status') == 'cancelled':
+            message = f"🛑 Cancelled: {city['city']} - {weather['name']}"
+        elif job.get('status') == 'defective':
+            message = f"🧪 Defective: {city['city']} - {weather['name']} ({job.get('error')}, {len(job['defects'])} tries)"
+        else:
+            message = f"❌ Failed: {city['city']} - {weather['name']} ({job.get('error')})"
+        if success and job.get('best_candidate'):
+            scores = ", ".join(f"{score:.2f}" for score in job['candidate_scores'])
+            message += f" (candidate {job['best_candidate']}/{len(job['candidate_scores'])}, scores {scores})"
+        if success and job.get('defects'):
+            requeued = len(job['defects'])
+            message += f" (after {requeued} re-queue{'s' if requeued > 1 else ''})"
+        if progress is None:
+            print(message)
+        elif success:
+            progress.note(message)
+        else:
+            progress.alert(message)
         return success
     
-    def generate_region_batch(self, region_name: str, config_file: str = "global_cities_config.json", weather_filter: List[str] = None):
-        """Execute regional batch generation"""
+    def generate_region_batch(self, region_name: str, config_file: str = "global_cities_config.json", weather_filter: List[str] = None, queue_depth: int = 1,
+                              resume: bool = False, retry_failed: bool = False):
+        """Execute regional batch generation (queue_depth > 1 enables pipelined submission)
+
+        resume skips jobs the ledger records as done or failed, retry_failed
+        re-runs only failed ones; both together run everything not yet done
+        """
         
         # Load configuration file
         try:
@@ -211,6 +440,11 @@ class RegionalBatchGenerator:
         except json.JSONDecodeError:
             print(f"❌ Invalid configuration file format: {config_file}")
             return
+        try:
+            self.apply_config(config)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
         
         # Check region - handle resort destinations
         if 'resort_destinations' in config and region_name in config['resort_destinations']:
@@ -245,14 +479,29 @@ class RegionalBatchGenerator:
         
         # Output batch information
         total_images = len(cities) * len(weather_conditions)
+        if self.img2img:
+            # Plus one base render per city
+            total_images += len(cities)
         print(f"🚀 Regional FLUX Krea batch generation started!")
         print(f"📍 Region: {region['name']} ({region['description']})")
         print(f"🏙️ Cities: {len(cities)}")
         print(f"🌤️ Weather conditions: {len(weather_conditions)}")
         if weather_filter:
             print(f"🔍 Weather filter: {weather_filter}")
+        if queue_depth > 1:
+            print(f"📦 Pipelined mode: queue depth {queue_depth}")
+        if self.profile['name'] != "final" or self.profile['output_root']:
+            print(f"🎚️ Quality: {self.profile['name']} ({self.profile['steps']} steps, "
+                  f"{self.profile['width']}x{self.profile['height']}) -> {self.profile['output_root'] or '.'}/")
+        if self.img2img:
+            print(f"🧱 img2img mode: one base per city, weather variants at denoise {self.variant_denoise:g}, "
+                  f"{self.variant_steps} steps")
+        if resume or retry_failed:
+            modes = [name for name, on in (("resume", resume), ("retry failed", retry_failed)) if on]
+            print(f"📒 Ledger mode: {' + '.join(modes)} ({self.ledger.path if self.ledger else 'no ledger'})")
+        progress = BatchProgress(total_images, parallelism=len(self.clients), interval=self.progress_interval)
         print(f"🖼️ Total images to generate: {total_images}")
-        print(f"⏱️ Estimated time: {total_images * 3} minutes")
+        print(f"⏱️ Estimated time: {format_seconds(progress.eta())} (updated from measured render times while running)")
         print()
         print("🕐 Timezone distribution:")
         for tz, city_list in sorted(timezone_stats.items()):
@@ -263,40 +512,90 @@ class RegionalBatchGenerator:
         
         success_count = 0
         failed_count = 0
+        cancelled_count = 0
         failed_images = []
         timezone_results = {}
         
-        # Process by city
-        for city_idx, city in enumerate(cities, 1):
+        def record_result(city: Dict, weather: Dict, success: bool):
+            nonlocal success_count, failed_count
             timezone = city['timezone']
             if timezone not in timezone_results:
                 timezone_results[timezone] = {'success': 0, 'failed': 0}
-                
-            print(f"\n📍 [{city_idx}/{len(cities)}] {city['city']}, {city['country']}")
-            print(f"🏛️ {city['landmark']} ({city['timezone']})")
-            print("-" * 40)
-            
-            # Generate by weather
-            for weather_idx, weather in enumerate(weather_conditions, 1):
-                print(f"[{weather_idx}/{len(weather_conditions)}] {weather['name']} weather")
-                
-                if self.generate_city_image(city, weather):
-                    success_count += 1
-                    timezone_results[timezone]['success'] += 1
-                else:
-                    failed_count += 1
-                    timezone_results[timezone]['failed'] += 1
-                    failed_images.append(f"{city['city']} ({timezone}) - {weather['name']}")
-                
-                # Server overload prevention delay
-                time.sleep(1)
+            if success:
+                success_count += 1
+                timezone_results[timezone]['success'] += 1
+            else:
+                failed_count += 1
+                timezone_results[timezone]['failed'] += 1
+                failed_images.append(f"{city['city']} ({timezone}) - {weather['name']}")
+        
+        bases = None
+        
+        def region_jobs():
+            # Jobs are produced lazily; only the in-flight ones hold a workflow
+            for city in cities:
+                if bases is not None and city['name'] not in bases:
+                    for weather in weather_conditions:
+                        record_result(city, weather, False)
+                    continue
+                for weather in weather_conditions:
+                    job = self.build_city_job(city, weather, bases[city['name']] if bases is not None else None)
+                    job['ledger_key'] = (config_file, region_name, city['name'], weather['name'])
+                    yield job
+        
+        def on_result(job: Dict, success: bool):
+            nonlocal cancelled_count
+            self.print_result(job, success, progress)
+            if job.get('status') == 'cancelled':
+                cancelled_count += 1
+            else:
+                record_result(job['city'], job['weather'], success)
+        
+        self.gate = image_quality.QualityGate() if self.quality_gate else None
+        metrics = RunMetrics(self.events_log, self.prom_file, job_name="regional_batch")
+        metrics.event("batch", region=region_name, images=total_images, queue_depth=queue_depth)
+        progress.start()
+        self.stopped = None
+        if self.img2img:
+            bases = self.render_bases(cities, config_file, region_name, queue_depth, resume, retry_failed,
+                                      progress, metrics)
+        dispatcher = run_batch(self.clients, [] if self.stopped else region_jobs(), queue_depth=queue_depth,
+                  on_submit=lambda job, prompt_id: self.print_submitted(job, prompt_id, progress),
+                  on_result=on_result, output_handler=self.select_candidate,
+                  ledger=self.ledger, resume=resume, retry_failed=retry_failed,
+                  cache=self.cache, output_dir=self.output_dir, on_interrupt=self.on_interrupt,
+                  keep_history=self.keep_history, metrics=metrics, progress=progress,
+                  sample_interval=self.sample_interval,
+                  quality_gate=self.check_render if self.gate else None, defect_retries=self.gate_retries)
+        progress.close()
+        metrics.close()
+        self.stopped = self.stopped or dispatcher.stop_mode
+        processed = success_count + failed_count
         
         # Results summary
         print("\n" + "="*60)
-        print(f"🎉 {region['name']} regional batch generation completed!")
+        if self.stopped:
+            print(f"🛑 {region['name']} regional batch generation stopped ({self.stopped})")
+        else:
+            print(f"🎉 {region['name']} regional batch generation completed!")
         print(f"✅ Success: {success_count}")
         print(f"❌ Failed: {failed_count}")
-        print(f"📊 Success rate: {(success_count/total_images)*100:.1f}%")
+        if cancelled_count:
+            print(f"🛑 Cancelled: {cancelled_count}")
+        if self.stopped:
+            print("↩️ Run again with --resume to finish the remaining images")
+        if self.ledger and self.ledger.skipped:
+            print(f"⏭️ Skipped (recorded in ledger): {self.ledger.skipped}")
+        print(f"📊 Success rate: {(success_count/processed)*100 if processed else 0:.1f}%")
+        dispatcher.print_utilization()
+        for client in self.clients:
+            client.print_stats()
+        if self.cache:
+            self.cache.print_report()
+        if self.gate:
+            self.gate.print_report()
+        metrics.print_percentiles("timezone", "Timings by timezone")
+        metrics.print_percentiles("weather", "Timings by weather")
         
         print(f"\n🕐 Results by timezone:")
         for tz in sorted(timezone_results.keys()):
@@ -312,11 +611,107 @@ class RegionalBatchGenerator:
                 print(f"   - {failed}")
         
         print(f"\n📁 Results location:")
-        print(f"   ComfyUI/output/timezones/")
+        results_root = os.path.join(self.profile['output_root'], 'timezones')
+        print(f"   {os.path.join(self.output_dir, results_root)}/" if self.output_dir else f"   ComfyUI/output/{results_root}/")
         for tz in sorted(timezone_results.keys()):
             folder_name = self.normalize_timezone(tz)
             print(f"   -> {folder_name}/")
 
+    def promote_drafts(self, approved_path: str, config_file: str = "global_cities_config.json",
+                       region_names: List[str] = None, weather_filter: List[str] = None, queue_depth: int = 1,
+                       resume: bool = False, retry_failed: bool = False) -> bool:
+        """Re-render approved drafts at final quality
+
+        A promoted image uses the seed of its draft: the one the ledger recorded
+        for the draft render (the replacement seed when the quality gate
+        re-queued it), else the city/weather/salt seed. Final renders share
+        ledger entries with regular final batches (--resume skips images
+        already promoted).
+        """
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            approved = load_approved(approved_path)
+            self.apply_config(config, "final")
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}")
+            return False
+        
+        sections = {**config.get('regions', {}), **config.get('resort_destinations', {})}
+        unknown = [name for name in region_names or [] if name not in sections]
+        if unknown:
+            print(f"❌ Region not found: {', '.join(unknown)}")
+            return False
+        weathers = [w for w in config['weather_conditions'] if not weather_filter or w['name'] in weather_filter]
+        
+        # (region, city, weather) of every approved draft, in config order
+        selected = []
+        for region_name in region_names or list(sections):
+            for city in sections[region_name]['cities']:
+                for weather in weathers:
+                    stem = f"{city['name'].lower()}_{weather['name'].lower()}"
+                    if stem in approved:
+                        selected.append((region_name, city, weather))
+                        approved.discard(stem)
+        
+        print(f"⭐ Promoting {len(selected)} approved drafts to final quality "
+              f"({self.profile['steps']} steps, {self.profile['width']}x{self.profile['height']})")
+        if approved:
+            print(f"⚠️ {len(approved)} approved names match no city/weather of {config_file}: {', '.join(sorted(approved))}")
+        if not selected:
+            return not approved
+        
+        counts = {'success': 0, 'failed': 0, 'cancelled': 0}
+        progress = BatchProgress(len(selected), parallelism=len(self.clients), interval=self.progress_interval)
+        
+        draft_profile = quality_profile(config, "draft")
+        
+        def promote_jobs():
+            for region_name, city, weather in selected:
+                ledger_key = (config_file, region_name, city['name'], weather['name'])
+                job = self.build_city_job(city, weather, seed=self.draft_seed(ledger_key, city, weather, draft_profile))
+                job['ledger_key'] = ledger_key
+                yield job
+        
+        def on_result(job: Dict, success: bool):
+            self.print_result(job, success, progress)
+            if job.get('status') == 'cancelled':
+                counts['cancelled'] += 1
+            else:
+                counts['success' if success else 'failed'] += 1
+        
+        self.gate = image_quality.QualityGate() if self.quality_gate else None
+        metrics = RunMetrics(self.events_log, self.prom_file, job_name="promote")
+        metrics.event("batch", promote=approved_path, images=len(selected), queue_depth=queue_depth)
+        progress.start()
+        dispatcher = run_batch(self.clients, promote_jobs(), queue_depth=queue_depth,
+                               on_submit=lambda job, prompt_id: self.print_submitted(job, prompt_id, progress),
+                               on_result=on_result, output_handler=self.select_candidate,
+                               ledger=self.ledger, resume=resume, retry_failed=retry_failed,
+                               cache=self.cache, output_dir=self.output_dir, on_interrupt=self.on_interrupt,
+                               keep_history=self.keep_history, metrics=metrics, progress=progress,
+                               sample_interval=self.sample_interval,
+                               quality_gate=self.check_render if self.gate else None, defect_retries=self.gate_retries)
+        progress.close()
+        metrics.close()
+        self.stopped = dispatcher.stop_mode
+        
+        print("\n" + "="*60)
+        print(f"🛑 Promotion stopped ({self.stopped})" if self.stopped else "🎉 Promotion completed!")
+        print(f"✅ Success: {counts['success']}")
+        print(f"❌ Failed: {counts['failed']}")
+        if counts['cancelled']:
+            print(f"🛑 Cancelled: {counts['cancelled']}")
+        if self.ledger and self.ledger.skipped:
+            print(f"⏭️ Skipped (recorded in ledger): {self.ledger.skipped}")
+        dispatcher.print_utilization()
+        if self.cache:
+            self.cache.print_report()
+        if self.gate:
+            self.gate.print_report()
+        metrics.print_percentiles("timezone", "Timings by timezone")
+        return counts['failed'] == 0 and not self.stopped
+
 def list_available_regions(config_file: str = "global_cities_config.json"):
     """Output available region list"""
     try:
@@ -356,6 +751,17 @@ def list_available_regions(config_file: str = "global_cities_config.json"):
     for tz in sorted(all_timezones):
         print(f"   {tz}")
 
+def create_generator(args) -> RegionalBatchGenerator:
+    return RegionalBatchGenerator(
+        server_url=args.server, ledger_path=args.ledger, cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_gb=args.cache_max_gb, output_dir=args.output_dir, seed_salt=args.seed_salt,
+        on_interrupt=args.on_interrupt, keep_history=args.keep_history, events_log=args.events_log,
+        prom_file=args.prom_file, progress_interval=args.progress_interval, sample_interval=args.sample_interval,
+        split_prompt=args.split_prompt, img2img=args.img2img, variant_denoise=args.variant_denoise,
+        variant_steps=args.variant_steps, quality=args.quality, candidates=args.candidates,
+        quality_gate=args.quality_gate, gate_retries=args.gate_retries
+    )
+
 def main():
     parser = argparse.ArgumentParser(description='Regional city landmark image batch generator (timezone-based folders)')
     parser.add_argument('--region', '-r', type=str, help='Region name to generate')
@@ -363,7 +769,41 @@ def main():
     parser.add_argument('--list', '-l', action='store_true', help='Show available region list')
     parser.add_argument('--weather', '-w', nargs='+', help='Generate specific weather only (e.g. sunny cloudy)')
     parser.add_argument('--config', '-c', default='global_cities_config.json', help='Configuration file path')
-    parser.add_argument('--server', '-s', default='http://127.0.0.1:8000', help='ComfyUI server URL')
+    parser.add_argument('--server', '-s', nargs='+', default=['http://127.0.0.1:8000'], help='ComfyUI server URL(s); several backends share the batch')
+    parser.add_argument('--queue-depth', '-q', type=int, default=1, help='Prompts kept enqueued on ComfyUI (1 = sequential)')
+    parser.add_argument('--resume', action='store_true', help='Skip images the job ledger records as done or failed')
+    parser.add_argument('--retry-failed', action='store_true', help='Re-run only images the job ledger records as failed')
+    parser.add_argument('--ledger', default='job_ledger.db', help='Job ledger (SQLite) path')
+    parser.add_argument('--seed-salt', default='', help='Salt mixed into the per city/weather seeds (change it for new variations)')
+    parser.add_argument('--cache-dir', default='.image_cache', help='Local image cache directory')
+    parser.add_argument('--cache-max-gb', type=float, default=2.0, help='Image cache size limit (least recently used entries are evicted)')
+    parser.add_argument('--no-cache', action='store_true', help='Always render, bypassing the image cache')
+    parser.add_argument('--output-dir', default='.', help='Local directory the images are downloaded to (<dir>/timezones/<tz>/...)')
+    parser.add_argument('--on-interrupt', choices=['drain', 'abort'], default='drain',
+                        help='Ctrl-C: drain finishes queued images, abort cancels them on ComfyUI (a second Ctrl-C always aborts)')
+    parser.add_argument('--keep-history', type=int, default=0, help='Finished prompts left in ComfyUI history for debugging (older ones are pruned)')
+    parser.add_argument('--events-log', default='batch_events.jsonl', help='JSONL log of job events and per-phase timings')
+    parser.add_argument('--prom-file', help='Prometheus textfile (node_exporter textfile collector) for job timing metrics')
+    parser.add_argument('--progress-interval', type=float, default=30, help='Seconds between progress lines when output is not a terminal')
+    parser.add_argument('--sample-interval', type=float, default=5, help='Seconds between /system_stats + /queue samples for the backend timeline (0 disables)')
+    parser.add_argument('--split-prompt', action='store_true',
+                        help='Encode landmark and weather prompts separately so ComfyUI reuses the landmark encoding across weathers')
+    parser.add_argument('--img2img', action='store_true',
+                        help='Render one base image per city and derive the weather variants from it (img2img)')
+    parser.add_argument('--variant-denoise', type=float, default=0.55, help='Denoise of img2img weather variants (1.0 = ignore the base)')
+    parser.add_argument('--variant-steps', type=int, default=20, help='Sampler steps of img2img weather variants')
+    parser.add_argument('--quality', default='final',
+                        help='Quality profile from settings.quality_profiles (draft = fast low-res previews under drafts/)')
+    parser.add_argument('--candidates', type=int, default=1,
+                        help='Render N candidates per text-to-image prompt in one latent batch and keep the best-scoring one '
+                             '(others go to candidates/; needs numpy and pillow)')
+    parser.add_argument('--quality-gate', action='store_true',
+                        help='Check every render (black/flat, missing low poly edges, unlike the city\'s other renders) '
+                             'and re-queue defective ones with a new seed (needs numpy and pillow)')
+    parser.add_argument('--gate-retries', type=int, default=2, help='Re-queues per image before the quality gate gives up')
+    parser.add_argument('--promote', metavar='APPROVED',
+                        help='Re-render approved drafts at final quality (folder of kept draft images or a list file); '
+                             'limited to --region when given')
     
     args = parser.parse_args()
     
@@ -371,11 +811,24 @@ def main():
         list_available_regions(args.config)
         return
     
+    if args.candidates > 1 and not image_quality.available():
+        print("❌ --candidates needs numpy and pillow (pip install numpy pillow)")
+        return
+    if args.quality_gate and not image_quality.available():
+        print("❌ --quality-gate needs numpy and pillow (pip install numpy pillow)")
+        return
+    
+    if args.promote:
+        generator = create_generator(args)
+        generator.promote_drafts(args.promote, args.config, [args.region] if args.region else None, args.weather,
+                                 args.queue_depth, args.resume, args.retry_failed)
+        return
+    
     # Handle resort destinations
     if args.resort:
         if not args.region:
             # Generate all resort destinations
-            generator = RegionalBatchGenerator(args.server)
+            generator = create_generator(args)
             # Load config to get all resort destination categories
             try:
                 with open(args.config, 'r', encoding='utf-8') as f:
@@ -383,7 +836,10 @@ def main():
                 if 'resort_destinations' in config:
                     for resort_category in config['resort_destinations']:
                         print(f"🏖️ Generating resort category: {resort_category}")
-                        generator.generate_region_batch(resort_category, args.config, args.weather)
+                        generator.generate_region_batch(resort_category, args.config, args.weather, args.queue_depth,
+                                                        args.resume, args.retry_failed)
+                        if generator.stopped:
+                            break
                         time.sleep(2)  # Brief pause between categories
                 else:
                     print("❌ No resort destinations found in config file")
@@ -406,8 +862,9 @@ def main():
     print("FLUX Krea + Low Poly Joy LoRA Style | Timezone-based Folder Structure")
     print("="*70)
     
-    generator = RegionalBatchGenerator(args.server)
-    generator.generate_region_batch(args.region, args.config, args.weather)
+    generator = create_generator(args)
+    generator.generate_region_batch(args.region, args.config, args.weather, args.queue_depth,
+                                    args.resume, args.retry_failed)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,14 +1,36 @@
 import json
-import requests
-import time
 import os
 import argparse
 from typing import List, Dict
 
+from batch_pipeline import run_batch
+from comfyui_client import ComfyUIClient, parse_server_urls
+from output_cache import deterministic_seed
+from progress import BatchProgress
+from run_metrics import format_seconds
+from workflow_templates import DEFAULT_TEMPLATE, compile_workflow, quality_profile, template_name, workflow_models
+
 class RegionalBatchGenerator:
-    def __init__(self, server_url: str = "http://127.0.0.1:8000"):
+    def __init__(self, server_url: str = "http://127.0.0.1:8000", seed_salt: str = ""):
         self.server_url = server_url
-        self.client_id = "regional_cities_generator"
+        # server_url may list several backends (list or comma-separated)
+        self.clients = [ComfyUIClient(url, "regional_cities_generator") for url in parse_server_urls(server_url)]
+        # Seeds derive from city + weather + salt so the same request renders the same image
+        self.seed_salt = seed_salt
+        # Sampler settings, workflow template and model files, read from each loaded config
+        self.profile = quality_profile({})
+        self.workflow_template = DEFAULT_TEMPLATE
+        self.models = workflow_models({})
+        
+    def apply_config(self, config: Dict):
+        """Use the sampler settings, workflow template and model files of a config
+
+        Raises ValueError for a broken template.
+        """
+        self.profile = quality_profile(config)
+        self.workflow_template = template_name(config)
+        self.models = workflow_models(config)
+        compile_workflow(self.workflow_template, models=self.models, sampler=self.profile)
         
     def normalize_timezone(self, timezone: str) -> str:
         """Convert timezone to folder-safe format"""
@@ -19,136 +41,15 @@ class RegionalBatchGenerator:
         normalized = normalized.replace(":", "_")
         return normalized
         
-    def create_flux_krea_workflow(self, positive_prompt: str, negative_prompt: str, filename: str, seed: int = None) -> Dict:
+    def create_flux_krea_workflow(self, positive_prompt: str, negative_prompt: str, filename: str, seed: int) -> Dict:
         """Generate FLUX Krea workflow (with LoRA)"""
-        if seed is None:
-            seed = int(time.time() * 1000) % 1000000
-            
-        workflow = {
-            "39": {
-                "inputs": {
-                    "vae_name": "ae.safetensors"
-                },
-                "class_type": "VAELoader"
-            },
-            "8": {
-                "inputs": {
-                    "samples": ["31", 0],
-                    "vae": ["39", 0]
-                },
-                "class_type": "VAEDecode"
-            },
-            "27": {
-                "inputs": {
-                    "width": 1024,
-                    "height": 1024,
-                    "batch_size": 1
-                },
-                "class_type": "EmptySD3LatentImage"
-            },
-            "52": {
-                "inputs": {
-                    "model": ["38", 0],
-                    "clip": ["40", 0],
-                    "lora_name": "noc-lwply.safetensors",
-                    "strength_model": 1.0,
-                    "strength_clip": 1.0
-                },
-                "class_type": "LoraLoader"
-            },
-            "38": {
-                "inputs": {
-                    "unet_name": "flux1-krea-dev_fp8_scaled.safetensors",
-                    "weight_dtype": "default"
-                },
-                "class_type": "UNETLoader"
-            },
-            "40": {
-                "inputs": {
-                    "clip_name1": "clip_l.safetensors",
-                    "clip_name2": "t5xxl_fp16.safetensors",
-                    "type": "flux",
-                    "device": "cpu"
-                },
-                "class_type": "DualCLIPLoader"
-            },
-            "9": {
-                "inputs": {
-                    "images": ["8", 0],
-                    "filename_prefix": f"timezones/{filename}"
-                },
-                "class_type": "SaveImage"
-            },
-            "53": {
-                "inputs": {
-                    "clip": ["40", 0],
-                    "text": negative_prompt
-                },
-                "class_type": "CLIPTextEncode"
-            },
-            "31": {
-                "inputs": {
-                    "model": ["52", 0],
-                    "positive": ["45", 0],
-                    "negative": ["53", 0],
-                    "latent_image": ["27", 0],
-                    "seed": seed,
-                    "steps": 35,
-                    "cfg": 1.0,
-                    "sampler_name": "euler",
-                    "scheduler": "simple",
-                    "denoise": 1.0
-                },
-                "class_type": "KSampler"
-            },
-            "45": {
-                "inputs": {
-                    "clip": ["52", 1],
-                    "text": positive_prompt
-                },
-                "class_type": "CLIPTextEncode"
-            }
-        }
-        return workflow
+        template = compile_workflow(self.workflow_template, models=self.models, sampler=self.profile)
+        return template.render(positive=positive_prompt, negative=negative_prompt, seed=seed,
+                               width=self.profile['width'], height=self.profile['height'],
+                               filename_prefix=f"timezones/{filename}")
     
-    def queue_prompt(self, workflow: Dict) -> str:
-        """Send workflow to ComfyUI server"""
-        prompt = {
-            "prompt": workflow,
-            "client_id": self.client_id
-        }
-        
-        try:
-            response = requests.post(f"{self.server_url}/prompt", json=prompt)
-            response.raise_for_status()
-            return response.json()["prompt_id"]
-        except Exception as e:
-            print(f"Failed to send prompt: {e}")
-            return None
-    
-    def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> bool:
-        """Wait for image generation completion"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            try:
-                response = requests.get(f"{self.server_url}/history/{prompt_id}")
-                if response.status_code == 200:
-                    history = response.json()
-                    if prompt_id in history:
-                        print(f"✅ Image generation completed: {prompt_id}")
-                        return True
-                
-                time.sleep(2)
-            except Exception as e:
-                print(f"Error checking status: {e}")
-                time.sleep(2)
-        
-        print(f"⏰ Timeout: {prompt_id}")
-        return False
-    
-    def generate_city_image(self, city: Dict, weather: Dict) -> bool:
-        """Generate individual city image"""
+    def build_city_job(self, city: Dict, weather: Dict) -> Dict:
+        """Build prompt, filename and workflow for one city/weather image"""
         
         # LoRA activation keywords
         lora_keywords = "lo-ply_, noc-lwply,"
@@ -174,32 +75,58 @@ class RegionalBatchGenerator:
         # Negative prompt
         negative_prompt = "blur, haze, soft focus, atmospheric perspective, depth of field, bokeh, motion blur, fog, mist, dreamy, soft lighting, realistic raindrops, photographic snowflakes, natural water drops, organic snow crystals, realistic weather effects, smooth rounded shapes, large raindrops, oversized snowflakes, big weather elements, giant precipitation, huge crystals, massive particles, recognizable raindrop shapes, distinct snowflake patterns, teardrop forms, star-shaped snowflakes, detailed precipitation, complex weather shapes, medium sized particles, visible crystal shapes, prominent weather elements, noticeable precipitation"
         
+        return {
+            'city': city,
+            'weather': weather,
+            'timezone_folder': timezone_folder,
+            'filename': filename,
+            'workflow': self.create_flux_krea_workflow(
+                positive_prompt, negative_prompt, filename,
+                deterministic_seed(city['name'], weather['name'], salt=self.seed_salt)
+            )
+        }
+    
+    def generate_city_image(self, city: Dict, weather: Dict) -> bool:
+        """Generate individual city image"""
+        job = self.build_city_job(city, weather)
+        
         print(f"\n🎨 Generating: {city['city']}, {city['country']}")
         print(f"🏛️ Landmark: {city['landmark']}")
         print(f"🌤️ Weather: {weather['name']}")
-        print(f"🕐 Timezone: {city['timezone']} -> {timezone_folder}")
-        print(f"💾 Filename: {filename}")
-        
-        # Generate workflow
-        workflow = self.create_flux_krea_workflow(positive_prompt, negative_prompt, filename)
+        print(f"🕐 Timezone: {city['timezone']} -> {job['timezone_folder']}")
+        print(f"💾 Filename: {job['filename']}")
         
-        # Send prompt
-        prompt_id = self.queue_prompt(workflow)
-        if not prompt_id:
-            print(f"❌ Prompt sending failed: {city['city']}")
-            return False
-        
-        # Wait for completion
-        success = self.wait_for_completion(prompt_id)
+        results = []
+        run_batch(self.clients, [job], on_submit=self.print_submitted,
+                  on_result=lambda job, success: results.append(self.print_result(job, success)))
+        return bool(results and results[0])
+    
+    def print_submitted(self, job: Dict, prompt_id: str, progress: BatchProgress = None):
+        message = f"📤 대기열 등록: {job['city']['city']} - {job['weather']['name']} ({prompt_id} @ {job['backend']})"
+        if progress:
+            progress.note(message)
+        else:
+            print(message)
+    
+    def print_result(self, job: Dict, success: bool, progress: BatchProgress = None) -> bool:
+        """이미지별 결과 출력; 실시간 진행 표시 중에는 실패만 출력"""
+        city, weather = job['city'], job['weather']
         if success:
-            print(f"✅ Completed: {city['city']} - {weather['name']} -> {timezone_folder}")
+            message = f"✅ 완료: {city['city']} - {weather['name']} -> {job['timezone_folder']}"
+        elif job.get('status') == 'timeout':
+            message = f"⏰ 시간 초과: {city['city']} - {weather['name']}"
         else:
-            print(f"❌ Failed: {city['city']} - {weather['name']}")
-        
+            message = f"❌ 실패: {city['city']} - {weather['name']} ({job.get('error')})"
+        if progress is None:
+            print(message)
+        elif success:
+            progress.note(message)
+        else:
+            progress.alert(message)
         return success
     
-    def generate_region_batch(self, region_name: str, config_file: str = "global_cities_config.json", weather_filter: List[str] = None):
-        """지역별 배치 생성 실행"""
+    def generate_region_batch(self, region_name: str, config_file: str = "global_cities_config.json", weather_filter: List[str] = None, queue_depth: int = 1):
+        """지역별 배치 생성 실행 (queue_depth > 1이면 파이프라인 제출)"""
         
         # 설정 파일 로드
         try:
@@ -211,6 +138,11 @@ class RegionalBatchGenerator:
         except json.JSONDecodeError:
             print(f"❌ Invalid configuration file format: {config_file}")
             return
+        try:
+            self.apply_config(config)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
         
         # 지역 확인
         if region_name not in config['regions']:
@@ -242,8 +174,11 @@ class RegionalBatchGenerator:
         print(f"🌤️ 날씨 조건: {len(weather_conditions)}개")
         if weather_filter:
             print(f"🔍 날씨 필터: {weather_filter}")
+        if queue_depth > 1:
+            print(f"📦 파이프라인 모드: 대기열 깊이 {queue_depth}")
+        progress = BatchProgress(total_images, parallelism=len(self.clients))
         print(f"🖼️ 총 생성 이미지: {total_images}개")
-        print(f"⏱️ 예상 소요시간: {total_images * 3}분")
+        print(f"⏱️ 예상 소요시간: {format_seconds(progress.eta())} (실행 중 측정된 렌더링 시간으로 갱신)")
         print()
         print("🕐 시간대별 도시 분포:")
         for tz, city_list in sorted(timezone_stats.items()):
@@ -257,30 +192,31 @@ class RegionalBatchGenerator:
         failed_images = []
         timezone_results = {}
         
-        # 도시별 진행
-        for city_idx, city in enumerate(cities, 1):
+        def record_result(city: Dict, weather: Dict, success: bool):
+            nonlocal success_count, failed_count
             timezone = city['timezone']
             if timezone not in timezone_results:
                 timezone_results[timezone] = {'success': 0, 'failed': 0}
-                
-            print(f"\n📍 [{city_idx}/{len(cities)}] {city['city']}, {city['country']}")
-            print(f"🏛️ {city['landmark']} ({city['timezone']})")
-            print("-" * 40)
-            
-            # 날씨별 생성
-            for weather_idx, weather in enumerate(weather_conditions, 1):
-                print(f"[{weather_idx}/{len(weather_conditions)}] {weather['name']} 날씨")
-                
-                if self.generate_city_image(city, weather):
-                    success_count += 1
-                    timezone_results[timezone]['success'] += 1
-                else:
-                    failed_count += 1
-                    timezone_results[timezone]['failed'] += 1
-                    failed_images.append(f"{city['city']} ({timezone}) - {weather['name']}")
-                
-                # 서버 과부하 방지 딜레이
-                time.sleep(1)
+            if success:
+                success_count += 1
+                timezone_results[timezone]['success'] += 1
+            else:
+                failed_count += 1
+                timezone_results[timezone]['failed'] += 1
+                failed_images.append(f"{city['city']} ({timezone}) - {weather['name']}")
+        
+        # 작업은 필요할 때 생성되며, 진행 중인 작업만 워크플로를 보관
+        jobs = (self.build_city_job(city, weather) for city in cities for weather in weather_conditions)
+        
+        def on_result(job: Dict, success: bool):
+            self.print_result(job, success, progress)
+            record_result(job['city'], job['weather'], success)
+        
+        progress.start()
+        dispatcher = run_batch(self.clients, jobs, queue_depth=queue_depth,
+                  on_submit=lambda job, prompt_id: self.print_submitted(job, prompt_id, progress),
+                  on_result=on_result, progress=progress)
+        progress.close()
         
         # 결과 요약
         print("\n" + "="*60)
@@ -288,6 +224,9 @@ class RegionalBatchGenerator:
         print(f"✅ 성공: {success_count}개")
         print(f"❌ 실패: {failed_count}개")
         print(f"📊 성공률: {(success_count/total_images)*100:.1f}%")
+        dispatcher.print_utilization()
+        for client in self.clients:
+            client.print_stats()
         
         print(f"\n🕐 시간대별 결과:")
         for tz in sorted(timezone_results.keys()):
@@ -354,11 +293,13 @@ def main():
     parser.add_argument('--list', '-l', action='store_true', help='사용 가능한 지역 목록 표시')
     parser.add_argument('--weather', '-w', nargs='+', help='특정 날씨만 생성 (예: sunny cloudy)')
     parser.add_argument('--config', '-c', default='global_cities_config.json', help='설정 파일 경로')
-    parser.add_argument('--server', '-s', default='http://127.0.0.1:8000', help='ComfyUI 서버 URL')
+    parser.add_argument('--server', '-s', nargs='+', default=['http://127.0.0.1:8000'], help='ComfyUI 서버 URL (여러 개 지정 시 백엔드 간 분산)')
+    parser.add_argument('--queue-depth', '-q', type=int, default=1, help='ComfyUI 대기열에 유지할 프롬프트 수 (1 = 순차 실행)')
+    parser.add_argument('--seed-salt', default='', help='도시/날씨별 시드에 섞는 값 (바꾸면 새로운 변형 생성)')
     
     args = parser.parse_args()
     
-    generator = RegionalBatchGenerator(args.server)
+    generator = RegionalBatchGenerator(args.server, args.seed_salt)
     
     if args.list:
         generator.list_regions(args.config)
@@ -372,7 +313,7 @@ def main():
     print("FLUX Krea + Low Poly Joy LoRA 스타일 | 시간대별 폴더 구조")
     print("="*60)
     
-    generator.generate_region_batch(args.region, args.config, args.weather)
+    generator.generate_region_batch(args.region, args.config, args.weather, args.queue_depth)
 
 if __name__ == "__main__":
     main()
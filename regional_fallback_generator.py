@@ -7,11 +7,17 @@ Generates representative images for regions not covered by the main 47 cities
 import os
 import sys
 import json
-import requests
-import time
 import argparse
 from pathlib import Path
-import uuid
+
+from batch_pipeline import DRAIN, run_batch
+from comfyui_client import ComfyUIClient, parse_server_urls
+from job_ledger import JobLedger
+from job_ledger import workflow_resolution
+from output_cache import OutputCache, deterministic_seed
+from progress import BatchProgress
+from run_metrics import RunMetrics, format_seconds
+from workflow_templates import compile_workflow, quality_profile, template_name, workflow_models
 
 def load_config(config_path="regional_fallback_config.json"):
     """Load regional fallback configuration"""
@@ -29,15 +35,11 @@ def normalize_region_name(region_name):
     """Convert region name to filesystem-safe format"""
     return region_name.lower().replace(' ', '_').replace('/', '_')
 
-def check_comfyui_server(server_url):
+def check_comfyui_server(client):
     """Check if ComfyUI server is running"""
-    try:
-        response = requests.get(f"{server_url}/system_stats", timeout=5)
-        return response.status_code == 200
-    except requests.RequestException:
-        return False
+    return client.is_alive()
 
-def generate_workflow(config, region_data, weather_condition):
+def generate_workflow(config, region_data, weather_condition, seed_salt=""):
     """Generate ComfyUI workflow for regional fallback image (matching existing system)"""
     lora_keywords = config["lora_keywords"]["activation"]
     landmark = region_data["representative_landmark"]
@@ -49,145 +51,55 @@ def generate_workflow(config, region_data, weather_condition):
         weather_condition=weather_desc
     )
     
-    seed = int(time.time() * 1000) % 1000000
+    seed = deterministic_seed(region_data['name'], weather_condition['name'], salt=seed_salt)
     # 지역명 폴더에 지역명_날씨.png 형식으로 저장 (all lowercase)
     region_name_clean = normalize_region_name(region_data['name'].lower())
     weather_name = weather_condition['name'].lower()
     filename = f"regional_fallback/{region_name_clean}/{region_name_clean}_{weather_name}"
     
-    # Use the same workflow structure as regional_batch_generator.py
-    workflow = {
-        "39": {
-            "inputs": {
-                "vae_name": "ae.safetensors"
-            },
-            "class_type": "VAELoader"
-        },
-        "8": {
-            "inputs": {
-                "samples": ["31", 0],
-                "vae": ["39", 0]
-            },
-            "class_type": "VAEDecode"
-        },
-        "27": {
-            "inputs": {
-                "width": 1024,
-                "height": 1024,
-                "batch_size": 1
-            },
-            "class_type": "EmptySD3LatentImage"
-        },
-        "52": {
-            "inputs": {
-                "model": ["38", 0],
-                "clip": ["40", 0],
-                "lora_name": "noc-lwply.safetensors",
-                "strength_model": 1.0,
-                "strength_clip": 1.0
-            },
-            "class_type": "LoraLoader"
-        },
-        "38": {
-            "inputs": {
-                "unet_name": "flux1-krea-dev_fp8_scaled.safetensors",
-                "weight_dtype": "default"
-            },
-            "class_type": "UNETLoader"
-        },
-        "40": {
-            "inputs": {
-                "clip_name1": "clip_l.safetensors",
-                "clip_name2": "t5xxl_fp16.safetensors",
-                "type": "flux",
-                "device": "cpu"
-            },
-            "class_type": "DualCLIPLoader"
-        },
-        "9": {
-            "inputs": {
-                "images": ["8", 0],
-                "filename_prefix": filename
-            },
-            "class_type": "SaveImage"
-        },
-        "53": {
-            "inputs": {
-                "clip": ["40", 0],
-                "text": config["prompts"]["negative_template"]
-            },
-            "class_type": "CLIPTextEncode"
-        },
-        "31": {
-            "inputs": {
-                "model": ["52", 0],
-                "positive": ["45", 0],
-                "negative": ["53", 0],
-                "latent_image": ["27", 0],
-                "seed": seed,
-                "steps": 35,
-                "cfg": 1.0,
-                "sampler_name": "euler",
-                "scheduler": "simple",
-                "denoise": 1.0
-            },
-            "class_type": "KSampler"
-        },
-        "45": {
-            "inputs": {
-                "clip": ["52", 1],
-                "text": positive_prompt
-            },
-            "class_type": "CLIPTextEncode"
-        }
-    }
-    
-    return workflow
+    # Same workflow template as regional_batch_generator.py
+    profile = quality_profile(config)
+    template = compile_workflow(template_name(config), models=workflow_models(config), sampler=profile)
+    return template.render(positive=positive_prompt, negative=config["prompts"]["negative_template"], seed=seed,
+                           width=profile["width"], height=profile["height"], filename_prefix=filename)
 
-def queue_prompt(server_url, workflow):
-    """Queue a prompt to ComfyUI server"""
-    prompt_data = {
-        "prompt": workflow,
-        "client_id": str(uuid.uuid4())
+def build_fallback_job(config, region_data, weather_condition, seed_salt=""):
+    """Job record for one region/weather image"""
+    workflow = generate_workflow(config, region_data, weather_condition, seed_salt)
+    return {
+        'region': region_data,
+        'weather': weather_condition,
+        'labels': {'kind': 'fallback', 'resolution': workflow_resolution(workflow),
+                   'timezone': region_data['timezone'], 'weather': weather_condition['name']},
+        'workflow': workflow
     }
-    
-    try:
-        response = requests.post(f"{server_url}/prompt", json=prompt_data, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"❌ Failed to queue prompt: {response.status_code}")
-            return None
-    except requests.RequestException as e:
-        print(f"❌ Request failed: {e}")
-        return None
 
-def wait_for_completion(server_url, prompt_id, timeout_seconds):
-    """Wait for image generation to complete"""
-    start_time = time.time()
-    
-    while time.time() - start_time < timeout_seconds:
-        try:
-            response = requests.get(f"{server_url}/history/{prompt_id}", timeout=5)
-            if response.status_code == 200:
-                history = response.json()
-                if prompt_id in history:
-                    return True
-        except requests.RequestException:
-            pass
-        
-        time.sleep(2)
-    
-    return False
+def generate_regional_images(config, regions=None, weather_conditions=None, priority_filter=None, queue_depth=1, servers=None,
+                             resume=False, retry_failed=False, ledger_path="job_ledger.db",
+                             config_name="regional_fallback_config.json", seed_salt="",
+                             cache_dir=".image_cache", cache_max_gb=2.0, output_dir=".", on_interrupt=DRAIN,
+                             keep_history=0, events_log="batch_events.jsonl", prom_file=None,
+                             progress_interval=30, sample_interval=5):
+    """Generate images for specified regions and weather conditions (queue_depth > 1 enables pipelining)
 
-def generate_regional_images(config, regions=None, weather_conditions=None, priority_filter=None):
-    """Generate images for specified regions and weather conditions"""
-    server_url = config["settings"]["server_url"]
+    Every job is recorded in the ledger at ledger_path; resume skips jobs recorded
+    as done or failed, retry_failed re-runs only failed ones. Workflows rendered
+    before are served from the image cache at cache_dir (None disables it).
+    Ctrl-C stops the batch in on_interrupt mode (drain or abort); cancelled jobs
+    are left for the next --resume run. Finished prompts are pruned from the
+    ComfyUI history except the newest keep_history. Job timings go to the
+    events_log (JSONL) and prom_file (Prometheus textfile) when given, along
+    with backend VRAM/queue samples taken every sample_interval seconds.
+    """
+    server_urls = parse_server_urls(servers or config["settings"]["server_url"])
     timeout_seconds = config["settings"]["timeout_seconds"]
     
-    # Check ComfyUI server
-    if not check_comfyui_server(server_url):
-        print(f"❌ ComfyUI server not accessible at {server_url}")
+    # One pooled client per backend; its /ws stream reports completion of our prompts
+    clients = [ComfyUIClient(url, "regional_fallback_generator") for url in server_urls]
+    
+    # Check ComfyUI servers
+    if not any(check_comfyui_server(client) for client in clients):
+        print(f"❌ ComfyUI server not accessible at {', '.join(server_urls)}")
         return False
     
     # Filter regions by priority if specified
@@ -219,8 +131,14 @@ def generate_regional_images(config, regions=None, weather_conditions=None, prio
     print(f"🚀 Regional FLUX Krea fallback image generation started!")
     print(f"📍 Regions: {len(regional_fallbacks)}")
     print(f"🌤️ Weather conditions: {len(weather_conditions_list)}")
+    if queue_depth > 1:
+        print(f"📦 Pipelined mode: queue depth {queue_depth}")
+    if resume or retry_failed:
+        modes = [name for name, on in (("resume", resume), ("retry failed", retry_failed)) if on]
+        print(f"📒 Ledger mode: {' + '.join(modes)} ({ledger_path})")
+    progress = BatchProgress(total_images, parallelism=len(clients), interval=progress_interval)
     print(f"🖼️ Total images to generate: {total_images}")
-    print(f"⏱️ Estimated time: {total_images * 3} minutes")
+    print(f"⏱️ Estimated time: {format_seconds(progress.eta())} (updated from measured render times while running)")
     print()
     print("🌍 Regional representative landmarks:")
     for name, data in regional_fallbacks.items():
@@ -231,59 +149,100 @@ def generate_regional_images(config, regions=None, weather_conditions=None, prio
     
     success_count = 0
     failed_count = 0
+    cancelled_count = 0
     failed_images = []
     priority_results = {}
     
-    # Process regions
-    for region_idx, (region_name, region_data) in enumerate(regional_fallbacks.items(), 1):
+    def record_result(region_data, weather_condition, success):
+        nonlocal success_count, failed_count
         priority = region_data.get("priority", 3)
         if priority not in priority_results:
             priority_results[priority] = {'success': 0, 'failed': 0}
-            
-        print(f"\n📍 [{region_idx}/{len(regional_fallbacks)}] {region_data['name']}")
-        print(f"🏛️ {region_data['representative_landmark']} (Priority: {priority})")
-        print(f"🌍 Coverage area: {region_data['coverage_area']}")
-        print("-" * 40)
-        
-        # Generate by weather conditions
-        for weather_idx, weather_condition in enumerate(weather_conditions_list, 1):
-            print(f"[{weather_idx}/{len(weather_conditions_list)}] {weather_condition['name']} weather")
-            
-            # Generate workflow
-            workflow = generate_workflow(config, region_data, weather_condition)
-            
-            # Queue prompt
-            result = queue_prompt(server_url, workflow)
-            if not result:
-                print(f"    ❌ Failed to queue prompt")
-                failed_count += 1
-                priority_results[priority]['failed'] += 1
-                failed_images.append(f"{region_data['name']} - {weather_condition['name']}")
-                continue
-            
-            prompt_id = result["prompt_id"]
-            print(f"    🔄 Generating... (ID: {prompt_id})")
-            
-            # Wait for completion
-            if wait_for_completion(server_url, prompt_id, timeout_seconds):
-                print(f"    ✅ Generation completed")
-                success_count += 1
-                priority_results[priority]['success'] += 1
-            else:
-                print(f"    ⏰ Timeout ({timeout_seconds}s)")
-                failed_count += 1
-                priority_results[priority]['failed'] += 1
-                failed_images.append(f"{region_data['name']} - {weather_condition['name']}")
-            
-            # Server overload prevention delay
-            time.sleep(1)
+        if success:
+            success_count += 1
+            priority_results[priority]['success'] += 1
+        else:
+            failed_count += 1
+            priority_results[priority]['failed'] += 1
+            failed_images.append(f"{region_data['name']} - {weather_condition['name']}")
+    
+    def fallback_jobs():
+        # Jobs are produced lazily; only the in-flight ones hold a workflow
+        for name, region_data in regional_fallbacks.items():
+            for weather_condition in weather_conditions_list:
+                job = build_fallback_job(config, region_data, weather_condition, seed_salt)
+                job['ledger_key'] = (config_name, name, region_data['representative_landmark'], weather_condition['name'])
+                yield job
+    
+    ledger = JobLedger(ledger_path) if ledger_path else None
+    cache = OutputCache(cache_dir, int(cache_max_gb * 1024 ** 3)) if cache_dir else None
+    submitted = 0
+    
+    def on_submit(job, prompt_id):
+        nonlocal submitted
+        submitted += 1
+        progress.note(f"\n📍 [{submitted}/{total_images}] {job['region']['name']} - {job['weather']['name']} weather")
+        progress.note(f"    🔄 Generating... (ID: {prompt_id} @ {job['backend']})")
+    
+    def on_result(job, success):
+        nonlocal cancelled_count
+        label = f"{job['region']['name']} - {job['weather']['name']}"
+        if success and job.get('cached'):
+            progress.note(f"    ♻️ Served from cache: {label}")
+        elif success:
+            progress.note(f"    ✅ Generation completed: {label}")
+        elif job.get('status') == 'timeout':
+            progress.alert(f"    ⏰ Timeout ({timeout_seconds}s): {label}")
+        elif job.get('status') == 'cancelled':
+            progress.alert(f"    🛑 Cancelled: {label}")
+            cancelled_count += 1
+            return
+        else:
+            progress.alert(f"    ❌ Failed: {label} ({job.get('error')})")
+        record_result(job['region'], job['weather'], success)
+    
+    metrics = RunMetrics(events_log, prom_file, job_name="regional_fallback")
+    metrics.event("batch", regions=list(regional_fallbacks), images=total_images, queue_depth=queue_depth)
+    progress.start()
+    dispatcher = run_batch(clients, fallback_jobs(), queue_depth=queue_depth, timeout=timeout_seconds,
+              on_submit=on_submit, on_result=on_result,
+              ledger=ledger, resume=resume, retry_failed=retry_failed,
+              cache=cache, output_dir=output_dir, on_interrupt=on_interrupt,
+              keep_history=keep_history, metrics=metrics, progress=progress,
+              sample_interval=sample_interval)
+    progress.close()
+    metrics.close()
+    
+    for client in clients:
+        client.close()
+    skipped = ledger.skipped if ledger else 0
+    if ledger:
+        ledger.close()
+    processed = success_count + failed_count
     
     # Results summary (matching existing style)
     print("\n" + "="*60)
-    print(f"🎉 Regional fallback image generation completed!")
+    if dispatcher.stop_mode:
+        print(f"🛑 Regional fallback image generation stopped ({dispatcher.stop_mode})")
+    else:
+        print(f"🎉 Regional fallback image generation completed!")
     print(f"✅ Success: {success_count}")
     print(f"❌ Failed: {failed_count}")
-    print(f"📊 Success rate: {(success_count/total_images)*100:.1f}%")
+    if cancelled_count:
+        print(f"🛑 Cancelled: {cancelled_count}")
+    if dispatcher.stop_mode:
+        print("↩️ Run again with --resume to finish the remaining images")
+    if skipped:
+        print(f"⏭️ Skipped (recorded in ledger): {skipped}")
+    print(f"📊 Success rate: {(success_count/processed)*100 if processed else 0:.1f}%")
+    dispatcher.print_utilization()
+    for client in clients:
+        client.print_stats()
+    if cache:
+        cache.print_report()
+        cache.close()
+    metrics.print_percentiles("timezone", "Timings by timezone")
+    metrics.print_percentiles("weather", "Timings by weather")
     
     print(f"\n📊 Results by priority:")
     for priority in sorted(priority_results.keys()):
@@ -298,9 +257,10 @@ def generate_regional_images(config, regions=None, weather_conditions=None, prio
         for failed in failed_images:
             print(f"   - {failed}")
     
-    print(f"\n📁 Results saved to: ComfyUI/output/regional_fallback/")
+    print(f"\n📁 Results saved to: {os.path.join(output_dir, 'regional_fallback')}/" if output_dir
+          else f"\n📁 Results saved to: ComfyUI/output/regional_fallback/")
     
-    return success_count == total_images
+    return failed_count == 0 and not dispatcher.stop_mode
 
 def list_regions(config):
     """List all available regions with their priorities"""
@@ -331,6 +291,23 @@ def main():
     parser.add_argument("--weather", nargs="+", help="Specific weather conditions (default: all)")
     parser.add_argument("--priority", nargs="+", type=int, choices=[1, 2, 3], help="Filter by priority levels")
     parser.add_argument("--list", action="store_true", help="List available regions and exit")
+    parser.add_argument("--queue-depth", type=int, default=1, help="Prompts kept enqueued on ComfyUI (1 = sequential)")
+    parser.add_argument("--server", nargs="+", help="ComfyUI server URL(s), overrides settings.server_url")
+    parser.add_argument("--resume", action="store_true", help="Skip images the job ledger records as done or failed")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run only images the job ledger records as failed")
+    parser.add_argument("--ledger", default="job_ledger.db", help="Job ledger (SQLite) path")
+    parser.add_argument("--seed-salt", default="", help="Salt mixed into the per region/weather seeds")
+    parser.add_argument("--cache-dir", default=".image_cache", help="Local image cache directory")
+    parser.add_argument("--cache-max-gb", type=float, default=2.0, help="Image cache size limit (LRU eviction)")
+    parser.add_argument("--no-cache", action="store_true", help="Always render, bypassing the image cache")
+    parser.add_argument("--output-dir", default=".", help="Local directory the images are downloaded to (<dir>/regional_fallback/...)")
+    parser.add_argument("--on-interrupt", choices=["drain", "abort"], default="drain",
+                        help="Ctrl-C: drain finishes queued images, abort cancels them on ComfyUI (a second Ctrl-C always aborts)")
+    parser.add_argument("--keep-history", type=int, default=0, help="Finished prompts left in ComfyUI history for debugging (older ones are pruned)")
+    parser.add_argument("--events-log", default="batch_events.jsonl", help="JSONL log of job events and per-phase timings")
+    parser.add_argument("--prom-file", help="Prometheus textfile (node_exporter textfile collector) for job timing metrics")
+    parser.add_argument("--progress-interval", type=float, default=30, help="Seconds between progress lines when output is not a terminal")
+    parser.add_argument("--sample-interval", type=float, default=5, help="Seconds between /system_stats + /queue samples for the backend timeline (0 disables)")
     
     args = parser.parse_args()
     
@@ -347,14 +324,30 @@ def main():
         config,
         regions=args.regions,
         weather_conditions=args.weather,
-        priority_filter=args.priority
+        priority_filter=args.priority,
+        queue_depth=args.queue_depth,
+        servers=args.server,
+        resume=args.resume,
+        retry_failed=args.retry_failed,
+        ledger_path=args.ledger,
+        config_name=args.config,
+        seed_salt=args.seed_salt,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_gb=args.cache_max_gb,
+        output_dir=args.output_dir,
+        on_interrupt=args.on_interrupt,
+        keep_history=args.keep_history,
+        events_log=args.events_log,
+        prom_file=args.prom_file,
+        progress_interval=args.progress_interval,
+        sample_interval=args.sample_interval
     )
     
     if success:
         print("\n🎉 All images generated successfully!")
         sys.exit(0)
     else:
-        print("\n⚠️ Some images failed to generate")
+        print("\n⚠️ Some images failed to generate or the batch was stopped")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Per-job timing metrics for batch runs
+Collects the phase timings the orchestrator attaches to every job, appends
+run events to a JSONL log and exports percentiles as a Prometheus textfile
+(node_exporter textfile collector format)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Phases of a job in the order they happen (seconds)
+PHASES = ("submit", "queue_wait", "execution", "detection", "download", "postprocess", "total")
+QUANTILES = (50, 90, 99)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * pct / 100
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 120:
+        return f"{seconds:.1f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+class RunMetrics:
+    """Job timings of one run: JSONL event log, percentile summaries, Prometheus export
+
+    Jobs may carry 'labels' (e.g. kind, timezone, weather) used for grouping;
+    'timings' is filled in by the orchestrator.
+    """
+
+    def __init__(self, events_path: Optional[str] = None, prom_path: Optional[str] = None,
+                 job_name: str = "comfyui_batch", prom_interval: float = 15):
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.events_path = events_path
+        self.prom_path = prom_path
+        self.job_name = job_name
+        self.prom_interval = prom_interval
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.statuses = Counter()
+        # url -> latest utilization sample plus accumulated idle seconds
+        self.backends = {}
+        self._last_prom = 0.0
+        self._events = open(events_path, "a", encoding="utf-8") if events_path else None
+        self.event("run_start", job=job_name)
+
+    def event(self, kind: str, **fields):
+        """Append one event line ({'ts', 'run', 'event', ...}) to the log"""
+        if self._events is None:
+            return
+        record = {"ts": round(time.time(), 3), "run": self.run_id, "event": kind, **fields}
+        with self.lock:
+            self._events.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._events.flush()
+
+    def job_submitted(self, job: Dict):
+        self.event("submitted", prompt_id=job.get("prompt_id"), backend=job.get("backend"),
+                   labels=job.get("labels", {}), submit=job.get("timings", {}).get("submit"))
+
+    def job_started(self, job: Dict):
+        self.event("started", prompt_id=job.get("prompt_id"), backend=job.get("backend"))
+
+    def job_finished(self, job: Dict, success: bool):
+        status = "cached" if job.get("cached") else job.get("status") or ("success" if success else "error")
+        timings = {phase: round(value, 4) for phase, value in job.get("timings", {}).items()}
+        with self.lock:
+            self.statuses[status] += 1
+            # Cache hits never touched a GPU; they would drag every percentile down
+            if not job.get("cached") and timings:
+                self.jobs.append((job.get("labels", {}), status, timings))
+        self.event("finished", prompt_id=job.get("prompt_id"), backend=job.get("backend"), status=status,
+                   error=job.get("error"), labels=job.get("labels", {}), timings=timings,
+                   cached_nodes=job.get("cached_nodes"))
+        if self.prom_path and time.time() - self._last_prom >= self.prom_interval:
+            self.write_prometheus()
+
+    def backend_sample(self, url: str, sample: Dict, idle_seconds: float):
+        """Latest /system_stats + /queue reading of a backend for the Prometheus gauges"""
+        with self.lock:
+            self.backends[url] = {**sample, "idle_seconds": idle_seconds}
+        if self.prom_path and time.time() - self._last_prom >= self.prom_interval:
+            self.write_prometheus()
+
+    def percentiles(self, group_by: str = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """{group: {phase: {'p50', 'p90', 'p99', 'count'}}}; one '' group without group_by"""
+        groups = {}
+        with self.lock:
+            for labels, _, timings in self.jobs:
+                group = str(labels.get(group_by, "unknown")) if group_by else ""
+                for phase, value in timings.items():
+                    groups.setdefault(group, {}).setdefault(phase, []).append(value)
+        return {
+            group: {
+                phase: {**{f"p{q}": percentile(values, q) for q in QUANTILES}, "count": len(values)}
+                for phase, values in phases.items()
+            }
+            for group, phases in groups.items()
+        }
+
+    def print_percentiles(self, group_by: str = None, title: str = None,
+                          phases: tuple = ("queue_wait", "execution", "download", "total")):
+        table = self.percentiles(group_by)
+        if not table:
+            return
+        print(f"\n⏱️ {title or 'Job timings'} (p50 / p90 / p99):")
+        for group in sorted(table):
+            cells = []
+            for phase in phases:
+                stats = table[group].get(phase)
+                if stats:
+                    cells.append(f"{phase} {format_seconds(stats['p50'])}/{format_seconds(stats['p90'])}/"
+                                 f"{format_seconds(stats['p99'])}")
+            count = max(stats["count"] for stats in table[group].values())
+            print(f"   {group or 'all'} ({count}): {', '.join(cells)}")
+
+    def write_prometheus(self):
+        """Write the textfile atomically so node_exporter never reads a partial file"""
+        if not self.prom_path:
+            return
+        job = self.job_name
+        lines = [
+            "# HELP comfyui_batch_jobs_total Jobs finished in the current run by status",
+            "# TYPE comfyui_batch_jobs_total counter"
+        ]
+        with self.lock:
+            statuses = dict(self.statuses)
+            samples = list(self.jobs)
+        for status, count in sorted(statuses.items()):
+            lines.append(f'comfyui_batch_jobs_total{{job="{job}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP comfyui_batch_job_phase_seconds Time a job spent in each phase",
+            "# TYPE comfyui_batch_job_phase_seconds summary"
+        ]
+        by_kind = {}
+        for labels, _, timings in samples:
+            kind = labels.get("kind", "job")
+            for phase, value in timings.items():
+                by_kind.setdefault((kind, phase), []).append(value)
+        for (kind, phase), values in sorted(by_kind.items()):
+            base = f'job="{job}",kind="{kind}",phase="{phase}"'
+            for q in QUANTILES:
+                lines.append(f'comfyui_batch_job_phase_seconds{{{base},quantile="{q / 100}"}} {percentile(values, q):.6f}')
+            lines.append(f"comfyui_batch_job_phase_seconds_sum{{{base}}} {sum(values):.6f}")
+            lines.append(f"comfyui_batch_job_phase_seconds_count{{{base}}} {len(values)}")
+
+        with self.lock:
+            backends = dict(self.backends)
+        gauges = (
+            ("comfyui_backend_vram_used_bytes", "VRAM in use on the backend", "vram_used"),
+            ("comfyui_backend_vram_free_bytes", "VRAM free on the backend", "vram_free"),
+            ("comfyui_backend_queue_running", "Prompts executing on the backend (all clients)", "running"),
+            ("comfyui_backend_queue_pending", "Prompts pending on the backend (all clients)", "pending"),
+            ("comfyui_backend_idle_seconds", "Sampled time with nothing running or pending on the backend",
+             "idle_seconds")
+        )
+        for name, description, field in gauges if backends else ():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            for url, sample in sorted(backends.items()):
+                lines.append(f'{name}{{job="{job}",backend="{url}"}} {round(sample[field], 3)}')
+
+        lines += [
+            "# HELP comfyui_batch_run_start_timestamp_seconds Start of the current run",
+            "# TYPE comfyui_batch_run_start_timestamp_seconds gauge",
+            f'comfyui_batch_run_start_timestamp_seconds{{job="{job}"}} {self.started_at:.3f}',
+            "# HELP comfyui_batch_last_update_timestamp_seconds Last time this file was written",
+            "# TYPE comfyui_batch_last_update_timestamp_seconds gauge",
+            f'comfyui_batch_last_update_timestamp_seconds{{job="{job}"}} {time.time():.3f}'
+        ]
+
+        directory = os.path.dirname(os.path.abspath(self.prom_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+        self._last_prom = time.time()
+
+    def close(self):
+        self.event("run_end", statuses=dict(self.statuses), wall_seconds=round(time.time() - self.started_at, 3))
+        self.write_prometheus()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
@@ -0,0 +1,54 @@
+"""Picking the best of a batched render's candidates"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+import image_quality
+from fake_comfyui import synthetic_png
+from regional_batch_generator import RegionalBatchGenerator
+
+pytestmark = pytest.mark.skipif(not image_quality.available(), reason="scoring needs numpy and pillow")
+
+
+def test_best_image_picks_the_highest_score_and_the_earliest_on_ties():
+    assert image_quality.best_image([{"score": 0.2}, {"score": 0.7}, {"score": 0.5}]) == 1
+    assert image_quality.best_image([{"score": 0.4}, {"score": 0.4}]) == 0
+
+
+def candidates(tmp_path, defects):
+    """A batched render's downloaded files, named like ComfyUI names a batch"""
+    files = []
+    for index, defect in enumerate(defects):
+        path = tmp_path / "timezones" / f"paris_sunny_{index + 1:05}_.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(synthetic_png(256, 256, seed=index, defect=defect))
+        files.append(str(path))
+    return {"candidates": len(files), "files": list(files), "filename": "utc_plus_1/paris_sunny",
+            "archive": str(tmp_path / "candidates")}, files
+
+
+def test_select_candidate_keeps_the_highest_scoring_render(tmp_path):
+    job, files = candidates(tmp_path, ["flat", None, "black"])
+    winner = Path(files[1]).read_bytes()
+
+    assert RegionalBatchGenerator(ledger_path=None, cache_dir=None).select_candidate(job)
+
+    assert job["best_candidate"] == 2
+    assert job["candidate_scores"][1] > 0 and job["candidate_scores"][0] == job["candidate_scores"][2] == 0
+    # The winner takes the first candidate's name, the others are archived
+    assert job["files"] == files[:1]
+    assert Path(files[0]).read_bytes() == winner
+    assert sorted(os.listdir(job["archive"])) == ["paris_sunny_cand1.png", "paris_sunny_cand3.png"]
+
+
+def test_candidate_rejected_by_the_gate_never_wins(tmp_path):
+    job, files = candidates(tmp_path, [None, None])
+    scores = image_quality.score_images(files)
+    best = image_quality.best_image(scores)
+    job["candidate_defects"] = ["unlike the city's other renders" if index == best else None for index in range(2)]
+
+    RegionalBatchGenerator(ledger_path=None, cache_dir=None).select_candidate(job)
+
+    assert job["best_candidate"] == 2 - best
@@ -0,0 +1,78 @@
+"""WebSocket completion tracking against the fake ComfyUI server"""
+
+import socket
+import time
+
+import pytest
+
+from comfyui_client import ComfyUIClient, wait_for_prompt
+from fake_comfyui import FakeComfyUIServer
+
+WORKFLOW = {"9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "test/render"}}}
+
+
+class CountingHistory:
+    """fetch_history wrapper that counts the /history requests"""
+
+    def __init__(self, client: ComfyUIClient):
+        self.client = client
+        self.calls = 0
+
+    def __call__(self, prompt_id: str):
+        self.calls += 1
+        return self.client.get_history(prompt_id)
+
+
+def run_prompt(server: FakeComfyUIServer, drop_socket_after: float = None):
+    client = ComfyUIClient(server.url, max_retries=0)
+    try:
+        prompt_id = client.queue_prompt(WORKFLOW)
+        assert client.listener.connected
+        if drop_socket_after is not None:
+            time.sleep(drop_socket_after)
+            with server.sockets_lock:
+                connections = list(server.sockets.get(client.client_id, []))
+            for connection in connections:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+        history = CountingHistory(client)
+        result = wait_for_prompt(client.listener, prompt_id, 10, history, poll_interval=0.05)
+        return client, result, history.calls
+    finally:
+        client.close()
+
+
+def test_completion_arrives_over_websocket():
+    with FakeComfyUIServer(latency="fixed:0.1") as server:
+        client, result, history_calls = run_prompt(server)
+    assert result["status"] == "success"
+    assert client.output_images(result["outputs"])[0]["filename"] == "render_00001_.png"
+    assert result["started"] is not None
+    assert history_calls == 0
+
+
+def test_execution_error_fails_the_prompt():
+    with FakeComfyUIServer(latency="fixed:0.1", failure_rate=1.0) as server:
+        _, result, history_calls = run_prompt(server)
+    assert result["status"] == "error"
+    assert "injected failure" in result["error"]
+    assert history_calls == 0
+
+
+def test_dropped_socket_falls_back_to_history():
+    with FakeComfyUIServer(latency="fixed:0.5") as server:
+        client, result, history_calls = run_prompt(server, drop_socket_after=0.1)
+    assert not client.listener.connected
+    assert result["status"] == "success"
+    assert client.output_images(result["outputs"])[0]["filename"] == "render_00001_.png"
+    assert history_calls >= 1
+
+
+@pytest.mark.parametrize("failure_rate, status", [(0.0, "success"), (1.0, "error")])
+def test_wait_for_completion(failure_rate, status):
+    with FakeComfyUIServer(latency="fixed:0.1", failure_rate=failure_rate) as server:
+        client = ComfyUIClient(server.url, max_retries=0)
+        try:
+            prompt_id = client.queue_prompt(WORKFLOW)
+            assert client.wait_for_completion(prompt_id, timeout=10)["status"] == status
+        finally:
+            client.close()
@@ -0,0 +1,73 @@
+"""Resume and retry selection of the job ledger and its workflow-hash key"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from job_ledger import DONE, FAILED, JobLedger
+from workflow_templates import DEFAULT_MODELS, DEFAULT_SAMPLER, TEMPLATES_DIR, TemplateLibrary
+
+
+def job(city, seed=1):
+    return {"ledger_key": ("global_cities_config.json", "europe", city, "sunny"),
+            "workflow": {"3": {"class_type": "KSampler", "inputs": {"seed": seed}}}}
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = JobLedger(str(tmp_path / "job_ledger.db"))
+    # paris done, rome failed, berlin cancelled mid-run, london never ran
+    for city, success, status in (("paris", True, None), ("rome", False, "error"), ("berlin", False, "cancelled")):
+        entry = job(city)
+        entry["ledger"] = JobLedger.job_key(entry)
+        entry["status"] = status
+        ledger.mark_queued(entry)
+        ledger.mark_running(entry)
+        ledger.mark_finished(entry, success)
+    yield ledger
+    ledger.close()
+
+
+def cities(jobs):
+    return [entry["ledger_key"][2] for entry in jobs]
+
+
+def test_resume_skips_finished_jobs(ledger):
+    jobs = [job(city) for city in ("paris", "rome", "berlin", "london")]
+
+    assert cities(ledger.select(jobs, resume=True)) == ["berlin", "london"]
+    assert ledger.skipped == 2
+    assert ledger.state(JobLedger.job_key(jobs[0])) == DONE
+
+
+def test_retry_failed_selects_only_failed_jobs(ledger):
+    jobs = [job(city) for city in ("paris", "rome", "berlin", "london")]
+
+    assert cities(ledger.select(jobs, retry_failed=True)) == ["rome"]
+    assert cities(ledger.select(jobs, resume=True, retry_failed=True)) == ["rome", "berlin", "london"]
+    assert ledger.state(JobLedger.job_key(jobs[1])) == FAILED
+
+
+def test_changed_workflow_is_a_new_job(ledger):
+    assert cities(ledger.select([job("paris", seed=2)], resume=True)) == ["paris"]
+
+
+def test_template_change_changes_the_key(tmp_path):
+    shutil.copy(os.path.join(TEMPLATES_DIR, "flux_krea_lora.json"), tmp_path / "base.json")
+    # Same graph with the text encoders moved to the GPU
+    (tmp_path / "gpu_clip.json").write_text(json.dumps({
+        "extends": "base", "patch": {"40": {"inputs": {"device": "default"}}}
+    }))
+    library = TemplateLibrary(str(tmp_path))
+    values = {"positive": "paris", "negative": "blur", "seed": 1, "width": 1024, "height": 1024,
+              "filename_prefix": "timezones/paris"}
+
+    def key(template):
+        workflow = library.compile(template, models=DEFAULT_MODELS, sampler=DEFAULT_SAMPLER).render(**values)
+        return JobLedger.job_key({"ledger_key": job("paris")["ledger_key"], "workflow": workflow})
+
+    assert key("base") == key("base")
+    assert key("base")[:4] == key("gpu_clip")[:4]
+    assert key("base")[4] != key("gpu_clip")[4]
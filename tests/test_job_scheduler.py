@@ -0,0 +1,81 @@
+"""Cache-aware ordering of jobs by shared models, LoRA, negative prompt and resolution"""
+
+import json
+import os
+import sys
+
+from job_scheduler import count_reuse, reuse_order
+from regional_batch_generator import RegionalBatchGenerator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cloud_generator"))
+from single_cloud_generator import CLOUD_STYLES, SingleCloudGenerator
+
+
+def workflow(unet: str, lora: str = None, negative: str = "blur", width: int = 1024) -> dict:
+    nodes = {
+        "1": {"class_type": "UNETLoader", "inputs": {"unet_name": unet}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": negative}},
+        "3": {"class_type": "EmptySD3LatentImage", "inputs": {"width": width, "height": width}},
+        "4": {"class_type": "KSampler", "inputs": {"model": ["1", 0], "negative": ["2", 0], "latent_image": ["3", 0]}}
+    }
+    if lora:
+        nodes["5"] = {"class_type": "LoraLoader", "inputs": {"model": ["1", 0], "lora_name": lora}}
+    return nodes
+
+
+def job(name: str, **options) -> dict:
+    return {"name": name, "workflow": workflow(**options)}
+
+
+def names(jobs):
+    return [entry["name"] for entry in jobs]
+
+
+def test_jobs_sharing_models_and_lora_end_up_adjacent():
+    jobs = [job("krea1", unet="krea", lora="lowpoly"), job("sdxl1", unet="sdxl"),
+            job("krea2", unet="krea", lora="lowpoly"), job("krea_plain", unet="krea"),
+            job("sdxl2", unet="sdxl"), job("krea3", unet="krea", lora="lowpoly")]
+
+    ordered = reuse_order(jobs)
+
+    assert names(ordered) == ["krea1", "krea2", "krea3", "krea_plain", "sdxl1", "sdxl2"]
+    assert sorted(names(ordered)) == sorted(names(jobs))
+
+
+def test_negative_prompt_outranks_resolution():
+    jobs = [job("a_small", unet="krea", width=512), job("b_large", unet="krea", negative="noise"),
+            job("a_large", unet="krea"), job("b_small", unet="krea", negative="noise", width=512)]
+
+    assert names(reuse_order(jobs)) == ["a_small", "a_large", "b_large", "b_small"]
+
+
+def test_grouped_list_comes_back_unchanged():
+    jobs = [job("krea1", unet="krea"), job("krea2", unet="krea"), job("sdxl", unet="sdxl")]
+    assert reuse_order(jobs) == jobs
+
+
+def test_count_reuse():
+    workflows = [workflow("krea", "lowpoly"), workflow("krea", "lowpoly", width=512), workflow("sdxl")]
+    assert count_reuse(workflows) == {"models": 1, "lora": 1, "negative": 2, "resolution": 0}
+
+
+def test_generator_jobs_keep_every_job_and_reuse_more():
+    with open(os.path.join(ROOT, "global_cities_config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    cities = RegionalBatchGenerator(ledger_path=None, cache_dir=None)
+    clouds = SingleCloudGenerator(cache_dir=None)
+    weather = config["weather_conditions"][0]
+    jobs = []
+    # City and cloud jobs alternating: cloud workflows use other negative prompts and resolutions
+    for city, style in zip(config["regions"]["europe"]["cities"][:4], CLOUD_STYLES):
+        jobs += [cities.build_city_job(city, weather), clouds.build_cloud_job(style)]
+
+    ordered = reuse_order(jobs)
+
+    assert sorted(map(id, ordered)) == sorted(map(id, jobs))
+    assert ["city" in entry for entry in ordered] == [True] * 4 + [False] * 4
+    before = count_reuse([entry["workflow"] for entry in jobs])
+    after = count_reuse([entry["workflow"] for entry in ordered])
+    assert after["negative"] > before["negative"]
+    assert after["resolution"] > before["resolution"]
@@ -0,0 +1,69 @@
+"""Lookups and LRU eviction of the content-addressed image cache"""
+
+import hashlib
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import output_cache
+from output_cache import OutputCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # A clock that ticks on every call keeps the LRU order independent of the timer resolution
+    ticks = itertools.count(1)
+    monkeypatch.setattr(output_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+    cache = OutputCache(str(tmp_path / "cache"), max_bytes=250)
+    yield cache
+    cache.close()
+
+
+def store(cache, tmp_path, key, payload: bytes):
+    path = tmp_path / f"{key}.png"
+    path.write_bytes(payload)
+    cache.store(key, [{"filename": f"{key}_00001_.png", "subfolder": "timezones", "path": str(path),
+                       "size": len(payload), "sha256": hashlib.sha256(payload).hexdigest()}])
+
+
+def test_lookup_after_store_returns_the_image(cache, tmp_path):
+    assert cache.lookup("paris") is None
+    store(cache, tmp_path, "paris", b"p" * 100)
+
+    images = cache.lookup("paris")
+
+    assert images[0]["filename"] == "paris_00001_.png" and images[0]["subfolder"] == "timezones"
+    with open(images[0]["path"], "rb") as f:
+        assert f.read() == b"p" * 100
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(cache, tmp_path):
+    store(cache, tmp_path, "paris", b"p" * 100)
+    store(cache, tmp_path, "rome", b"r" * 100)
+    # Using paris makes rome the least recently used entry
+    assert cache.lookup("paris") is not None
+
+    store(cache, tmp_path, "berlin", b"b" * 100)
+
+    assert cache.evicted == 1
+    assert cache.lookup("rome") is None
+    assert cache.lookup("paris") is not None
+    assert cache.lookup("berlin") is not None
+    assert cache.total_bytes() == 200
+
+
+def test_shared_image_survives_eviction_of_one_entry(cache, tmp_path):
+    store(cache, tmp_path, "paris", b"same" * 25)
+    store(cache, tmp_path, "rome", b"r" * 100)
+    store(cache, tmp_path, "paris_again", b"same" * 25)
+    store(cache, tmp_path, "berlin", b"b" * 100)
+
+    # Evicting paris frees nothing (paris_again shares its image), so rome goes too
+    assert cache.evicted == 2
+    assert cache.lookup("paris") is None and cache.lookup("rome") is None
+    images = cache.lookup("paris_again")
+    assert images is not None
+    with open(images[0]["path"], "rb") as f:
+        assert f.read() == b"same" * 25
@@ -0,0 +1,82 @@
+"""Inline quality gate: defect detection and re-queueing of gated batches against the fake server"""
+
+import json
+import os
+
+import pytest
+
+import image_quality
+from batch_pipeline import run_batch
+from fake_comfyui import FakeComfyUIServer, synthetic_png
+from regional_batch_generator import RegionalBatchGenerator
+
+pytestmark = pytest.mark.skipif(not image_quality.available(), reason="the quality gate needs numpy and pillow")
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "global_cities_config.json")
+
+
+def write_png(path, defect=None, seed=0):
+    path.write_bytes(synthetic_png(256, 256, seed=seed, defect=defect))
+    return str(path)
+
+
+def test_black_and_flat_renders_are_defects(tmp_path):
+    paths = [write_png(tmp_path / "good.png"), write_png(tmp_path / "black.png", "black"),
+             write_png(tmp_path / "flat.png", "flat")]
+
+    reasons = image_quality.QualityGate().check(paths)
+
+    assert reasons[0] is None
+    assert reasons[1].startswith("black")
+    assert reasons[2].startswith("flat")
+
+
+def gated_batch(tmp_path, defect_rate, seed, retries=2):
+    """Two cities x two weathers through run_batch with the generator's quality gate"""
+    with open(CONFIG, encoding="utf-8") as f:
+        config = json.load(f)
+    cities = config["regions"]["europe"]["cities"][:2]
+    weathers = config["weather_conditions"][:2]
+    results = []
+    with FakeComfyUIServer(latency="fixed:0.01", defect_rate=defect_rate, seed=seed) as server:
+        generator = RegionalBatchGenerator(server.url, ledger_path=None, cache_dir=None, output_dir=str(tmp_path),
+                                           quality_gate=True, gate_retries=retries)
+        generator.gate = image_quality.QualityGate()
+        jobs = [generator.build_city_job(city, weather) for city in cities for weather in weathers]
+        run_batch(generator.clients, jobs, output_dir=str(tmp_path), sample_interval=0,
+                  on_result=lambda job, success: results.append((job, success)),
+                  quality_gate=generator.check_render, defect_retries=generator.gate_retries)
+        for client in generator.clients:
+            client.close()
+    rejected = sorted(os.path.relpath(os.path.join(root, name), tmp_path)
+                      for root, _, names in os.walk(tmp_path / "rejected") for name in names)
+    return generator.gate, results, rejected
+
+
+def test_defective_renders_are_requeued_and_keep_the_first_name(tmp_path):
+    gate, results, rejected = gated_batch(tmp_path, defect_rate=0.5, seed=3)
+
+    assert all(success for _, success in results)
+    assert gate.requeued >= 1 and gate.gave_up == 0
+    requeued = [job for job, _ in results if job.get("defects")]
+    assert len(requeued) == gate.requeued
+    for job, _ in results:
+        assert os.path.basename(job["files"][0]).endswith("_00001_.png")
+    # Rejected renders keep their ComfyUI name plus the seed they were rendered with
+    assert len(rejected) == gate.requeued
+    for job in requeued:
+        stem = os.path.basename(job["filename"])
+        assert any(os.path.basename(path).startswith(f"{stem}_00001_seed") for path in rejected)
+
+
+def test_gate_gives_up_after_the_retry_limit(tmp_path):
+    gate, results, rejected = gated_batch(tmp_path, defect_rate=1.0, seed=0, retries=2)
+
+    assert [job["status"] for job, _ in results] == ["defective"] * 4
+    assert not any(success for _, success in results)
+    # First render plus two re-queues per image, each moved to rejected/ under its own seed
+    assert all(len(job["defects"]) == 3 for job, _ in results)
+    assert gate.requeued == 8 and gate.gave_up == 4
+    assert len(rejected) == 12
+    seeds = {path.rsplit("_seed", 1)[1] for path in rejected}
+    assert len(seeds) == 12
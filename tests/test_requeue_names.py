@@ -0,0 +1,17 @@
+"""File names of renders the quality gate re-queued"""
+
+from batch_pipeline import _canonical_names
+
+
+def test_replacement_render_takes_the_first_render_names(tmp_path):
+    path = tmp_path / "paris_sunny_00002_.png"
+    path.write_bytes(b"png")
+    files = [{"filename": "paris_sunny_00002_.png", "subfolder": "timezones", "path": str(path), "size": 3}]
+    canonical = [{"filename": "paris_sunny_00001_.png", "subfolder": "timezones", "type": "output"}]
+
+    renamed = _canonical_names(files, canonical)
+
+    assert renamed[0]["filename"] == "paris_sunny_00001_.png"
+    assert renamed[0]["path"] == str(tmp_path / "paris_sunny_00001_.png")
+    assert (tmp_path / "paris_sunny_00001_.png").read_bytes() == b"png"
+    assert not path.exists()
@@ -0,0 +1,50 @@
+"""Idle gap accounting of the backend utilization sampler"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from utilization_sampler import UtilizationSampler
+
+URL = "http://gpu:8000"
+
+
+def sampled(states):
+    """Sampler fed one sample per second; states are 'busy' or 'idle'"""
+    dispatcher = SimpleNamespace(backends=[SimpleNamespace(url=URL)])
+    sampler = UtilizationSampler(dispatcher, interval=1)
+    for ts, state in enumerate(states):
+        sample = {"ts": float(ts), "running": int(state == "busy"), "pending": 0,
+                  "vram_used": 0, "vram_free": 0, "vram_total": 0}
+        sampler._track_idle(URL, sample)
+        sampler.samples[URL].append(sample)
+    sampler.close_gaps()
+    return sampler
+
+
+def test_state_changes_split_the_interval_at_the_midpoint():
+    sampler = sampled(["busy", "idle", "idle", "busy", "busy"])
+    assert sampler.idle_gaps[URL] == [(0.5, 2.0)]
+    assert sampler.idle_share(URL) == pytest.approx(0.5)
+
+
+def test_idle_tail_ends_at_the_last_sample():
+    sampler = sampled(["busy", "busy", "busy", "idle"])
+    assert sampler.idle_gaps[URL] == [(2.5, 0.5)]
+    assert sampler.idle_share(URL) == pytest.approx(0.5 / 3)
+
+
+def test_busy_run_has_no_idle_time():
+    assert sampled(["busy"] * 5).idle_share(URL) == 0.0
+
+
+def test_too_few_samples_report_no_idle_share():
+    # A busy run whose only other reading is the final one after the last job
+    report = sampled(["busy", "idle"]).report()
+    assert report[0]["samples"] == 2
+    assert report[0]["idle_share"] is None
+
+
+def test_enough_samples_report_the_idle_share():
+    report = sampled(["busy", "busy", "busy", "idle"]).report()
+    assert report[0]["idle_share"] == pytest.approx(0.5 / 3)
@@ -0,0 +1,75 @@
+"""Claims, leases and results of the shared work queue"""
+
+import time
+
+import pytest
+
+from job_ledger import DONE
+from work_queue import CLAIMED, PENDING, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "work_queue.db"))
+    queue.add_plan("plan.jsonl", {"plan": 1}, [{"id": f"job{slot}", "slot": slot} for slot in range(3)])
+    yield queue
+    queue.close()
+
+
+def state_of(queue, job_id):
+    return queue._query("SELECT state, worker, lease_until FROM queue WHERE id=?", (job_id,))[0]
+
+
+def test_claims_are_exclusive(queue):
+    other = WorkQueue(queue.path)
+    try:
+        claimed = [queue.claim("a", 60), other.claim("b", 60), queue.claim("a", 60), other.claim("b", 60)]
+    finally:
+        other.close()
+
+    assert [record["id"] for record in claimed[:3]] == ["job0", "job1", "job2"]
+    assert claimed[3] is None
+    assert [state_of(queue, f"job{slot}")[1] for slot in range(3)] == ["a", "b", "a"]
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.claim("a", 0.01)
+    time.sleep(0.05)
+
+    record = queue.claim("b", 60)
+
+    assert record["id"] == "job0"
+    assert state_of(queue, "job0")[:2] == (CLAIMED, "b")
+    assert queue._query("SELECT attempts FROM queue WHERE id='job0'")[0][0] == 2
+
+
+def test_heartbeat_extends_the_lease(queue):
+    queue.claim("a", 0.5)
+    lease_until = state_of(queue, "job0")[2]
+
+    queue.heartbeat("a", 60)
+
+    assert state_of(queue, "job0")[2] > lease_until + 50
+    time.sleep(0.6)
+    assert queue.claim("b", 60)["id"] == "job1"
+
+
+def test_stale_finish_does_not_override_the_new_claim(queue):
+    queue.claim("a", 0.01)
+    time.sleep(0.05)
+    queue.claim("b", 60)
+
+    assert not queue.finish("job0", "a", False, "timeout")
+    assert state_of(queue, "job0")[:2] == (CLAIMED, "b")
+
+    assert queue.finish("job0", "b", True, seconds=1.5)
+    assert state_of(queue, "job0")[0] == DONE
+
+
+def test_release_hands_the_job_back(queue):
+    queue.claim("a", 60)
+    queue.release("job0", "b")
+    assert state_of(queue, "job0")[0] == CLAIMED
+
+    queue.release("job0", "a")
+    assert state_of(queue, "job0")[:2] == (PENDING, None)
@@ -0,0 +1,40 @@
+"""Workflow validation against /object_info for img2img inputs"""
+
+import pytest
+
+from comfyui_client import ComfyUIClient, PromptRejected
+from fake_comfyui import FakeComfyUIServer, synthetic_png
+from workflow_validation import validate_workflow
+
+IMG2IMG = {
+    "1": {"class_type": "LoadImage", "inputs": {"image": "img2img_bases/seoul_base.png"}},
+    "9": {"class_type": "SaveImage", "inputs": {"images": ["1", 0], "filename_prefix": "test/variant"}}
+}
+
+
+def test_load_image_skips_the_input_file_combo():
+    object_info = {
+        "LoadImage": {"input": {"required": {"image": [["other.png"], {"image_upload": True}]}}},
+        "SaveImage": {"input": {"required": {"images": ["IMAGE"], "filename_prefix": ["STRING", {}]}}}
+    }
+    assert validate_workflow(IMG2IMG, object_info) == []
+
+
+def test_subfolder_upload_after_object_info_is_queued(tmp_path):
+    path = tmp_path / "seoul_base.png"
+    path.write_bytes(synthetic_png(64, 48))
+    with FakeComfyUIServer(latency="fixed:0.05") as server:
+        client = ComfyUIClient(server.url, max_retries=0)
+        try:
+            object_info = client.get_object_info()
+            with pytest.raises(PromptRejected):
+                client.queue_prompt(IMG2IMG)
+
+            assert client.upload_image(str(path), subfolder="img2img_bases") == "img2img_bases/seoul_base.png"
+            client.upload_image(str(path))
+            assert validate_workflow(IMG2IMG, object_info) == []
+            assert client.get_object_info(refresh=True)["LoadImage"]["input"]["required"]["image"][0] == ["seoul_base.png"]
+            prompt_id = client.queue_prompt(IMG2IMG)
+            assert client.wait_for_completion(prompt_id, timeout=10)["status"] == "success"
+        finally:
+            client.close()
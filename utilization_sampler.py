@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Backend utilization sampling during batches
+Polls /system_stats and /queue of every backend at a fixed interval and keeps
+VRAM usage, queue counts and idle gaps (nothing running or pending on the
+server) so a slow run can be told apart: GPU-bound, starved by the client or
+reloading models
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from backend_dispatcher import Backend, BackendDispatcher
+from run_metrics import RunMetrics, format_seconds
+
+GIB = 1024 ** 3
+# Busy share of a timeline column, idle to fully busy
+TIMELINE_LEVELS = "·░▒▓█"
+# Fewer samples leave the midpoint split of each interval to decide the idle
+# share: with the final reading after the last job (always idle) a busy run
+# would look half or fully idle
+MIN_SAMPLES = 3
+
+
+def parse_system_stats(stats: Dict) -> Dict:
+    """VRAM totals in bytes summed over every device of a /system_stats payload"""
+    devices = stats.get("devices", [])
+    total = sum(device.get("vram_total", 0) for device in devices)
+    free = sum(device.get("vram_free", 0) for device in devices)
+    return {"vram_total": total, "vram_free": free, "vram_used": max(0, total - free)}
+
+
+class UtilizationSampler:
+    """Periodic /system_stats + /queue samples for every backend of a dispatcher
+
+    Samples and closed idle gaps are written to the metrics event log; the
+    latest values also go to its Prometheus textfile.
+    """
+
+    def __init__(self, dispatcher: BackendDispatcher, interval: float = 5, metrics: RunMetrics = None):
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.metrics = metrics
+        # url -> [{'ts', 'running', 'pending', 'vram_used', 'vram_free', 'vram_total'}, ...]
+        self.samples = {backend.url: [] for backend in dispatcher.backends}
+        # url -> [(start, seconds), ...] of finished idle gaps
+        self.idle_gaps = {backend.url: [] for backend in dispatcher.backends}
+        # url -> start of the idle gap still open
+        self._idle_since = {}
+        # Sampling starts with the first submitted prompt, not while the run is still preparing
+        self.started = asyncio.Event()
+
+    def job_submitted(self):
+        """Called for every submitted prompt; the first one starts the sampling"""
+        self.started.set()
+
+    async def run(self):
+        """Sample from the first submission until cancelled"""
+        await self.started.wait()
+        while True:
+            await self.sample_all()
+            await asyncio.sleep(self.interval)
+
+    async def sample_all(self):
+        await asyncio.gather(*[self.sample(backend) for backend in self.dispatcher.healthy_backends()])
+
+    async def sample(self, backend: Backend) -> Optional[Dict]:
+        try:
+            stats, queue = await asyncio.gather(
+                backend.async_client.run_blocking(backend.client.system_stats),
+                backend.async_client.run_blocking(backend.client.get_queue)
+            )
+        except Exception:
+            # The health monitor reports dead backends; a missed sample is just a gap in the timeline
+            return None
+        sample = {"ts": time.time(), "running": len(queue.get("queue_running", [])),
+                  "pending": len(queue.get("queue_pending", [])), **parse_system_stats(stats)}
+        self._track_idle(backend.url, sample)
+        self.samples[backend.url].append(sample)
+        if self.metrics is not None:
+            self.metrics.event("backend_sample", backend=backend.url, **sample)
+            self.metrics.backend_sample(backend.url, sample, self.idle_seconds(backend.url))
+        return sample
+
+    def _track_idle(self, url: str, sample: Dict):
+        """Open or close an idle gap at the midpoint between the previous sample and this one
+
+        The backend changed state somewhere in between; splitting the interval
+        at its midpoint keeps either side from getting all of it.
+        """
+        idle = sample["running"] == 0 and sample["pending"] == 0
+        previous = self.samples[url][-1] if self.samples[url] else None
+        boundary = (previous["ts"] + sample["ts"]) / 2 if previous else sample["ts"]
+        if idle and url not in self._idle_since:
+            self._idle_since[url] = boundary
+        elif not idle and url in self._idle_since:
+            self._close_gap(url, boundary)
+
+    def _close_gap(self, url: str, end: float):
+        start = self._idle_since.pop(url)
+        if end > start:
+            self.idle_gaps[url].append((start, end - start))
+            if self.metrics is not None:
+                self.metrics.event("idle_gap", backend=url, start=round(start, 3), seconds=round(end - start, 3))
+
+    def close_gaps(self):
+        """End the open idle gaps at the last sample of their backend"""
+        for url in list(self._idle_since):
+            self._close_gap(url, self.samples[url][-1]["ts"])
+
+    def idle_seconds(self, url: str) -> float:
+        closed = sum(seconds for _, seconds in self.idle_gaps[url])
+        if url in self._idle_since and self.samples[url]:
+            closed += self.samples[url][-1]["ts"] - self._idle_since[url]
+        return closed
+
+    def idle_share(self, url: str) -> float:
+        """Share of the sampled wall time with nothing running or pending on the backend"""
+        samples = self.samples[url]
+        if len(samples) < 2:
+            return 0.0
+        return min(1.0, self.idle_seconds(url) / (samples[-1]["ts"] - samples[0]["ts"]))
+
+    def timeline(self, url: str, width: int = 60) -> str:
+        """One character per time slice: share of samples with work on the server
+
+        A slice without a sample of its own repeats the previous one.
+        """
+        samples = self.samples[url]
+        if len(samples) < 2:
+            return ""
+        start, span = samples[0]["ts"], samples[-1]["ts"] - samples[0]["ts"]
+        width = min(width, len(samples))
+        columns = [[] for _ in range(width)]
+        for sample in samples:
+            index = min(width - 1, int((sample["ts"] - start) / span * width)) if span else 0
+            columns[index].append(sample["running"] + sample["pending"] > 0)
+        top = len(TIMELINE_LEVELS) - 1
+        line = ""
+        for column in columns:
+            line += TIMELINE_LEVELS[round(sum(column) / len(column) * top)] if column else line[-1]
+        return line
+
+    def report(self) -> List[Dict]:
+        rows = []
+        for url, samples in self.samples.items():
+            # Runs shorter than one interval have no timeline to show
+            if len(samples) < 2 or samples[-1]["ts"] <= samples[0]["ts"]:
+                continue
+            vram = [sample["vram_used"] for sample in samples]
+            gaps = [seconds for _, seconds in self.idle_gaps[url]]
+            conclusive = len(samples) >= MIN_SAMPLES
+            rows.append({
+                "url": url,
+                "samples": len(samples),
+                "wall_seconds": samples[-1]["ts"] - samples[0]["ts"],
+                # None: too few samples to tell idle time apart from sampling artifacts
+                "idle_share": self.idle_share(url) if conclusive else None,
+                "idle_gaps": len(gaps),
+                "longest_gap": max(gaps, default=0.0),
+                "max_pending": max(sample["pending"] for sample in samples),
+                "vram_min": min(vram),
+                "vram_max": max(vram),
+                "vram_total": samples[-1]["vram_total"],
+                "timeline": self.timeline(url)
+            })
+        return rows
+
+    def print_report(self):
+        rows = self.report()
+        if not rows:
+            return
+        print(f"\n📉 Backend timeline (every {self.interval:g}s, █ busy · idle):")
+        for row in rows:
+            if row["idle_share"] is None:
+                idle = (f"idle time inconclusive ({row['samples']} samples over "
+                        f"{format_seconds(row['wall_seconds'])}, lower --sample-interval for short runs)")
+            else:
+                idle = (f"idle {row['idle_share'] * 100:.0f}% of {format_seconds(row['wall_seconds'])} "
+                        f"({row['idle_gaps']} gaps, longest {format_seconds(row['longest_gap'])})")
+            print(f"   {row['url']}: {idle}, max {row['max_pending']} pending, VRAM {row['vram_min'] / GIB:.1f}-{row['vram_max'] / GIB:.1f}"
+                  f"/{row['vram_total'] / GIB:.0f} GiB")
+            print(f"   |{row['timeline']}|")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Shared work queue for distributed plan workers
+SQLite table of job-plan records that any number of worker processes claim
+atomically. A claim is a lease kept alive by heartbeats; jobs whose lease ran
+out (crashed or disconnected worker) are claimed again by the next worker.
+The database may live on a shared volume; it uses the rollback journal
+because WAL mode does not work across hosts.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from job_ledger import DONE, FAILED
+
+PENDING = "pending"
+CLAIMED = "claimed"
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """Job states: pending -> claimed (leased to a worker) -> done | failed
+
+    A claimed job goes back to pending when its worker releases it (stopped
+    run) or can be taken over once its lease expired.
+    """
+
+    def __init__(self, path: str = "work_queue.db", busy_timeout: float = 30):
+        self.path = path
+        # Explicit transactions (BEGIN IMMEDIATE) make claims atomic across processes
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS queue (
+                id TEXT PRIMARY KEY,
+                plan TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                claimed_at REAL,
+                finished_at REAL,
+                seconds REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS queue_state ON queue (state, lease_until)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS plans (
+                plan TEXT PRIMARY KEY,
+                header TEXT NOT NULL,
+                added_at REAL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS workers (
+                worker TEXT PRIMARY KEY,
+                servers TEXT,
+                started_at REAL,
+                heartbeat_at REAL,
+                stopped_at REAL
+            )
+        """)
+
+    def _transaction(self, statements) -> list:
+        """Run (sql, params) pairs in one BEGIN IMMEDIATE transaction; returns their cursors' rows"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                results = [self.conn.execute(sql, params).fetchall() for sql, params in statements]
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # --- plans ---
+
+    def add_plan(self, plan: str, header: Dict, records: List[Dict]) -> int:
+        """Enqueue the records of a plan; already queued IDs are kept as they are. Returns the new count"""
+        statements = [("INSERT OR REPLACE INTO plans (plan, header, added_at) VALUES (?, ?, ?)",
+                       (plan, json.dumps(header, ensure_ascii=False), time.time()))]
+        before = self.total()
+        statements += [
+            ("INSERT OR IGNORE INTO queue (id, plan, slot, record, state) VALUES (?, ?, ?, ?, ?)",
+             (record["id"], plan, record["slot"], json.dumps(record, ensure_ascii=False), PENDING))
+            for record in records
+        ]
+        self._transaction(statements)
+        return self.total() - before
+
+    def plans(self) -> Dict[str, Dict]:
+        return {plan: json.loads(header) for plan, header in self._query("SELECT plan, header FROM plans")}
+
+    def retry_failed(self) -> int:
+        rows = self._transaction([
+            ("SELECT COUNT(*) FROM queue WHERE state=?", (FAILED,)),
+            ("UPDATE queue SET state=?, worker=NULL, lease_until=NULL, error=NULL WHERE state=?", (PENDING, FAILED))
+        ])
+        return rows[0][0][0]
+
+    # --- workers ---
+
+    def register_worker(self, worker: str, servers: List[str]):
+        now = time.time()
+        self._query(
+            "INSERT INTO workers (worker, servers, started_at, heartbeat_at, stopped_at) VALUES (?, ?, ?, ?, NULL) "
+            "ON CONFLICT (worker) DO UPDATE SET servers=excluded.servers, heartbeat_at=excluded.heartbeat_at, stopped_at=NULL",
+            (worker, ",".join(servers), now, now)
+        )
+
+    def claim(self, worker: str, lease: float) -> Optional[Dict]:
+        """Atomically take the next pending (or lease-expired) job; None when nothing is claimable"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id, record, state, worker FROM queue WHERE state=? OR (state=? AND lease_until<?) "
+                    "ORDER BY rowid LIMIT 1",
+                    (PENDING, CLAIMED, now)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE queue SET state=?, worker=?, lease_until=?, attempts=attempts+1, claimed_at=?, error=NULL "
+                        "WHERE id=?",
+                        (CLAIMED, worker, now + lease, now, row[0])
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        record = json.loads(row[1])
+        if row[2] == CLAIMED:
+            print(f"♻️ Reclaimed slot {record['slot']} from {row[3]} (lease expired)")
+        return record
+
+    def heartbeat(self, worker: str, lease: float):
+        """Extend the leases of every job the worker holds"""
+        now = time.time()
+        self._transaction([
+            ("UPDATE queue SET lease_until=? WHERE worker=? AND state=?", (now + lease, worker, CLAIMED)),
+            ("UPDATE workers SET heartbeat_at=? WHERE worker=?", (now, worker))
+        ])
+
+    def finish(self, job_id: str, worker: str, success: bool, error: str = None, seconds: float = None) -> bool:
+        """Record the result of a job the worker still holds
+
+        False when the claim was lost meanwhile (lease expired and the job was
+        taken over): the result is dropped so the new holder's claim stands.
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE queue SET state=?, error=?, finished_at=?, seconds=?, lease_until=NULL "
+                "WHERE id=? AND worker=? AND state=?",
+                (DONE if success else FAILED, None if success else error, time.time(), seconds, job_id, worker, CLAIMED)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, worker: str):
+        """Hand a claimed job back (stopped before it finished)"""
+        self._query(
+            "UPDATE queue SET state=?, worker=NULL, lease_until=NULL WHERE id=? AND worker=? AND state=?",
+            (PENDING, job_id, worker, CLAIMED)
+        )
+
+    def release_worker(self, worker: str) -> int:
+        """Hand back everything the worker still holds and mark it stopped"""
+        rows = self._transaction([
+            ("SELECT COUNT(*) FROM queue WHERE worker=? AND state=?", (worker, CLAIMED)),
+            ("UPDATE queue SET state=?, worker=NULL, lease_until=NULL WHERE worker=? AND state=?",
+             (PENDING, worker, CLAIMED)),
+            ("UPDATE workers SET stopped_at=? WHERE worker=?", (time.time(), worker))
+        ])
+        return rows[0][0][0]
+
+    # --- progress ---
+
+    def total(self) -> int:
+        return self._query("SELECT COUNT(*) FROM queue")[0][0]
+
+    def counts(self) -> Dict[str, int]:
+        """Jobs per state; claimed jobs whose lease expired count as 'expired'"""
+        counts = dict(self._query("SELECT state, COUNT(*) FROM queue GROUP BY state"))
+        expired = self._query("SELECT COUNT(*) FROM queue WHERE state=? AND lease_until<?", (CLAIMED, time.time()))[0][0]
+        if expired:
+            counts[CLAIMED] -= expired
+            counts["expired"] = expired
+        return counts
+
+    def claimable(self) -> int:
+        counts = self.counts()
+        return counts.get(PENDING, 0) + counts.get("expired", 0)
+
+    def workers(self, stale_after: float) -> List[Dict]:
+        """Per worker: done/failed/claimed counts, mean seconds per image and liveness"""
+        stats = {}
+        for worker, state, count, seconds in self._query(
+                "SELECT worker, state, COUNT(*), AVG(seconds) FROM queue WHERE worker IS NOT NULL GROUP BY worker, state"):
+            row = stats.setdefault(worker, {DONE: 0, FAILED: 0, CLAIMED: 0, "avg_seconds": None})
+            row[state] = count
+            if state == DONE:
+                row["avg_seconds"] = seconds
+        now = time.time()
+        rows = []
+        for worker, servers, heartbeat_at, stopped_at in self._query(
+                "SELECT worker, servers, heartbeat_at, stopped_at FROM workers ORDER BY started_at"):
+            row = stats.get(worker, {DONE: 0, FAILED: 0, CLAIMED: 0, "avg_seconds": None})
+            if stopped_at:
+                state = "stopped"
+            elif now - (heartbeat_at or 0) > stale_after:
+                state = "lost"
+            else:
+                state = "alive"
+            rows.append({"worker": worker, "servers": servers, "state": state,
+                         "heartbeat_age": now - (heartbeat_at or now), **row})
+        return rows
+
+    def throughput(self, window: float = 900) -> float:
+        """Images per hour over all workers in the last window seconds"""
+        since = time.time() - window
+        finished = self._query("SELECT COUNT(*), MIN(finished_at) FROM queue WHERE state=? AND finished_at>=?",
+                               (DONE, since))[0]
+        if finished[0] < 2:
+            return 0.0
+        return finished[0] / max(time.time() - finished[1], 1e-6) * 3600
+
+    def close(self):
+        self.conn.close()
+
+
+class LeaseKeeper:
+    """Background heartbeats for one worker's leases"""
+
+    def __init__(self, queue_path: str, worker: str, lease: float):
+        self.queue_path = queue_path
+        self.worker = worker
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "LeaseKeeper":
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        # Own connection: SQLite connections should stay on one thread
+        queue = WorkQueue(self.queue_path)
+        try:
+            while not self._stop.wait(self.lease / 3):
+                try:
+                    queue.heartbeat(self.worker, self.lease)
+                except sqlite3.Error as e:
+                    print(f"⚠️ Heartbeat failed: {e}")
+        finally:
+            queue.close()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
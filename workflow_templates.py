@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Workflow templates shared by the generators
+API-format workflows live as JSON files in workflows/. A value "$name" in a
+template is a slot: slots named after a static group ("$models.unet",
+"$sampler.steps") are filled once when the template is compiled, the others
+(prompts, seed, size, filename) per job. A compiled template is serialized
+once in the canonical form workflow_hash uses; rendering a job only splices
+the slot values into that text.
+
+A template file holds either the full graph ("nodes") or a patch on another
+template ("extends" + "patch"): patched nodes are merged into the base node,
+null removes a node. Patch templates also work as overlays on any base
+(compile_workflow(name, overlays=[...])), so new workflow variants need a
+JSON file and a config entry, not code.
+"""
+
+import copy
+import json
+import os
+import re
+from typing import Dict, List, Tuple
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows")
+DEFAULT_TEMPLATE = "flux_krea_lora"
+
+# Fallbacks for configs without flux_krea_models
+DEFAULT_MODELS = {"unet": "flux1-krea-dev_fp8_scaled.safetensors", "clip_text": "t5xxl_fp16.safetensors",
+                  "clip_vision": "clip_l.safetensors", "vae": "ae.safetensors", "lora": "noc-lwply.safetensors",
+                  "lora_strength_model": 1.0, "lora_strength_clip": 1.0}
+
+# Fallbacks for configs without settings.flux_krea_params / image_size / quality_profiles
+DEFAULT_SAMPLER = {"steps": 35, "cfg": 1.0, "sampler": "euler", "scheduler": "simple", "denoise": 1.0,
+                   "width": 1024, "height": 1024, "output_root": ""}
+DEFAULT_PROFILES = {
+    "draft": {"steps": 12, "width": 512, "height": 512, "output_root": "drafts"},
+    "final": {}
+}
+
+SLOT = re.compile(r"^\$([a-z_][a-z0-9_]*)(?:\.([a-z_][a-z0-9_]*))?$")
+# Per-job slots are serialized as this marker and cut out of the text
+MARKER = "\x00slot:{}\x00"
+MARKER_TEXT = re.compile(r'"\\u0000slot:([a-z0-9_]+)\\u0000"')
+
+
+class TemplateError(ValueError):
+    """Missing, malformed or incompletely filled workflow template"""
+
+
+def quality_profile(config: Dict, name: str = "final") -> Dict:
+    """Sampler settings of a named quality profile
+
+    settings.flux_krea_params and settings.image_size give the full-quality
+    values; settings.quality_profiles[name] overrides them (steps, cfg,
+    sampler, scheduler, denoise, width, height, output_root). Images of a
+    profile with an output_root are saved under that folder.
+    """
+    settings = config.get('settings', {})
+    profiles = {**DEFAULT_PROFILES, **settings.get('quality_profiles', {})}
+    if name not in profiles:
+        raise ValueError(f"Unknown quality profile '{name}' (available: {', '.join(profiles)})")
+    return {**DEFAULT_SAMPLER, **settings.get('flux_krea_params', {}), **settings.get('image_size', {}),
+            **profiles[name], 'name': name}
+
+
+def workflow_models(config: Dict) -> Dict:
+    """Model files of a config (flux_krea_models over the defaults)"""
+    return {**DEFAULT_MODELS, **config.get('flux_krea_models', {})}
+
+
+def template_name(config: Dict) -> str:
+    """Template a config renders with (settings.workflow_template)"""
+    return config.get('settings', {}).get('workflow_template', DEFAULT_TEMPLATE)
+
+
+class Workflow(dict):
+    """A rendered API-format workflow; serialized holds its canonical JSON
+
+    workflow_hash and the /prompt request use serialized instead of encoding
+    the dict again, so a rendered workflow must not be modified (render a new
+    one instead). Deep copies are plain dicts.
+    """
+
+    def __init__(self, serialized: str):
+        super().__init__(json.loads(serialized))
+        self.serialized = serialized
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+
+class CompiledTemplate:
+    """A template with its static slots filled, serialized around its per-job slots"""
+
+    def __init__(self, name: str, nodes: Dict, static: Dict):
+        self.name = name
+        nodes = self._fill(nodes, static)
+        text = json.dumps(nodes, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        parts = MARKER_TEXT.split(text)
+        # Text chunks at even indices, slot names at odd ones
+        self.chunks = parts[0::2]
+        self.slots = tuple(parts[1::2])
+
+    def _fill(self, value, static: Dict):
+        if isinstance(value, dict):
+            return {key: self._fill(item, static) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._fill(item, static) for item in value]
+        match = SLOT.match(value) if isinstance(value, str) else None
+        if match is None:
+            return value
+        group, key = match.groups()
+        if group not in static:
+            if key is not None:
+                raise TemplateError(f"Template '{self.name}': no static values for ${group}.{key}")
+            return MARKER.format(group)
+        values = static[group]
+        if key is None:
+            return values
+        if key not in values:
+            raise TemplateError(f"Template '{self.name}': ${group}.{key} is not set")
+        return values[key]
+
+    def render_json(self, **values) -> str:
+        """Canonical JSON of the workflow for these slot values (extra values are ignored)"""
+        missing = [slot for slot in self.slots if slot not in values]
+        if missing:
+            raise TemplateError(f"Template '{self.name}': no value for {', '.join('$' + slot for slot in missing)}")
+        parts = [self.chunks[0]]
+        for slot, chunk in zip(self.slots, self.chunks[1:]):
+            parts.append(json.dumps(values[slot], ensure_ascii=False))
+            parts.append(chunk)
+        return "".join(parts)
+
+    def render(self, **values) -> Workflow:
+        return Workflow(self.render_json(**values))
+
+
+def _merge(base: Dict, patch: Dict) -> Dict:
+    merged = dict(base)
+    for key, value in patch.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class TemplateLibrary:
+    """Template files of a directory, each read once; compiled templates are cached per static values"""
+
+    def __init__(self, directory: str = TEMPLATES_DIR):
+        self.directory = directory
+        self._files = {}
+        self._compiled = {}
+
+    def load(self, name: str) -> Dict:
+        if name not in self._files:
+            path = os.path.join(self.directory, f"{name}.json")
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                available = sorted(file[:-5] for file in os.listdir(self.directory) if file.endswith(".json"))
+                raise TemplateError(f"Workflow template '{name}' not found (available: {', '.join(available)})")
+            except json.JSONDecodeError as e:
+                raise TemplateError(f"Invalid workflow template {path}: {e}")
+            if "nodes" not in data and not ("extends" in data and "patch" in data):
+                raise TemplateError(f"Workflow template {path} needs 'nodes' or 'extends' + 'patch'")
+            self._files[name] = data
+        return self._files[name]
+
+    def nodes(self, name: str, overlays: Tuple[str, ...] = ()) -> Dict:
+        """Full node graph of a template with the patches of overlays applied in order"""
+        data = self.load(name)
+        nodes = data["nodes"] if "nodes" in data else _merge(self.nodes(data["extends"]), data["patch"])
+        for overlay in overlays:
+            nodes = _merge(nodes, self.load(overlay).get("patch", {}))
+        return nodes
+
+    def compile(self, name: str, overlays: List[str] = (), **static) -> CompiledTemplate:
+        overlays = tuple(overlays)
+        key = (name, overlays, _freeze(static))
+        if key not in self._compiled:
+            label = "+".join((name,) + overlays)
+            self._compiled[key] = CompiledTemplate(label, self.nodes(name, overlays), static)
+        return self._compiled[key]
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+_library = None
+
+
+def compile_workflow(name: str = DEFAULT_TEMPLATE, overlays: List[str] = (), **static) -> CompiledTemplate:
+    """Compiled template from the shared library of workflows/"""
+    global _library
+    if _library is None:
+        _library = TemplateLibrary()
+    return _library.compile(name, overlays, **static)
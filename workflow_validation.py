@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Validate API-format workflows against a server's /object_info
+Catches unknown node types, missing inputs, dangling links and model or
+option names the server does not have before anything is queued
+"""
+
+from typing import Dict, List, Optional
+
+
+def combo_options(spec) -> Optional[List]:
+    """Allowed values of a combo input spec, or None for free-form inputs
+
+    Older servers list the options as the first element, newer ones use
+    ["COMBO", {"options": [...]}].
+    """
+    if not isinstance(spec, (list, tuple)) or not spec:
+        return None
+    if isinstance(spec[0], list):
+        return spec[0]
+    if spec[0] == "COMBO" and len(spec) > 1 and isinstance(spec[1], dict):
+        return spec[1].get("options")
+    return None
+
+
+def is_upload_input(class_type: str, spec) -> bool:
+    """Image inputs whose combo only lists top-level input files
+
+    ComfyUI checks these itself when the prompt is queued (files in input
+    subfolders and ones uploaded after /object_info was fetched are valid but
+    not in the list), so they are not checked against the combo here.
+    """
+    if class_type == "LoadImage":
+        return True
+    return (isinstance(spec, (list, tuple)) and len(spec) > 1
+            and isinstance(spec[1], dict) and bool(spec[1].get("image_upload")))
+
+
+def is_link(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[1], int)
+
+
+def validate_workflow(workflow: Dict, object_info: Dict) -> List[str]:
+    """Problems found in workflow; an empty list means it should queue cleanly"""
+    errors = []
+    for node_id, node in workflow.items():
+        class_type = node.get("class_type")
+        info = object_info.get(class_type)
+        if info is None:
+            errors.append(f"node {node_id}: unknown node type {class_type}")
+            continue
+
+        inputs = node.get("inputs", {})
+        required = info.get("input", {}).get("required", {})
+        optional = info.get("input", {}).get("optional", {})
+
+        for name in required:
+            if name not in inputs:
+                errors.append(f"node {node_id} {class_type}: missing input {name}")
+
+        for name, value in inputs.items():
+            if is_link(value):
+                if str(value[0]) not in workflow:
+                    errors.append(f"node {node_id} {class_type}: {name} links to missing node {value[0]}")
+                continue
+            spec = required.get(name) or optional.get(name)
+            if is_upload_input(class_type, spec):
+                continue
+            options = combo_options(spec)
+            if options is not None and value not in options:
+                errors.append(f"node {node_id} {class_type}: {name} '{value}' not available on server")
+    return errors